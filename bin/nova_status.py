@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 
+import gzip
+import json
 import logging
 import os
 import re
+import time
 from argparse import ArgumentParser
 from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 
 import novaclient
@@ -16,6 +20,11 @@ logging.basicConfig(level=logging.INFO)
 COLUMN_WIDTH = 30
 TREE = "|  "
 
+# concurrent nova.hosts.get calls
+DEFAULT_WORKERS = 8
+
+SNAPSHOT_VERSION = 1
+
 RESOURCES = ["cores", "disk", "ram"]
 
 OUTPUT_TYPES = RESOURCES + [
@@ -29,6 +38,9 @@ SUFFIXES = {"cores": "", "ram": "GB", "disk": "GB"}
 
 Service = namedtuple("Service", ["name", "flavor"])
 
+# what a snapshot keeps of a novaclient Flavor
+Flavor = namedtuple("Flavor", ["id", "name", "vcpus", "ram", "disk"])
+
 HostStats = namedtuple(
     "HostStats",
     [
@@ -46,7 +58,7 @@ HostStats = namedtuple(
 def fix_av_url(zone):
     base_av_url_str = "api-gdc-av"
     av_str = "%s%1d" % (base_av_url_str, zone)
-    parts1 = filter(None, os.environ["OS_AUTH_URL"].split("/"))
+    parts1 = [part for part in os.environ["OS_AUTH_URL"].split("/") if part]
     parts2 = parts1[1].split(".")
     for i, part in enumerate(parts2):
         if base_av_url_str in part:
@@ -87,11 +99,32 @@ def get_host_stats(nova_host, servers=None):
     )
 
 
-def parse_server_info(url, nova, options):
+def load_flavors(nova):
+    """Returns {flavor_id: Flavor} from a single list call, including
+    private flavors"""
+
+    return {flavor.id: flavor for flavor in nova.flavors.list(is_public=None)}
+
+
+def get_flavor(nova, flavors, flavor_id):
+    """Returns the flavor from `flavors`, fetching (and caching) it if it
+    isn't there, e.g. deleted flavors still used by servers
+
+    """
+
+    if flavor_id not in flavors:
+        flavors[flavor_id] = nova.flavors.get(flavor_id)
+    return flavors[flavor_id]
+
+
+def parse_server_info(url, nova, options, flavors=None):
     """Returns {'az': {'host': [Service]}}"""
 
     logging.info("Getting server info for %s", url)
 
+    if flavors is None:
+        flavors = load_flavors(nova)
+
     az_tag = url.find("av")
     az_name = url[az_tag : az_tag + 3]
     server_info = defaultdict(lambda: defaultdict(list))
@@ -99,15 +132,40 @@ def parse_server_info(url, nova, options):
     for server in nova.servers.list():
         az_name = getattr(server, "OS-EXT-AZ:availability_zone")
         host_name = getattr(server, "OS-EXT-SRV-ATTR:host", None)
-        flavor = nova.flavors.get(server.flavor["id"])
+        flavor = get_flavor(nova, flavors, server.flavor["id"])
         service = Service(server.human_id, flavor)
         server_info[az_name][host_name].append(service)
 
     return server_info
 
 
-def parse_host_info(nova, az, server_info, options):
-    """Returns a list of HostStats objects"""
+def fits_flavor(host, flavor):
+    """Whether `flavor` fits in the free resources of HostStats `host`"""
+
+    return (
+        flavor.ram < (host.total_ram - host.used_ram) * 1e3
+        and flavor.disk < (host.total_disk - host.used_disk)
+        and flavor.vcpus < (host.total_cores - host.used_cores)
+    )
+
+
+def get_nova_host(nova, host_name):
+    """Returns (host_name, nova host or None if it can't be accessed)"""
+
+    try:
+        return host_name, nova.hosts.get(host_name)
+    except Exception as e:
+        logger.error("Can't access %s: %s", host_name, e)
+        return host_name, None
+
+
+def parse_host_info(nova, az, server_info, options, executor=None, flavor=None):
+    """Returns {host_name: HostStats}
+
+    Hosts are fetched concurrently on `executor` if given, and only the
+    ones `flavor` (the `--flavor-fits` one) fits on are kept if given.
+
+    """
 
     region = az.zoneName
 
@@ -116,47 +174,265 @@ def parse_host_info(nova, az, server_info, options):
 
     logging.info("Getting host info for %s", region)
 
-    hosts = {}
-    for host_name in az.hosts:
-        try:
-            nova_host = nova.hosts.get(host_name)
-        except Exception as e:
-            logger.error("Can't access %s: %s", host_name, e)
-        else:
-            host_servers = server_info[region][host_name]
-            host = get_host_stats(nova_host, host_servers)
-
-            # Filter to hosts that can fit flavor
-            add_host = True
-            if options.get("flavor", None):
-                try:
-                    flavor = nova.flavors.get(options["flavor"])
-                except novaclient.exceptions.NotFound:
-                    add_host = False
-                else:
-                    add_host = (
-                        flavor.ram < (host.total_ram - host.used_ram) * 1e3
-                        and flavor.disk < (host.total_disk - host.used_disk)
-                        and flavor.vcpus < (host.total_cores - host.used_cores)
-                    )
+    if executor is None:
+        nova_hosts = (get_nova_host(nova, host_name) for host_name in az.hosts)
+    else:
+        nova_hosts = executor.map(lambda name: get_nova_host(nova, name), az.hosts)
 
-            if add_host:
-                hosts[host_name] = host
+    hosts = {}
+    for host_name, nova_host in nova_hosts:
+        if nova_host is None:
+            continue
+        host_servers = server_info[region][host_name]
+        host = get_host_stats(nova_host, host_servers)
+        # Filter to hosts that can fit flavor
+        if flavor is None or fits_flavor(host, flavor):
+            hosts[host_name] = host
 
     return hosts
 
 
-def parse_availability_zone(url, options):
-    with get_client(url) as nova:
-        server_info = parse_server_info(url, nova, options)
+def parse_availability_zone(url, options, nova=None):
+    """Returns {'region': {'host': HostStats}} for the availability zone
+    at `url`, connecting to it unless a `nova` client is given
+
+    """
+
+    if nova is None:
+        with get_client(url) as nova:
+            return parse_availability_zone(url, options, nova=nova)
+
+    flavors = load_flavors(nova)
+    server_info = parse_server_info(url, nova, options, flavors=flavors)
+
+    flavor = None
+    if options.get("flavor", None):
+        try:
+            flavor = get_flavor(nova, flavors, options["flavor"])
+        except novaclient.exceptions.NotFound:
+            logger.error("Flavor %s not found", options["flavor"])
+            return {az.zoneName: {} for az in nova.availability_zones.list()}
+
+    workers = options.get("workers") or DEFAULT_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as executor:
         zones = {
-            az.zoneName: parse_host_info(nova, az, server_info, options)
+            az.zoneName: parse_host_info(
+                nova, az, server_info, options, executor=executor, flavor=flavor
+            )
             for az in nova.availability_zones.list()
         }
 
     return zones
 
 
+def parse_availability_zones(urls, options):
+    """Returns {'av#': zones} for every url, queried in parallel"""
+
+    urls = list(urls)
+    with ThreadPoolExecutor(max_workers=max(len(urls), 1)) as executor:
+        zones = list(
+            executor.map(lambda url: parse_availability_zone(url, options), urls)
+        )
+
+    return {url[url.find("av") :][:3]: zone for url, zone in zip(urls, zones)}
+
+
+# ======================================================================
+# Snapshots
+
+
+def _open_snapshot(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def save_snapshot(path, availability_zones):
+    """Writes {'av#': {'region': {'host': HostStats}}} to `path` as
+    compact JSON, gzipped if `path` ends with .gz
+
+    Flavors are stored once and referenced by id from the services.
+
+    """
+
+    flavors = {}
+    zones = {}
+    for az_name, zone in availability_zones.items():
+        zones[az_name] = {}
+        for region, hosts in zone.items():
+            zones[az_name][region] = {}
+            for host_name, host in hosts.items():
+                services = []
+                for service in host.services:
+                    flavor = service.flavor
+                    flavors[flavor.id] = [
+                        getattr(flavor, "name", None),
+                        flavor.vcpus,
+                        flavor.ram,
+                        flavor.disk,
+                    ]
+                    services.append([service.name, flavor.id])
+                zones[az_name][region][host_name] = list(host[:-1]) + [services]
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "created": time.time(),
+        "fields": list(HostStats._fields),
+        "flavors": flavors,
+        "availability_zones": zones,
+    }
+    with _open_snapshot(path, "w") as snapshot_file:
+        json.dump(snapshot, snapshot_file, separators=(",", ":"))
+
+
+def load_snapshot(path):
+    """Returns the {'av#': {'region': {'host': HostStats}}} saved to
+    `path` by save_snapshot"""
+
+    with _open_snapshot(path, "r") as snapshot_file:
+        snapshot = json.load(snapshot_file)
+
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(
+            "Unsupported snapshot version {} in {}".format(
+                snapshot.get("version"), path
+            )
+        )
+
+    flavors = {
+        flavor_id: Flavor(flavor_id, *values)
+        for flavor_id, values in snapshot["flavors"].items()
+    }
+    availability_zones = {}
+    for az_name, zone in snapshot["availability_zones"].items():
+        availability_zones[az_name] = {}
+        for region, hosts in zone.items():
+            availability_zones[az_name][region] = {
+                host_name: HostStats(
+                    *values[:-1],
+                    [
+                        Service(name, flavors[flavor_id])
+                        for name, flavor_id in values[-1]
+                    ],
+                )
+                for host_name, values in hosts.items()
+            }
+
+    return availability_zones
+
+
+def select_zones(availability_zones, zones):
+    """Returns the availability zones numbered `zones` from a snapshot"""
+
+    wanted = {"av%d" % zone for zone in zones}
+    return {
+        az_name: zone
+        for az_name, zone in availability_zones.items()
+        if az_name in wanted
+    }
+
+
+HostChange = namedtuple(
+    "HostChange", ["az", "region", "host", "status", "resources", "added", "removed"]
+)
+
+
+def diff_snapshots(old, new):
+    """Returns a HostChange for every host whose resources or services
+    differ between two {'av#': {'region': {'host': HostStats}}}
+
+    `status` is 'added', 'removed' or 'changed', `resources` maps each
+    changed resource to ((old used, old total), (new used, new total))
+    and `added`/`removed` are the names of the services that appeared or
+    went away.
+
+    """
+
+    empty = HostStats(0, 0, 0, 0, 0, 0, [])
+    changes = []
+    for az_name in sorted(set(old) | set(new)):
+        old_zone, new_zone = old.get(az_name, {}), new.get(az_name, {})
+        for region in sorted(set(old_zone) | set(new_zone)):
+            old_hosts = old_zone.get(region, {})
+            new_hosts = new_zone.get(region, {})
+            for host_name in sorted(set(old_hosts) | set(new_hosts)):
+                if host_name not in new_hosts:
+                    status = "removed"
+                elif host_name not in old_hosts:
+                    status = "added"
+                else:
+                    status = "changed"
+                old_host = old_hosts.get(host_name, empty)
+                new_host = new_hosts.get(host_name, empty)
+
+                resources = {}
+                for resource in RESOURCES:
+                    usages = (
+                        get_host_usage(old_host, resource),
+                        get_host_usage(new_host, resource),
+                    )
+                    if usages[0] != usages[1]:
+                        resources[resource] = usages
+                old_services = Counter(service.name for service in old_host.services)
+                new_services = Counter(service.name for service in new_host.services)
+                added = sorted((new_services - old_services).elements())
+                removed = sorted((old_services - new_services).elements())
+
+                if status != "changed" or resources or added or removed:
+                    changes.append(
+                        HostChange(
+                            az_name,
+                            region,
+                            host_name,
+                            status,
+                            resources,
+                            added,
+                            removed,
+                        )
+                    )
+
+    return changes
+
+
+def format_host_change(change, options):
+    repr_ = f"{change.host.ljust(10)}: {change.status}"
+
+    for resource, ((old_used, _), (new_used, total)) in change.resources.items():
+        if options.get(resource, False):
+            delta = new_used - old_used
+            column = " {}: {:+g} used ({:g}/{:g} {})".format(
+                resource, delta, new_used, total, SUFFIXES[resource]
+            )
+            repr_ += column.center(COLUMN_WIDTH, " ")
+
+    if options.get("services", False):
+        for sign, names in (("+", change.added), ("-", change.removed)):
+            if names:
+                repr_ += "\n" + tree(3) + sign + " " + ", ".join(names)
+
+    return repr_
+
+
+def print_diff(changes, options):
+    """Print the HostChanges from diff_snapshots, grouped by az and
+    region"""
+
+    print()
+    location = None
+    for change in changes:
+        if options.get("region") and not re.match(options["region"], change.region):
+            continue
+        if location is None or location[0] != change.az:
+            print(tree(0) + "Availability Zone: %s" % change.az)
+        if location != (change.az, change.region):
+            print(tree(1) + f"Region: {change.region}")
+        location = (change.az, change.region)
+        print(tree(3) + format_host_change(change, options))
+    if location is None:
+        print("No changes")
+    print()
+
+
 # ======================================================================
 # Output
 
@@ -233,14 +509,14 @@ def print_region(name, hosts, options):
     print(tree(1) + f"Region: {name}")
 
     if set(options) & set(RESOURCES):
-        for host_name, host_stats in hosts.iteritems():
+        for host_name, host_stats in hosts.items():
             print(tree(3) + format_host_stats(host_name, host_stats, options))
 
     if options.get("totals", False) and hosts:
         totals = HostStats(*reduce(accum_totals, hosts.values()))
         totals_options = {option: True for option in OUTPUT_TYPES}
         totals_options.update(services=False)
-        print(format_host_stats(tree(2) + "Totals", totals, totals_options)),
+        print(format_host_stats(tree(2) + "Totals", totals, totals_options), end=" ")
         print("%3d services" % len(totals.services))
 
     if options.get("maxes", False) and hosts:
@@ -253,9 +529,9 @@ def print_availability_zones(availability_zones, options):
     """Print all the stats for an az {name: zone}"""
 
     print()
-    for az_name, zone in availability_zones.iteritems():
+    for az_name, zone in availability_zones.items():
         print(tree(0) + "Availability Zone: %s" % az_name)
-        for zone_name, hosts in zone.iteritems():
+        for zone_name, hosts in zone.items():
             print_region(zone_name, hosts, options)
     print()
 
@@ -296,8 +572,40 @@ def parse_cmd_args():
         help="Filter hosts out that flavor can't fit on",
         default=None,
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of hosts to query concurrently per availability zone",
+        type=int,
+        default=DEFAULT_WORKERS,
+    )
+    parser.add_argument(
+        "--save",
+        metavar="SNAPSHOT",
+        help="Save the collected stats to a snapshot file (.gz to compress)",
+        default=None,
+    )
+    parser.add_argument(
+        "--load",
+        metavar="SNAPSHOT",
+        help="Report from a snapshot file instead of querying nova",
+        default=None,
+    )
+    parser.add_argument(
+        "--diff",
+        metavar="SNAPSHOT",
+        help="Show the changes since an older snapshot file",
+        default=None,
+    )
     args = parser.parse_args()
 
+    if args.load and args.flavor_fits:
+        parser.error("--flavor-fits needs live data, it can't be used with --load")
+    # the filters apply while crawling, so the snapshot would only hold the
+    # filtered hosts and a later --diff would report the rest as added/removed
+    if args.save and (args.flavor_fits or args.region):
+        parser.error("--save snapshots every host, it can't be filtered")
+
     return args
 
 
@@ -308,9 +616,9 @@ def main():
 
     # figure out zone
     if args.availability_zone == "all":
-        os_urls = map(fix_av_url, [1, 2])
+        zones = [1, 2]
     else:
-        os_urls = map(fix_av_url, [int(args.availability_zone)])
+        zones = [int(args.availability_zone)]
 
     # figure out output
     if "all" in args.output or not args.output:
@@ -323,14 +631,23 @@ def main():
 
     options["region"] = args.region
     options["flavor"] = args.flavor_fits
+    options["workers"] = args.workers
 
     # Collect stats
-    availability_zones = {
-        url[url.find("av") :][:3]: parse_availability_zone(url, options)
-        for url in os_urls
-    }
+    if args.load:
+        availability_zones = select_zones(load_snapshot(args.load), zones)
+    else:
+        os_urls = [fix_av_url(zone) for zone in zones]
+        availability_zones = parse_availability_zones(os_urls, options)
+
+    if args.save:
+        save_snapshot(args.save, availability_zones)
 
-    print_availability_zones(availability_zones, options)
+    if args.diff:
+        old = select_zones(load_snapshot(args.diff), zones)
+        print_diff(diff_snapshots(old, availability_zones), options)
+    else:
+        print_availability_zones(availability_zones, options)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,34 @@
 import hashlib
+import importlib
+
+# submodules are imported on first access (PEP 562), so `import cdisutils`
+# doesn't pull in boto3, openpyxl and friends
+_SUBMODULES = frozenset(
+    [
+        "cache",
+        "checksum",
+        "dbgap",
+        "dictionary",
+        "errors",
+        "excel",
+        "log",
+        "net",
+        "parsers",
+        "psqlgraph_utils",
+        "s3io",
+        "storage3",
+    ]
+)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
 
 
 def md5sum(iterable):
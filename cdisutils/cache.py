@@ -0,0 +1,330 @@
+"""
+cdisutils.cache
+----------------------------------
+
+Local caches for data that is expensive to fetch repeatedly
+
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .log import get_logger
+
+# 10GiB
+DEFAULT_OBJECT_CACHE_SIZE = 10737418240
+
+
+class ObjectCache:
+    """
+    Opt-in, on-disk cache for object store downloads.
+
+    Entries are content addressed by url and ETag, laid out as
+    ``<directory>/<sha256 of url>/<etag>``, so a changed object never
+    collides with a stale copy.  Freshness is the caller's job (e.g. a
+    conditional GET with ``IfNoneMatch``); the cache only stores,
+    serves and evicts.
+
+    The total size is bounded by ``max_size`` bytes.  Every hit bumps
+    the entry's mtime and the least recently used entries are evicted
+    first when a new entry pushes the cache over its limit.
+    """
+
+    log = get_logger("object_cache")
+
+    def __init__(self, directory, max_size=DEFAULT_OBJECT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def _etag_name(etag):
+        return re.sub(r"[^0-9A-Za-z_-]", "", etag)
+
+    def _url_dir(self, url):
+        return os.path.join(
+            self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest()
+        )
+
+    def path(self, url, etag):
+        """Return the path an object with ``url`` and ``etag`` is cached at"""
+        return os.path.join(self._url_dir(url), self._etag_name(etag))
+
+    def get(self, url):
+        """
+        Look up the cached copy of ``url``
+
+        :returns: The cached ETag (quoted, as S3 returns it), or None
+        """
+        try:
+            names = [n for n in os.listdir(self._url_dir(url)) if n[0] != "."]
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+        return f'"{names[0]}"'
+
+    def put(self, url, etag, body, chunk_size=1048576):
+        """
+        Store the stream ``body`` as the copy of ``url`` at ``etag``,
+        replacing any other version of it.
+
+        :returns: The path of the cached file
+        """
+        url_dir = self._url_dir(url)
+        os.makedirs(url_dir, exist_ok=True)
+        path = self.path(url, etag)
+
+        # write next to the final path so the rename is atomic
+        fd, tmp_path = tempfile.mkstemp(dir=url_dir, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                shutil.copyfileobj(body, tmp_file, chunk_size)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        for name in os.listdir(url_dir):
+            if name[0] != "." and os.path.join(url_dir, name) != path:
+                self._remove(os.path.join(url_dir, name))
+
+        self.evict(keep=path)
+        return path
+
+    def open(self, url, etag):
+        """
+        Memory-map the cached copy of ``url`` at ``etag`` read-only and
+        mark it as recently used.
+        """
+        path = self.path(url, etag)
+        os.utime(path)
+        with open(path, "rb") as cached_file:
+            if os.fstat(cached_file.fileno()).st_size == 0:
+                # empty files can't be mapped
+                return b""
+            return mmap.mmap(cached_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def entries(self):
+        """Return ``(mtime, size, path)`` for every cached file"""
+        entries = []
+        for url_hash in os.listdir(self.directory):
+            url_dir = os.path.join(self.directory, url_hash)
+            if not os.path.isdir(url_dir):
+                continue
+            for name in os.listdir(url_dir):
+                if name[0] == ".":
+                    continue
+                path = os.path.join(url_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until under ``max_size``
+
+        :param keep: *optional* path of an entry that must not be evicted
+        """
+        entries = sorted(self.entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            self.log.info("Evicting %s (%d bytes)", path, size)
+            self._remove(path)
+            total_size -= size
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache whose entries expire after ``ttl``
+    seconds.
+
+    The total size of the entries is bounded by ``max_size``, measured
+    with ``sizeof`` (by default every entry counts as 1, so
+    ``max_size`` is a number of entries).  The least recently used
+    entries are evicted first.  Expired entries are only dropped by
+    that eviction, so they can still be looked up with ``stale=True``
+    (e.g. to revalidate them) until then.
+
+    Supports the dict operations the callers in this package use
+    (``in``, ``[]``, ``get``, ``pop``), so it can stand in for a plain
+    dict cache.
+    """
+
+    def __init__(self, ttl=None, max_size=None, sizeof=None, clock=time.monotonic):
+        """
+        :param ttl: *optional* Seconds an entry stays valid
+        :param max_size: *optional* Bound on the total size of the entries
+        :param sizeof: *optional* Callable returning the size of a value
+        :param clock: Time source, mostly useful for tests
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.clock = clock
+        self.size = 0
+
+        self._entries = OrderedDict()  # key -> (expires, size, value)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        now = self.clock()
+        with self._lock:
+            return sum(
+                1
+                for expires, _, _ in self._entries.values()
+                if expires is None or expires > now
+            )
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def get(self, key, default=None, stale=False):
+        """
+        Look up ``key``
+
+        :param stale:
+            Return the value even if it has expired, as long as it
+            hasn't been evicted yet, e.g. to revalidate it
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, _, value = entry
+            if stale:
+                return value
+            if expires is not None and expires <= self.clock():
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_size is not None and size > self.max_size:
+                # would evict everything else and still not fit
+                return
+            self._entries[key] = (expires, size, value)
+            self.size += size
+            while self.max_size is not None and self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self.get(key, _MISSING)
+            if key in self._entries:
+                self._remove(key)
+            return default if value is _MISSING else value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+
+class JSONDiskCache:
+    """
+    Small persistent store of JSON documents, one file per key, used to
+    share cached data between processes and across restarts.
+
+    Documents older than ``ttl`` seconds are treated as missing unless
+    explicitly asked for with ``stale=True``.
+    """
+
+    def __init__(self, directory, ttl=None):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        """Return the path the document for ``key`` is stored at"""
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def get(self, key, stale=False):
+        """
+        Load the document stored for ``key``
+
+        :param stale: Return the document even if it is older than ``ttl``
+        :returns: The document, or None
+        """
+        path = self.path(key)
+        try:
+            if not stale and self.ttl is not None:
+                if os.stat(path).st_mtime + self.ttl <= time.time():
+                    return None
+            with open(path) as cached_file:
+                return json.load(cached_file)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, document):
+        """Store ``document`` for ``key``, replacing any previous one"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".")
+        try:
+            with os.fdopen(fd, "w") as tmp_file:
+                json.dump(document, tmp_file)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def touch(self, key):
+        """
+        Mark the document for ``key`` as fresh again
+
+        :returns: Whether there was a document to touch
+        """
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+
+_MISSING = object()
@@ -0,0 +1,300 @@
+"""
+cdisutils.checksum
+----------------------------------
+
+Incremental checksums for long-running object store transfers, and
+parallel checksums of local files
+
+Run ``python -m cdisutils.checksum PATH...`` to checksum files from the
+command line.
+"""
+import hashlib
+import json
+import mmap
+import os
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+# 1GiB, the part size Boto3Manager uploads with by default
+DEFAULT_PART_SIZE = 1073741824
+# 16MiB, hashlib releases the GIL while hashing each buffer
+DEFAULT_BUFFER_SIZE = 16777216
+
+
+def multipart_etag(part_md5s):
+    """
+    Compute the ETag S3 gives an object uploaded in parts
+
+    :param part_md5s: Hex md5 digests of the parts, in order
+    :returns: The ETag, without the surrounding quotes S3 adds
+    """
+    digest = hashlib.md5(b"".join(bytes.fromhex(md5) for md5 in part_md5s))
+    return f"{digest.hexdigest()}-{len(part_md5s)}"
+
+
+def compute_etag(source, part_size=DEFAULT_PART_SIZE):
+    """
+    Compute the ETag S3 gives ``source`` once uploaded in parts of
+    ``part_size`` bytes, e.g. by ``Boto3Manager.copy_multipart_file``
+
+    :param source: bytes, or an iterable of chunks of bytes
+    :param int part_size: Size of every part but the last
+    :returns: The ETag, without the surrounding quotes S3 adds
+    """
+    state = HashState(part_size=part_size)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = [source]
+    for chunk in source:
+        state.update(chunk)
+    return state.multipart_etag()
+
+
+def etags_match(etag, other):
+    """Compare two ETags, ignoring the quotes S3 puts around them"""
+    return etag.strip('"') == other.strip('"')
+
+
+class HashState:
+    """
+    Running md5/sha256 state for a transfer that also tracks the md5 of
+    every multipart part, the pieces needed for an S3-style composite
+    ETag.
+
+    Each time a part is closed (see :meth:`end_part`) a checkpoint is
+    recorded holding the offset, the part md5 and the digests of
+    everything hashed so far.  Copies of the running hash objects are
+    kept alongside, so an interrupted read can :meth:`rewind` to the
+    last part boundary and only re-read the tail instead of the whole
+    object.
+
+    hashlib does not expose its internal state, so the full object
+    digests can only be resumed within the process that computed them.
+    The recorded checkpoints are plain dicts and can be persisted to
+    re-verify individual parts later.
+    """
+
+    def __init__(self, part_size=None):
+        """
+        :param part_size:
+            If given, parts are closed automatically every
+            ``part_size`` bytes.  Otherwise the caller is expected to
+            call :meth:`end_part` at its own part boundaries.
+        """
+        self.part_size = part_size
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.bytes_hashed = 0
+        self.checkpoints = []
+
+        self._part_md5 = hashlib.md5()
+        self._part_bytes = 0
+        # (offset, md5, sha256) copies taken at every part boundary
+        self._snapshots = [(0, self.md5.copy(), self.sha256.copy())]
+
+    @property
+    def part_md5s(self):
+        """Hex md5 digests of the closed parts, in order"""
+        return [checkpoint["part_md5"] for checkpoint in self.checkpoints]
+
+    def update(self, chunk):
+        """Hash ``chunk``, closing parts on ``part_size`` boundaries"""
+        if not self.part_size:
+            self._update(chunk)
+            return
+
+        view = memoryview(chunk)
+        while len(view):
+            take = min(len(view), self.part_size - self._part_bytes)
+            self._update(view[:take])
+            view = view[take:]
+            if self._part_bytes >= self.part_size:
+                self.end_part()
+
+    def _update(self, chunk):
+        self.md5.update(chunk)
+        self.sha256.update(chunk)
+        self._part_md5.update(chunk)
+        self._part_bytes += len(chunk)
+        self.bytes_hashed += len(chunk)
+
+    def end_part(self):
+        """Close the current part and record a checkpoint for it"""
+        checkpoint = {
+            "part_number": len(self.checkpoints) + 1,
+            "offset": self.bytes_hashed,
+            "part_size": self._part_bytes,
+            "part_md5": self._part_md5.hexdigest(),
+            "md5_sum": self.md5.hexdigest(),
+            "sha256_sum": self.sha256.hexdigest(),
+        }
+        self.checkpoints.append(checkpoint)
+        self._snapshots.append((self.bytes_hashed, self.md5.copy(), self.sha256.copy()))
+        self._part_md5 = hashlib.md5()
+        self._part_bytes = 0
+        return checkpoint
+
+    def rewind(self, offset=None):
+        """
+        Roll the state back to the last part boundary at or before
+        ``offset`` (default: the last boundary), dropping any partially
+        hashed part.
+
+        :returns: The offset the caller should resume reading from
+        """
+        if offset is None:
+            offset = self.bytes_hashed
+        while self._snapshots[-1][0] > offset:
+            self._snapshots.pop()
+            self.checkpoints.pop()
+
+        boundary, md5, sha256 = self._snapshots[-1]
+        self.md5 = md5.copy()
+        self.sha256 = sha256.copy()
+        self.bytes_hashed = boundary
+        self._part_md5 = hashlib.md5()
+        self._part_bytes = 0
+        return boundary
+
+    def multipart_etag(self):
+        """
+        The ETag of a multipart upload of everything hashed so far, with
+        the current part (if any) as the last one
+
+        :returns: The ETag, without the surrounding quotes S3 adds
+        """
+        part_md5s = self.part_md5s
+        # an empty upload still has one (empty) part
+        if self._part_bytes or not part_md5s:
+            part_md5s = part_md5s + [self._part_md5.hexdigest()]
+        return multipart_etag(part_md5s)
+
+    def hexdigests(self):
+        """Return the digests of everything hashed so far"""
+        return {
+            "md5_sum": self.md5.hexdigest(),
+            "sha256_sum": self.sha256.hexdigest(),
+        }
+
+
+def checksum_file(path, part_size=DEFAULT_PART_SIZE, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Compute the md5, sha256 and multipart ETag of a local file in one
+    pass over a read-only memory map of it
+
+    :param str path: The file to checksum
+    :param int part_size: Part size to compute the multipart ETag for
+    :param int buffer_size: Bytes handed to the hashes at a time
+    :returns: dict with path, size, md5_sum, sha256_sum, etag and
+        part_size
+    """
+    state = HashState(part_size=part_size)
+    with open(path, "rb") as data_file:
+        # empty files can't be mapped
+        if os.fstat(data_file.fileno()).st_size:
+            with mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(mapped) as view:
+                    for offset in range(0, len(view), buffer_size):
+                        state.update(view[offset : offset + buffer_size])
+
+    result = state.hexdigests()
+    result.update(
+        path=path,
+        size=state.bytes_hashed,
+        etag=state.multipart_etag(),
+        part_size=part_size,
+    )
+    return result
+
+
+def checksum_files(
+    paths,
+    max_workers=None,
+    part_size=DEFAULT_PART_SIZE,
+    buffer_size=DEFAULT_BUFFER_SIZE,
+):
+    """
+    Checksum many local files concurrently, see :func:`checksum_file`
+
+    :param paths: iterable of file paths
+    :param int max_workers:
+        *optional* Number of files hashed at once, defaults to the
+        number of CPUs
+    :returns:
+        generator of results, in the order of ``paths``. A file that
+        can't be read gives a dict with ``path`` and ``error`` instead
+    """
+
+    def checksum(path):
+        try:
+            return checksum_file(path, part_size=part_size, buffer_size=buffer_size)
+        except OSError as e:
+            return {"path": path, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        yield from executor.map(checksum, paths)
+
+
+def iter_paths(paths):
+    """Yield ``paths``, with directories replaced by the files in them"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                yield os.path.join(root, name)
+
+
+def parse_cmd_args(argv=None):
+    parser = ArgumentParser(
+        prog="python -m cdisutils.checksum",
+        description="Compute md5, sha256 and multipart ETags of local files",
+    )
+    parser.add_argument("paths", nargs="+", help="Files or directories")
+    parser.add_argument(
+        "--part-size",
+        type=int,
+        default=DEFAULT_PART_SIZE,
+        help="Multipart part size in bytes to compute ETags for",
+    )
+    parser.add_argument(
+        "--buffer-size",
+        type=int,
+        default=DEFAULT_BUFFER_SIZE,
+        help="Bytes hashed at a time",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Files hashed at once (default: CPU count)"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print one JSON object per file"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_cmd_args(argv)
+
+    failed = False
+    for result in checksum_files(
+        iter_paths(args.paths),
+        max_workers=args.workers,
+        part_size=args.part_size,
+        buffer_size=args.buffer_size,
+    ):
+        if "error" in result:
+            failed = True
+            print(f"{result['path']}: {result['error']}", file=sys.stderr)
+        elif args.json:
+            print(json.dumps(result, sort_keys=True))
+        else:
+            print("{md5_sum}  {sha256_sum}  {etag}  {size}  {path}".format(**result))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,177 @@
 """
 Defines functionality to check case existence in dbGaP.
+
+requests, xmltodict and gdcdatamodel2 are slow to import, so they're
+imported by the functions that need them rather than with this module.
 """
 
 import logging
 import re
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from xml.parsers import expat
 from xml.parsers.expat import ExpatError
 
-import requests
-import xmltodict
-from gdcdatamodel2.models import Project
-
+from .cache import JSONDiskCache, TTLCache
 from .errors import InternalError, UserError
 
+
+class TelemetryReportNotFound(InternalError):
+    """dbGaP has no telemetry report for the requested accession number"""
+
+
 PHSID_REGEX = re.compile(r"(phs\d+.v)(\d)(.*)")
 
 COMPLETE_STATE = ["released", "completed_by_gpa"]
 
+#: Seconds a telemetry report is trusted before it's pulled again
+DEFAULT_TELEMETRY_TTL = 86400
+#: Bound in bytes on the memory held by cached telemetry summaries
+DEFAULT_TELEMETRY_CACHE_SIZE = 268435456  # 256MiB
+#: Number of full parsed telemetry reports kept by :meth:`get_xml`
+DEFAULT_XML_CACHE_ENTRIES = 4
+#: Size of the chunks telemetry reports are streamed through the parser in
+TELEMETRY_CHUNK_SIZE = 65536
+#: (connect, read) timeouts in seconds of requests to dbGaP
+DEFAULT_TIMEOUT = (10, 120)
+#: Number of telemetry reports :meth:`prefetch_telemetry` pulls at once
+DEFAULT_PREFETCH_WORKERS = 8
+#: Seconds resolved projects are trusted before they're looked up again
+DEFAULT_PROJECT_TTL = 300
+#: Number of resolved projects kept
+DEFAULT_PROJECT_CACHE_ENTRIES = 4096
+#: Number of connections kept open to dbGaP
+DEFAULT_POOL_SIZE = DEFAULT_PREFETCH_WORKERS
+#: Number of times failed requests to dbGaP are retried
+DEFAULT_RETRIES = 3
+#: Statuses worth retrying, everything else is reported straight away
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+#: The parts of a project node cross referencing needs, detached from the
+#: database session
+ProjectRecord = namedtuple(
+    "ProjectRecord", ["program_name", "project_code", "accession", "bypassed_cases"]
+)
+
+#: The parts of a telemetry report cross referencing needs
+TelemetryReport = namedtuple(
+    "TelemetryReport",
+    ["accession", "registration_status", "submitter_ids", "etag", "last_modified"],
+)
+
+
+def parse_telemetry(source, etag=None, last_modified=None):
+    """Extract a :class:`TelemetryReport` from a telemetry report XML
+
+    The XML is fed through an expat parser incrementally and only the
+    study accession, its registration status and the submitter ids of
+    its samples are kept, so memory stays proportional to the number
+    of distinct ids rather than to the size of the report.
+
+    :param source:
+        The telemetry report, as str or bytes, or an iterable of chunks
+        of it, e.g. ``response.iter_content(TELEMETRY_CHUNK_SIZE)``
+    :param str etag: *optional* ETag the report was served with
+    :param str last_modified:
+        *optional* Last-Modified date the report was served with
+    :raises xml.parsers.expat.ExpatError: if the XML is malformed
+    :raises KeyError: if the report has no Study
+    """
+
+    study = {}
+    submitter_ids = set()
+    depth = [0]
+
+    def start_element(name, attrs):
+        depth[0] += 1
+        # DbGap > Study > SampleList > Sample
+        if name == "Sample" and depth[0] == 4:
+            submitter_id = attrs.get("submitted_subject_id")
+            if submitter_id is not None:
+                submitter_ids.add(sys.intern(submitter_id))
+        elif name == "Study" and depth[0] == 2:
+            study.update(attrs)
+
+    def end_element(name):
+        depth[0] -= 1
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+
+    if isinstance(source, (str, bytes)):
+        source = [source]
+    for chunk in source:
+        parser.Parse(chunk, False)
+    parser.Parse(b"", True)
+
+    return TelemetryReport(
+        accession=study["accession"],
+        registration_status=study["registration_status"],
+        submitter_ids=frozenset(submitter_ids),
+        etag=etag,
+        last_modified=last_modified,
+    )
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES):
+    """Create a :class:`requests.Session` for talking to dbGaP
+
+    :param int pool_size: Number of connections kept open per host
+    :param int retries:
+        Number of times connection errors and :data:`RETRY_STATUSES`
+        are retried, with exponential backoff
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        # hand the last response back so its status can be reported
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    for prefix in ("http://", "https://"):
+        session.mount(
+            prefix,
+            HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+            ),
+        )
+    return session
+
+
+def telemetry_size(report):
+    """Approximate memory in bytes held by a :class:`TelemetryReport`"""
+    return sys.getsizeof(report.submitter_ids) + sum(
+        sys.getsizeof(submitter_id) for submitter_id in report.submitter_ids
+    )
+
+
+def telemetry_to_record(report):
+    """Convert a :class:`TelemetryReport` to a JSON serializable dict"""
+    record = report._asdict()
+    record["submitter_ids"] = sorted(report.submitter_ids)
+    return record
+
+
+def telemetry_from_record(record):
+    """Convert a dict from :func:`telemetry_to_record` back to a
+    :class:`TelemetryReport`"""
+    return TelemetryReport(
+        accession=record["accession"],
+        registration_status=record["registration_status"],
+        submitter_ids=frozenset(record["submitter_ids"]),
+        etag=record.get("etag"),
+        last_modified=record.get("last_modified"),
+    )
+
 
 class dbGaPXReferencer:
     #: The url from which to pull telemetry reports for project with given
@@ -25,14 +181,64 @@ class dbGaPXReferencer:
         "GetSampleStatus.cgi?study_id={phsid}&rettype=xml"
     )
 
-    def __init__(self, db, logger=None, proxies={}):
-        """Instantiate a class to crossvalidate entity existence in dbGaP."""
-        self._cached_telemetry_xmls = {
-            # "phsid": "telemetry xml"
-        }
+    def __init__(
+        self,
+        db,
+        logger=None,
+        proxies={},
+        telemetry_cache=None,
+        cache_dir=None,
+        cache_ttl=DEFAULT_TELEMETRY_TTL,
+        timeout=DEFAULT_TIMEOUT,
+        session=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        retries=DEFAULT_RETRIES,
+    ):
+        """Instantiate a class to crossvalidate entity existence in dbGaP.
+
+        :param telemetry_cache:
+            *optional* :class:`TTLCache` of phsid to
+            :class:`TelemetryReport`, e.g. one shared between instances.
+            Defaults to a per-instance cache bounded by
+            :data:`DEFAULT_TELEMETRY_CACHE_SIZE` bytes
+        :param str cache_dir:
+            *optional* Directory to persist telemetry summaries in, so
+            they survive restarts and are shared between processes
+        :param int cache_ttl: Seconds cached telemetry is trusted
+        :param timeout:
+            Timeout in seconds of requests to dbGaP, or a (connect,
+            read) tuple
+        :param session:
+            *optional* :class:`requests.Session` to make requests with.
+            Defaults to one from :func:`make_session`
+        :param int pool_size: Connections kept open to dbGaP
+        :param int retries: Times failed requests are retried
+        """
+        self._cached_telemetry_xmls = TTLCache(
+            ttl=cache_ttl, max_size=DEFAULT_XML_CACHE_ENTRIES
+        )
+        if telemetry_cache is None:
+            telemetry_cache = TTLCache(
+                ttl=cache_ttl,
+                max_size=DEFAULT_TELEMETRY_CACHE_SIZE,
+                sizeof=telemetry_size,
+            )
+        self._telemetry = telemetry_cache
+        self._disk_cache = (
+            JSONDiskCache(cache_dir, ttl=cache_ttl) if cache_dir is not None else None
+        )
+        self._projects = TTLCache(
+            # "program-project": ProjectRecord
+            ttl=DEFAULT_PROJECT_TTL,
+            max_size=DEFAULT_PROJECT_CACHE_ENTRIES,
+        )
 
         self.db = db
         self.proxies = proxies
+        self.timeout = timeout
+        # one pool of connections shared by every request, including the
+        # concurrent ones from prefetch_telemetry
+        self.session = session or make_session(pool_size=pool_size, retries=retries)
         self.logger = logger or logging.getLogger("dbGapXReferencer")
         self.logger.info("Creating new dbGaP Cross Referencer")
 
@@ -58,58 +264,227 @@ class dbGaPXReferencer:
         # if current one is not released
 
         if xml["DbGap"]["Study"]["@registration_status"] not in COMPLETE_STATE:
-            current_version = xml["DbGap"]["Study"]["@accession"]
-            match = PHSID_REGEX.match(current_version)
-            if not match:
+            previous_version = self._previous_version(
+                phsid, xml["DbGap"]["Study"]["@accession"]
+            )
+            xml = self.get_xml(previous_version)
+            if xml["DbGap"]["Study"]["@registration_status"] != "released":
                 raise InternalError(
                     "Unable to cross reference cases with dbGaP. "
-                    "Invalid accession number {} in telemery report from dbGap".format(
-                        phsid
-                    )
+                    "Last two versions of telemetry reports from dbGap "
+                    "are not released"
                 )
-            else:
-                previous_version = (
-                    match.group(1) + str(int(match.group(2)) - 1) + match.group(3)
+        return xml
+
+    def request_telemetry_summary(self, phsid):
+        """Same as :meth:`request_telemetry_report`, but returns the
+        cached :class:`TelemetryReport` of the released version instead
+        of the whole parsed XML
+
+        :param str phsid: The accession number of the project
+        :raises gdcapi.errors.InternalError:
+            if neither of the last two versions is released
+        :returns: :class:`TelemetryReport`
+
+        """
+
+        report = self.get_telemetry(phsid)
+        if report.registration_status not in COMPLETE_STATE:
+            report = self.get_telemetry(self._previous_version(phsid, report.accession))
+            if report.registration_status != "released":
+                raise InternalError(
+                    "Unable to cross reference cases with dbGaP. "
+                    "Last two versions of telemetry reports from dbGap "
+                    "are not released"
                 )
-                xml = self.get_xml(previous_version)
-                if xml["DbGap"]["Study"]["@registration_status"] != "released":
-                    raise InternalError(
-                        "Unable to cross reference cases with dbGaP. "
-                        "Last two versions of telemetry reports from dbGap "
-                        "are not released"
+        return report
+
+    def prefetch_telemetry(
+        self, phsids, max_workers=DEFAULT_PREFETCH_WORKERS, speculative=True
+    ):
+        """Pull the telemetry reports of many projects concurrently,
+        populating the cache so later lookups don't hit dbGaP.
+
+        :param phsids: iterable of accession numbers
+        :param int max_workers: Number of reports pulled at once
+        :param bool speculative:
+            Also pull the previous version of every versioned phsid up
+            front, in case the current one turns out not to be released,
+            rather than in a second round trip
+        :returns:
+            dict of phsid to the :class:`TelemetryReport` that
+            :meth:`request_telemetry_summary` resolves it to. phsids
+            that couldn't be resolved are logged and left out
+
+        """
+        import requests
+
+        phsids = list(dict.fromkeys(phsids))
+        reports = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            targets = set(phsids)
+            speculative_targets = set()
+            if speculative:
+                for phsid in phsids:
+                    match = PHSID_REGEX.match(phsid)
+                    # there's no v0 to fall back to
+                    if match and int(match.group(2)) > 1:
+                        speculative_targets.add(self._previous_version(phsid, phsid))
+            speculative_targets -= targets
+            fetched = {
+                phsid: executor.submit(self.get_telemetry, phsid) for phsid in targets
+            }
+            # may well not exist, so failing is only logged at debug; the
+            # ones actually needed are pulled again below and fail loudly
+            fetched.update(
+                (phsid, executor.submit(self.get_telemetry, phsid, quiet=True))
+                for phsid in speculative_targets
+            )
+            wait(fetched.values())
+
+            # unreleased reports whose previous version wasn't fetched
+            # speculatively still fetch it here, concurrently
+            summaries = {}
+            for phsid in phsids:
+                if fetched[phsid].exception() is None:
+                    summaries[phsid] = executor.submit(
+                        self.request_telemetry_summary, phsid
+                    )
+                else:
+                    summaries[phsid] = fetched[phsid]
+            for phsid, future in summaries.items():
+                try:
+                    reports[phsid] = future.result()
+                except (InternalError, requests.RequestException) as e:
+                    self.logger.warning(
+                        "Unable to prefetch telemetry report for {}: {}".format(
+                            phsid, e
+                        )
                     )
-                return xml
-        else:
-            return xml
 
-    def get_xml(self, phsid):
-        if phsid not in self._cached_telemetry_xmls:
-            url = self.DEFAULT_URL.format(phsid=phsid)
-            self.logger.info(f"Pulling telemetry report from {url}")
-
-            # Request the XML
-            r = requests.get(url, proxies=self.proxies)
-            if r.status_code != 200:
-                msg = (
-                    "Unable to cross reference cases with dbGaP. "
-                    "Either this project is not registered in dbGaP or we "
-                    "were temporarily unable to communicate with dbGaP. "
-                    "Please try again later."
+        return reports
+
+    def _previous_version(self, phsid, current_version):
+        match = PHSID_REGEX.match(current_version)
+        if not match:
+            raise InternalError(
+                "Unable to cross reference cases with dbGaP. "
+                "Invalid accession number {} in telemery report from dbGap".format(
+                    phsid
                 )
-                self.logger.error(msg)
-                raise InternalError(msg)
+            )
+        return match.group(1) + str(int(match.group(2)) - 1) + match.group(3)
+
+    def _request_report(self, phsid, stream=False, headers=None, quiet=False):
+        url = self.DEFAULT_URL.format(phsid=phsid)
+        self.logger.info(f"Pulling telemetry report from {url}")
+
+        # Request the XML
+        r = self.session.get(
+            url,
+            proxies=self.proxies,
+            stream=stream,
+            timeout=self.timeout,
+            headers=headers,
+        )
+        if r.status_code == 304 and headers:
+            return r
+        if r.status_code != 200:
+            r.close()
+            msg = (
+                "Unable to cross reference cases with dbGaP. "
+                "Either this project is not registered in dbGaP or we "
+                "were temporarily unable to communicate with dbGaP. "
+                "Please try again later."
+            )
+            self.logger.log(logging.DEBUG if quiet else logging.ERROR, msg)
+            if r.status_code == 400:
+                raise TelemetryReportNotFound(msg)
+            raise InternalError(msg)
+        return r
+
+    def get_xml(self, phsid):
+        """Pull and parse the whole telemetry report for :param:`phsid`
+
+        Only the last few reports are kept, prefer :meth:`get_telemetry`
+        when the submitter_ids are all that's needed.
+        """
+        import xmltodict
+
+        xml = self._cached_telemetry_xmls.get(phsid)
+        if xml is None:
+            r = self._request_report(phsid)
 
             # Parse the XML
             try:
                 xml = xmltodict.parse(r.text)
-                self._cached_telemetry_xmls[phsid] = xml
-
             except ExpatError as e:
                 msg = "Unable to parse dbGaP telemetry report. Please try again later."
                 self.logger.exception(e)
                 raise InternalError(msg)
+            self._cached_telemetry_xmls[phsid] = xml
+
+        return xml
 
-        return self._cached_telemetry_xmls[phsid]
+    def get_telemetry(self, phsid, quiet=False):
+        """Get the :class:`TelemetryReport` for :param:`phsid`
+
+        Looked up in the memory cache, then the disk cache (if
+        configured), and only pulled from dbGaP when neither has a
+        fresh copy. An expired copy is revalidated with a conditional
+        GET, so an unchanged report isn't downloaded again.
+
+        :param bool quiet:
+            Log failing to pull the report at debug rather than error,
+            for reports that may legitimately not exist
+        """
+        report = self._telemetry.get(phsid)
+        if report is not None:
+            return report
+
+        stale = self._telemetry.get(phsid, stale=True)
+        if self._disk_cache:
+            record = self._disk_cache.get(phsid)
+            if record is not None:
+                report = telemetry_from_record(record)
+                self._telemetry[phsid] = report
+                return report
+            if stale is None:
+                record = self._disk_cache.get(phsid, stale=True)
+                stale = record and telemetry_from_record(record)
+
+        report = self._fetch_telemetry(phsid, stale=stale, quiet=quiet)
+        if self._disk_cache:
+            if report is not stale or not self._disk_cache.touch(phsid):
+                self._disk_cache.set(phsid, telemetry_to_record(report))
+
+        self._telemetry[phsid] = report
+        return report
+
+    def _fetch_telemetry(self, phsid, stale=None, quiet=False):
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers["If-None-Match"] = stale.etag
+            if stale.last_modified:
+                headers["If-Modified-Since"] = stale.last_modified
+
+        r = self._request_report(phsid, stream=True, headers=headers, quiet=quiet)
+        try:
+            if r.status_code == 304:
+                self.logger.info(f"Telemetry report for {phsid} is unchanged")
+                return stale
+            return parse_telemetry(
+                r.iter_content(TELEMETRY_CHUNK_SIZE),
+                etag=r.headers.get("ETag"),
+                last_modified=r.headers.get("Last-Modified"),
+            )
+        except (ExpatError, KeyError) as e:
+            msg = "Unable to parse dbGaP telemetry report. Please try again later."
+            self.logger.exception(e)
+            raise InternalError(msg)
+        finally:
+            r.close()
 
     def get_project(self, program_name, project_code):
         """Lookup the project node
@@ -120,6 +495,8 @@ class dbGaPXReferencer:
 
         """
 
+        from gdcdatamodel2.models import Project
+
         self.logger.info(f"Looking up project {program_name}-{project_code}")
 
         with self.db.session_scope():
@@ -138,6 +515,96 @@ class dbGaPXReferencer:
 
         return project
 
+    def resolve_projects(self, projects):
+        """Look up many projects at once
+
+        Every project not already in the index is loaded, together with
+        its program, by a single query, and the accession number and
+        bypassed cases are copied out of the nodes so no lazy loads
+        happen later.
+
+        :param projects: iterable of ``(program_name, project_code)``
+        :returns: dict of ``(program_name, project_code)`` to
+            :class:`ProjectRecord`
+        :raises:
+            :class:`gdcapi.errors.InternalError` if any project isn't
+            found
+
+        """
+
+        records = {}
+        missing = []
+        for program_name, project_code in dict.fromkeys(projects):
+            record = self._projects.get(f"{program_name}-{project_code}")
+            if record is None:
+                missing.append((program_name, project_code))
+            else:
+                records[(program_name, project_code)] = record
+
+        if missing:
+            for record in self._query_projects(missing):
+                key = (record.program_name, record.project_code)
+                self._projects[f"{record.program_name}-{record.project_code}"] = record
+                records[key] = record
+
+        not_found = [code for name, code in missing if (name, code) not in records]
+        if not_found:
+            msg = "Unable to find project {} in database".format(", ".join(not_found))
+            self.logger.error(msg)
+            raise InternalError(msg)
+
+        return {key: records[key] for key in dict.fromkeys(projects)}
+
+    def resolve_project(self, program_name, project_code):
+        """Look up one project, see :meth:`resolve_projects`
+
+        :returns: :class:`ProjectRecord`
+        """
+
+        return self.resolve_projects([(program_name, project_code)])[
+            (program_name, project_code)
+        ]
+
+    def _query_projects(self, projects):
+        from gdcdatamodel2.models import Program, Project
+
+        self.logger.info(
+            "Looking up projects {}".format(
+                ", ".join(f"{name}-{code}" for name, code in projects)
+            )
+        )
+        wanted = set(projects)
+
+        records = []
+        with self.db.session_scope():
+            rows = (
+                self.db.nodes(Project)
+                .prop_in("code", list({code for _, code in wanted}))
+                .path("programs")
+                .prop_in("name", list({name for name, _ in wanted}))
+                .add_entity(Program)
+                .all()
+            )
+            for project, program in rows:
+                if (program.name, project.code) not in wanted:
+                    # the IN clauses match every combination of the two
+                    continue
+                records.append(
+                    ProjectRecord(
+                        program_name=program.name,
+                        project_code=project.code,
+                        accession=(
+                            project.dbgap_accession_number
+                            or program.dbgap_accession_number
+                        ),
+                        bypassed_cases=frozenset(
+                            self.get_project_dbgap_bypassed_cases(project)
+                        ),
+                    )
+                )
+
+        return records
+
     def get_project_accession(self, project):
         """Return the project's accession number (phsid)
 
@@ -164,15 +631,12 @@ class dbGaPXReferencer:
         return project.sysan.get("dbgap_bypassed_cases") or []
 
     def get_registered_cases(self, project):
-        """Gets the submitter_id of all the cases in latest telemetry report."""
-        phsid = self.get_project_accession(project)
+        """Gets the submitter_id of all the cases in latest telemetry report.
 
-        # Pull the telemetry report for the project
-        telemetry = self.request_telemetry_report(phsid)
-
-        # Parse our the sample ids
-        samples = telemetry["DbGap"]["Study"]["SampleList"]["Sample"]
-        return {s["@submitted_subject_id"] for s in samples}
+        :returns: frozenset of submitter_id strings
+        """
+        phsid = self.get_project_accession(project)
+        return self.request_telemetry_summary(phsid).submitter_ids
 
     def case_exists(self, program_name, project_code, case_submitter_id):
         """Checks to see if case exists in latest telemetry report.
@@ -187,32 +651,95 @@ class dbGaPXReferencer:
 
         """
 
-        # Lookup the project node
-        project = self.get_project(program_name, project_code)
+        return self.cases_exist(program_name, project_code, [case_submitter_id])[
+            case_submitter_id
+        ]
+
+    def cases_exist(self, program_name, project_code, case_submitter_ids):
+        """Checks which of many cases exist in the latest telemetry report.
+
+        The project is looked up once and its registered cases are
+        built once, however many cases are checked.
+
+        :param str program_name: the `Program.name` e.g. TCGA
+        :param str project_code: the `Project.code` e.g.e BRCA
+        :param case_submitter_ids: iterable of case submitter_ids
+        :returns: dict of submitter_id to :class:`bool`
+
+        :raises:
+            :class:`gdcapi.errors.InternalError` if the project isn't
+            found
+
+        """
+
+        # Lookup the project
+        project = self.resolve_project(program_name, project_code)
         # Check against a local bypass list
-        if case_submitter_id in self.get_project_dbgap_bypassed_cases(project):
-            self.logger.warning(
-                "Found case {} in local bypass list".format(case_submitter_id)
-            )
-            return True
+        bypassed_cases = project.bypassed_cases
+
+        results = {}
+        submitter_ids = None
+        for case_submitter_id in case_submitter_ids:
+            if case_submitter_id in bypassed_cases:
+                self.logger.warning(
+                    "Found case {} in local bypass list".format(case_submitter_id)
+                )
+                results[case_submitter_id] = True
+                continue
+
+            if submitter_ids is None:
+                submitter_ids = self.request_telemetry_summary(
+                    project.accession
+                ).submitter_ids
+            results[case_submitter_id] = case_submitter_id in submitter_ids
+
+        return results
+
+    def projects_cases_exist(self, cases):
+        """Checks which cases exist across many projects at once.
+
+        :param dict cases:
+            Map of ``(program_name, project_code)`` to an iterable of
+            case submitter_ids
+        :returns:
+            dict of ``(program_name, project_code)`` to the result of
+            :meth:`cases_exist` for that project
+
+        """
 
-        submitter_ids = self.get_registered_cases(project)
-        return case_submitter_id in submitter_ids
+        cases = {key: list(ids) for key, ids in cases.items()}
+
+        # one query for every project, then the telemetry of every project
+        # with cases that aren't bypassed, all at once
+        projects = self.resolve_projects(cases)
+        accessions = {
+            projects[key].accession
+            for key, ids in cases.items()
+            if not projects[key].bypassed_cases.issuperset(ids)
+        }
+        if len(accessions) > 1:
+            self.prefetch_telemetry(accessions, speculative=False)
+
+        return {
+            (program_name, project_code): self.cases_exist(
+                program_name, project_code, case_submitter_ids
+            )
+            for (program_name, project_code), case_submitter_ids in cases.items()
+        }
 
     def assert_project_exists(self, project_code, phsid):
-        url = self.DEFAULT_URL.format(phsid=phsid)
-        self.logger.info(f"Pulling telemetry report from {url}")
+        """Check dbGaP has a telemetry report for :param:`phsid`
 
-        # Request the XML
-        r = requests.get(url, proxies=self.proxies)
-        if r.status_code == 400:
-            msg = "Project appears not to exist in dbGaP."
-            raise UserError(msg)
+        Goes through the same cache as :meth:`get_telemetry`, so the
+        report is reused by later cross referencing.
+
+        :raises gdcapi.errors.UserError: if dbGaP doesn't know the project
+        :raises gdcapi.errors.InternalError:
+            if the report can't be pulled or parsed
+        """
 
-        # Parse the XML
         try:
-            xml = xmltodict.parse(r.text)
-        except ExpatError as e:
-            msg = "Unable to parse dbGaP telemetry report. " "Please try again later."
-            self.logger.exception(e)
-            raise InternalError(msg)
+            self.get_telemetry(phsid)
+        except TelemetryReportNotFound:
+            msg = "Project appears not to exist in dbGaP."
+            raise UserError(msg)
@@ -1,41 +1,388 @@
 """
 Helper functions to work with dictionary data
+
+The tree walking functions here use an explicit stack rather than
+recursion, so documents of any depth can be processed without hitting
+the interpreter's recursion limit.
 """
 
+import hashlib
+from collections import deque, namedtuple
+
+#: Size in bytes of the digests :func:`fingerprint` combines
+DIGEST_SIZE = 16
+
+#: One difference found by :func:`iter_diff`: ``op`` is "add", "remove"
+#: or "change", ``path`` the tuple of keys and list indices leading to
+#: the value, ``old``/``new`` the value in each tree (None when absent)
+Change = namedtuple("Change", ["op", "path", "old", "new"])
+
+
+def _key_set(remove_keys):
+    """Turn ``remove_keys`` into a frozenset once, for O(1) lookups"""
+    if not remove_keys:
+        return frozenset()
+    if isinstance(remove_keys, frozenset):
+        return remove_keys
+    return frozenset(remove_keys)
+
+
+def _copy_node(node, remove_keys):
+    if isinstance(node, dict):
+        return {key: value for key, value in node.items() if key not in remove_keys}
+    return node[:]
+
+
+def _rebuild(tree, remove_keys, sort_lists):
+    """Copy every dict and list of ``tree`` without ``remove_keys``,
+    sorting the lists if ``sort_lists``"""
+    if not isinstance(tree, (dict, list)):
+        return tree
+
+    # every node is copied shallowly, then its containers are replaced
+    # by their own copies as the stack reaches them
+    result = _copy_node(tree, remove_keys)
+    # (copy, whether its children have been copied)
+    stack = [(result, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            node.sort()
+            continue
+        if isinstance(node, dict):
+            items = node.items()
+        else:
+            if sort_lists:
+                # sorted once all its elements have been copied
+                stack.append((node, True))
+            items = enumerate(node)
+        for key, value in items:
+            if isinstance(value, (dict, list)):
+                # replacing values doesn't resize, so iterating is safe
+                node[key] = child = _copy_node(value, remove_keys)
+                stack.append((child, False))
+    return result
+
+
+def _update_in_place(tree, remove_keys, sort_lists):
+    """Delete ``remove_keys`` from every dict of ``tree`` and sort its
+    lists if ``sort_lists``, without copying anything"""
+    if not isinstance(tree, (dict, list)):
+        return tree
+
+    # (node, whether its children have been visited)
+    stack = [(tree, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            node.sort()
+            continue
+        if isinstance(node, dict):
+            for key in [key for key in node if key in remove_keys]:
+                del node[key]
+            values = node.values()
+        else:
+            if sort_lists:
+                # sorted once all its elements have been updated
+                stack.append((node, True))
+            values = node
+        stack.extend(
+            (value, False) for value in values if isinstance(value, (dict, list))
+        )
+    return tree
+
+
+def sort_dict(tree, remove_keys=None, in_place=False):
+    """
+    Sorts the lists of a dictionary tree and removes some keys
 
-def sort_dict(tree, remove_keys=None):
+    :param tree: The dict, list or value to sort
+    :param remove_keys: *optional* Iterable of keys to drop from every dict
+    :param bool in_place:
+        Update ``tree`` itself instead of returning a sorted copy
+    :returns: The sorted tree
+    :raises TypeError: if a list holds elements that can't be compared
     """
-    Recursively sorts dictionary tree and removes some keys
+    remove_keys = _key_set(remove_keys)
+    if in_place:
+        return _update_in_place(tree, remove_keys, sort_lists=True)
+    return _rebuild(tree, remove_keys, sort_lists=True)
+
+
+def remove_keys_from_dict(tree, remove_keys, in_place=False):
     """
-    if remove_keys is None:
-        remove_keys = []
+    Remove keys from every dict of a dictionary tree
 
-    if isinstance(tree, dict):
-        return {
-            key: sort_dict(tree[key], remove_keys=remove_keys)
-            for key in tree
-            if key not in remove_keys
-        }
-    elif isinstance(tree, list):
-        return sorted(sort_dict(element, remove_keys=remove_keys) for element in tree)
-    else:
+    :param tree: The dict, list or value to remove keys from
+    :param remove_keys: Iterable of keys to remove
+    :param bool in_place:
+        Update ``tree`` itself instead of returning a copy
+    :returns: The tree without ``remove_keys``, ``tree`` itself if there
+        is nothing to remove
+    """
+    remove_keys = _key_set(remove_keys)
+    if not remove_keys:
         return tree
+    if in_place:
+        return _update_in_place(tree, remove_keys, sort_lists=False)
+    return _rebuild(tree, remove_keys, sort_lists=False)
+
+
+def _hash(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def _encode(value):
+    # the type is part of the encoding, so 1, 1.0, True and "1" all differ
+    if isinstance(value, str):
+        return b"s" + value.encode("utf-8", "surrogatepass")
+    if isinstance(value, bytes):
+        return b"y" + value
+    return type(value).__name__.encode() + b":" + repr(value).encode()
+
+
+def _scalar_digest(value):
+    return _hash(b"v" + _encode(value))
+
+
+class _DigestFrame:
+    """A container whose digest is being computed"""
+
+    __slots__ = ("node", "is_dict", "children", "parts", "key")
+
+    def __init__(self, node, remove_keys):
+        self.node = node
+        self.is_dict = isinstance(node, dict)
+        if self.is_dict:
+            self.children = iter(
+                [(key, value) for key, value in node.items() if key not in remove_keys]
+            )
+        else:
+            self.children = iter([(None, element) for element in node])
+        self.parts = []
+        self.key = None
+
+    def add_scalar(self, key, value):
+        if self.is_dict:
+            # one hash per entry, of the key and the value together
+            key = _encode(key)
+            self.parts.append(_hash(b"%d:" % len(key) + key + b"v" + _encode(value)))
+        else:
+            self.parts.append(_scalar_digest(value))
+
+    def add_digest(self, key, digest):
+        if self.is_dict:
+            key = _encode(key)
+            self.parts.append(_hash(b"%d:" % len(key) + key + b"c" + digest))
+        else:
+            self.parts.append(digest)
+
+    def digest(self):
+        # sorting the child digests makes the digest independent of key
+        # and element order without sorting the children themselves
+        self.parts.sort()
+        return _hash((b"d" if self.is_dict else b"l") + b"".join(self.parts))
 
 
-def remove_keys_from_dict(tree, remove_keys):
+def _digest(tree, remove_keys, memo=None):
+    """Digest of ``tree``, see :func:`fingerprint`
+
+    :param dict memo:
+        *optional* Filled with ``id(container) -> digest`` for every
+        container in ``tree``, and used to skip ones already in it
     """
-    Recursively remove keys from dictionary tree
+    if not isinstance(tree, (dict, list)):
+        return _scalar_digest(tree)
+    if memo is not None and id(tree) in memo:
+        return memo[id(tree)]
+
+    stack = [_DigestFrame(tree, remove_keys)]
+    while True:
+        frame = stack[-1]
+        for key, value in frame.children:
+            if not isinstance(value, (dict, list)):
+                frame.add_scalar(key, value)
+            elif memo is not None and id(value) in memo:
+                frame.add_digest(key, memo[id(value)])
+            else:
+                # finish the child first, then resume this frame
+                frame.key = key
+                stack.append(_DigestFrame(value, remove_keys))
+                break
+        else:
+            stack.pop()
+            digest = frame.digest()
+            if memo is not None:
+                memo[id(frame.node)] = digest
+            if not stack:
+                return digest
+            stack[-1].add_digest(stack[-1].key, digest)
+
+
+def fingerprint(tree, remove_keys=None):
     """
-    if remove_keys is None or remove_keys == []:
-        return tree
+    Compute a stable structural hash of a dictionary tree
 
-    if isinstance(tree, dict):
-        return {
-            key: remove_keys_from_dict(tree[key], remove_keys)
-            for key in tree
-            if key not in remove_keys
-        }
-    elif isinstance(tree, list):
-        return [remove_keys_from_dict(element, remove_keys) for element in tree]
-    else:
-        return tree
+    Two trees have the same fingerprint when they are equal ignoring
+    ``remove_keys``, the order of dict keys and the order of list
+    elements, i.e. when their :func:`sort_dict` copies would compare
+    equal, but no sorted copy is built and lists of dicts work too.
+    Scalars of different types (``1``, ``1.0``, ``"1"``) are different.
+
+    :param tree: The dict, list or value to hash
+    :param remove_keys: *optional* Iterable of keys to ignore in every dict
+    :returns: Hex digest string
+    """
+    return _digest(tree, _key_set(remove_keys)).hex()
+
+
+def first_difference(a, b, remove_keys=None):
+    """
+    Find where two dictionary trees first differ, stopping as soon as a
+    difference is found
+
+    Trees are compared with the same rules as :func:`fingerprint`.
+    Lists are compared as multisets, by digest, so a differing list is
+    reported as a whole.
+
+    :param a: First tree
+    :param b: Second tree
+    :param remove_keys: *optional* Iterable of keys to ignore in every dict
+    :returns:
+        Tuple of the keys leading to the first difference (``()`` for
+        the roots), or None if the trees are equivalent
+    """
+    remove_keys = _key_set(remove_keys)
+    stack = [((), a, b)]
+    while stack:
+        path, a, b = stack.pop()
+        if type(a) is not type(b):
+            return path
+        if isinstance(a, dict):
+            a_keys = [key for key in a if key not in remove_keys]
+            if len(a_keys) != len(b.keys() - remove_keys):
+                return path
+            for key in reversed(a_keys):
+                if key not in b:
+                    return path + (key,)
+                stack.append((path + (key,), a[key], b[key]))
+        elif isinstance(a, list):
+            if len(a) != len(b):
+                return path
+            if not remove_keys and a == b:
+                # same order, so compare pairwise instead of hashing; only
+                # the scalar types (1 == 1.0) are left to check
+                stack.extend((path, x, y) for x, y in zip(a, b))
+                continue
+            a_digests = sorted(_digest(element, remove_keys) for element in a)
+            b_digests = sorted(_digest(element, remove_keys) for element in b)
+            if a_digests != b_digests:
+                return path
+        elif a != b:
+            return path
+    return None
+
+
+def iter_diff(a, b, remove_keys=None):
+    """
+    Generate the differences between two dictionary trees
+
+    Trees are compared with the same rules as :func:`fingerprint`.
+    Dicts are walked key by key. List elements are matched up by digest,
+    memoized per subtree so nothing is hashed twice, and elements with a
+    match on the other side are skipped without being walked.
+    Differences are generated as they're found, so a caller can stop
+    early.
+
+    Lists are compared as multisets: elements with a match on the other
+    side are ignored whatever their position, unmatched dicts (and
+    lists) are paired up in order and diffed against each other, with
+    paths indexing into ``a``, and the rest are reported as removed
+    (indexed in ``a``) or added (indexed in ``b``).
+
+    :param a: Old tree
+    :param b: New tree
+    :param remove_keys: *optional* Iterable of keys to ignore in every dict
+    :returns: generator of :class:`Change`
+    """
+    remove_keys = _key_set(remove_keys)
+    # digests by id(), so each tree needs its own
+    a_memo, b_memo = {}, {}
+
+    # holds both (path, a, b) to compare and Changes to emit in order
+    stack = [((), a, b)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, Change):
+            yield item
+            continue
+
+        path, a, b = item
+        if a is b:
+            continue
+        if type(a) is not type(b) or not isinstance(a, (dict, list)):
+            if type(a) is not type(b) or a != b:
+                yield Change("change", path, a, b)
+            continue
+        if isinstance(a, dict):
+            items = [
+                (path + (key,), a[key], b[key])
+                if key in b
+                else Change("remove", path + (key,), a[key], None)
+                for key in a
+                if key not in remove_keys
+            ]
+            items.extend(
+                Change("add", path + (key,), None, b[key])
+                for key in b
+                if key not in a and key not in remove_keys
+            )
+        else:
+            # lists need digests to match their elements up; dicts are
+            # cheaper to walk directly than to hash first
+            items = _diff_lists(path, a, b, remove_keys, a_memo, b_memo)
+        stack.extend(reversed(items))
+
+
+def _diff_lists(path, a, b, remove_keys, a_memo, b_memo):
+    available = {}
+    for j, element in enumerate(b):
+        available.setdefault(_digest(element, remove_keys, b_memo), deque()).append(j)
+
+    a_unmatched = []
+    for i, element in enumerate(a):
+        matches = available.get(_digest(element, remove_keys, a_memo))
+        if matches:
+            matches.popleft()
+        else:
+            a_unmatched.append(i)
+    b_unmatched = set(j for matches in available.values() for j in matches)
+
+    # pair up the unmatched containers of each type in order, and diff
+    # them, so a changed element is reported as changes inside it
+    pending = {dict: deque(), list: deque()}
+    for j in sorted(b_unmatched):
+        if type(b[j]) in pending:
+            pending[type(b[j])].append(j)
+
+    items = []
+    for i in a_unmatched:
+        candidates = pending.get(type(a[i]))
+        if candidates:
+            j = candidates.popleft()
+            b_unmatched.discard(j)
+            items.append((path + (i,), a[i], b[j]))
+        else:
+            items.append(Change("remove", path + (i,), a[i], None))
+    items.extend(Change("add", path + (j,), None, b[j]) for j in sorted(b_unmatched))
+    return items
+
+
+def diff_trees(a, b, remove_keys=None):
+    """
+    List the differences between two dictionary trees, see
+    :func:`iter_diff`
+
+    :returns: list of :class:`Change`, empty if the trees are equivalent
+    """
+    return list(iter_diff(a, b, remove_keys=remove_keys))
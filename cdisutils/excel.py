@@ -1,8 +1,12 @@
-from io import BytesIO
+import logging
+import mmap
+import multiprocessing
+import operator
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import urlparse
 
-import openpyxl
-
 from cdisutils.log import get_logger
 
 log = get_logger("excel")
@@ -41,6 +45,15 @@ def read_headers(rows, num_headers=1):
     Return:
         list: List of combined headers
     """
+    return read_header_values(
+        ([cell.value for cell in row] for row in rows), num_headers
+    )
+
+
+def read_header_values(rows, num_headers=1):
+    """Same as :func:`read_headers`, for rows of cell values, e.g. from
+    `ws.iter_rows(values_only=True)`
+    """
     header = None
     headers = []
     if num_headers > 2:
@@ -50,8 +63,9 @@ def read_headers(rows, num_headers=1):
     for row in rows:
         if num_headers > 0:
             header_data = []
-            for cell in row:
-                header_data.append(cell.value.strip() if cell.value.strip() else None)
+            for value in row:
+                value = value.strip() if isinstance(value, str) else value
+                header_data.append(value if value else None)
             headers.append(header_data)
             num_headers -= 1
         if num_headers == 0:
@@ -63,6 +77,13 @@ def read_headers(rows, num_headers=1):
     return header
 
 
+_cell_value = operator.attrgetter("value")
+
+
+def _is_read_only(ws):
+    return getattr(ws.parent, "read_only", False)
+
+
 def read_columns(ws, num_headers=1):
     """Read an XLSX spreadsheet and return column values
 
@@ -75,13 +96,19 @@ def read_columns(ws, num_headers=1):
             column header name and the value being the list of column values
     """
     sheet_data = {}
-    rows = ws.rows
-    header = read_headers(rows, num_headers)
+    if _is_read_only(ws):
+        rows = ws.iter_rows(values_only=True)
+    else:
+        # see iter_sheet
+        rows = (map(_cell_value, row) for row in ws.iter_rows())
+    header = read_header_values(rows, num_headers)
     if header is None:
         return sheet_data
+
     for row in rows:
-        for h, cell in zip(header, row):
-            value = cell.value.strip() if isinstance(cell.value, str) else cell.value
+        for h, value in zip(header, row):
+            if isinstance(value, str):
+                value = value.strip()
             if h not in sheet_data:
                 sheet_data[h] = [value]
             elif value:
@@ -90,6 +117,83 @@ def read_columns(ws, num_headers=1):
     return sheet_data
 
 
+def _log_rows(ws):
+    # max_row is a pass over every cell of a regular worksheet, so it's only
+    # worth working out if it's logged
+    if log.isEnabledFor(logging.INFO):
+        log.info(f"{ws.max_row} rows in sheet")
+
+
+def _has_data(row):
+    """Whether any cell of a row of values has a non-blank value"""
+    # stops at the first one, usually the first cell
+    for value in row:
+        if value.strip() if isinstance(value, str) else value:
+            return True
+    return False
+
+
+def iter_sheet_values(ws=None, num_headers=1):
+    """Read the header of a worksheet and lazily iterate its data rows
+
+    Cells are read with `iter_rows(values_only=True)`, so no Cell objects
+    are touched.
+
+    Args:
+        ws (openpyxl.worksheet.worksheet.Worksheet): Worksheet to read from
+        num_headers (int): Number of headers in the worksheet. NOTE: maximum
+            allowed number of headers is `2`
+
+    Return:
+        tuple: `(header, rows)`, `rows` being a generator of tuples of
+            stripped string values, one per non-blank row
+    """
+    _log_rows(ws)
+    rows = ws.iter_rows(values_only=True)
+    header = read_header_values(rows, num_headers)
+    # NOTE: header rows will already be processed, remaining is just data
+    return header, (
+        tuple([str(value).strip() for value in row]) for row in rows if _has_data(row)
+    )
+
+
+def iter_sheet(ws=None, num_headers=1):
+    """Lazily read an XLSX spreadsheet, yielding one dict per row
+
+    Each row is checked for data up to its first non-blank cell and turned
+    into a dict in a single pass. Read-only worksheets are read with
+    `iter_rows(values_only=True)`, which skips building a cell per value
+    parsed from the sheet; regular worksheets already hold their cells, and
+    there `values_only` would only add a generator per row on top of them.
+
+    Args:
+        ws (openpyxl.worksheet.worksheet.Worksheet): Worksheet to read from,
+            works with both regular and read-only worksheets
+        num_headers (int): Number of headers in the worksheet. NOTE: maximum
+            allowed number of headers is `2`
+
+    Yields:
+        dict: The next non-blank row, see :func:`read_sheet`
+    """
+    _log_rows(ws)
+    if _is_read_only(ws):
+        rows = ws.iter_rows(values_only=True)
+        header = read_header_values(rows, num_headers)
+        for row in rows:
+            if _has_data(row):
+                yield dict(zip(header, [str(value).strip() for value in row]))
+        return
+
+    rows = ws.iter_rows()
+    header = read_headers(rows, num_headers)
+    for row in rows:
+        for cell in row:
+            value = cell.value
+            if value.strip() if isinstance(value, str) else value:
+                yield dict(zip(header, [str(cell.value).strip() for cell in row]))
+                break
+
+
 def read_sheet(ws=None, num_headers=1):
     """Read an XLSX spreadsheet and return a list of rows
 
@@ -112,65 +216,262 @@ def read_sheet(ws=None, num_headers=1):
                 }
             ]
     """
-    sheet_data = []
-    log.info(f"{ws.max_row} rows in sheet")
-    # NOTE: Saving the generator object in a variable, because accessing the
-    # 'rows' property will always return a fresh generator
-    rows = ws.rows
-    header = read_headers(rows, num_headers)
+    return list(iter_sheet(ws=ws, num_headers=num_headers))
 
-    for row in rows:
-        # NOTE: header rows will already be processed, remaining is just data
-        # try and strip any blank rows
-        any_data = False
-        for cell in row:
-            if cell.value and len(str(cell.value).strip()):
-                any_data = True
-                break
 
-        if any_data:
-            line_data = dict(zip(header, [str(cell.value).strip() for cell in row]))
-            sheet_data.append(line_data)
-
-    return sheet_data
+def open_workbook(source, key_name=""):
+    """Open a workbook read-only, so cells are streamed from `source` as
+    they are iterated instead of all being loaded into memory
 
+    Args:
+        source (file): Seekable file-like object with the workbook
+        key_name (str): Name of the file, used to pick the fallback mode
 
-def load_spreadsheet_from_s3(boto_man=None, uri=None, sheet_names=None, num_headers=1):
-    downloading = True
-    total_transfer = 0
-    data = None
-    file_data = bytearray()
-    chunk_size = 16777216
-    urlparts = urlparse(uri)
-    s3_loc = urlparts.netloc.split(".")[0]
-    bucket = urlparts.path.split("/")[1]
-    key_name = urlparts.path.split("/")[-1]
-
-    # This is a bit tricky here. openpyxl likes a file, so we're
-    # tricking it a bit by loading the data first, because we want to
-    # stream from S3.
-    data = boto_man.load_file(uri=uri)
-    file_data.extend(data)
+    Return:
+        openpyxl.Workbook: The read-only workbook
+    """
+    # imported here, so loading the module stays cheap
+    import openpyxl
 
     try:
-        wb = openpyxl.load_workbook(filename=BytesIO(file_data))
+        wb = openpyxl.load_workbook(filename=source, read_only=True)
     except Exception as e:
         print(f"Hmm, something wrong: {e}")
+        source.seek(0)
         if key_name.endswith("xls"):
             print("Loading as xlsx")
-            wb = openpyxl.load_workbook(filename=BytesIO(file_data), data_only=False)
+            wb = openpyxl.load_workbook(
+                filename=source, read_only=True, data_only=False
+            )
         else:
             print("Loading as xls")
-            wb = openpyxl.load_workbook(filename=BytesIO(file_data), data_only=True)
-    else:
-        pass
-    ws = None
-    data = {}
-    for name in wb.sheetnames:
+            wb = openpyxl.load_workbook(filename=source, read_only=True, data_only=True)
+    return wb
+
+
+def match_sheets(sheetnames, sheet_names):
+    """Match requested sheet names against the sheets of a workbook
+
+    Args:
+        sheetnames (list): Names of the sheets in the workbook
+        sheet_names (list): Requested names, matching any sheet whose name
+            contains them. If several sheets match, the last one wins.
+
+    Return:
+        dict: `{sheet_name: workbook sheet name}` for every matched name
+    """
+    matches = {}
+    for name in sheetnames:
         for sheet_name in sheet_names:
             if sheet_name in name:
                 log.info("Found sheet: %s" % name)
-                ws = wb[name]
-                data[sheet_name] = read_sheet(ws=ws, num_headers=num_headers)
+                matches[sheet_name] = name
+    return matches
+
+
+def _cached_path(boto_man, uri):
+    """Refresh the manager's cached copy of `uri` and return its path
+
+    Args:
+        boto_man (cdisutils.storage3.Boto3Manager): Manager with a cache
+        uri (str): s3://host/bucket/key url of the workbook
+
+    Return:
+        str: Path of the cached copy, to be read in place
+    """
+    mapped = boto_man.load_bytes(url=uri)
+    if isinstance(mapped, mmap.mmap):
+        mapped.close()
+    etag = boto_man.cache.get(uri)
+    if etag is None:
+        raise Exception("Unable to get {}".format(uri))
+    return boto_man.cache.path(uri, etag)
+
+
+def _read_sheet_from_file(path, name, num_headers, key_name):
+    with open(path, "rb") as source:
+        wb = open_workbook(source, key_name)
+        try:
+            return read_sheet(ws=wb[name], num_headers=num_headers)
+        finally:
+            wb.close()
+
+
+def read_sheets_from_file(path, sheets, num_headers=1, processes=None, key_name=""):
+    """Parse several sheets of a workbook on disk concurrently
+
+    Parsing is CPU bound, so each sheet is read in its own worker process,
+    every worker opening the workbook read-only from `path`.
+
+    Args:
+        path (str): Path of the workbook
+        sheets (dict): `{sheet_name: workbook sheet name}`, as returned by
+            :func:`match_sheets`
+        num_headers (int): Number of headers in each sheet
+        processes (int): Number of worker processes, defaults to the
+            number of CPUs
+
+    Return:
+        dict: `{sheet_name: rows}`, see :func:`read_sheet`
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        futures = {
+            sheet_name: executor.submit(
+                _read_sheet_from_file, path, name, num_headers, key_name
+            )
+            for sheet_name, name in sheets.items()
+        }
+        return {sheet_name: future.result() for sheet_name, future in futures.items()}
+
+
+def _read_matched_sheets(path, sheet_names, num_headers, processes, key_name):
+    with open(path, "rb") as source:
+        wb = open_workbook(source, key_name)
+        try:
+            sheets = match_sheets(wb.sheetnames, sheet_names)
+        finally:
+            wb.close()
+
+    return read_sheets_from_file(path, sheets, num_headers, processes, key_name)
+
+
+def _load_spreadsheet_in_processes(boto_man, uri, sheet_names, num_headers, processes):
+    key_name = urlparse(uri).path.split("/")[-1]
+    if boto_man.cache is not None:
+        # the workers read the cached copy in place
+        return _read_matched_sheets(
+            _cached_path(boto_man, uri), sheet_names, num_headers, processes, key_name
+        )
+
+    with tempfile.NamedTemporaryFile(suffix=".xlsx") as tmp_file:
+        shutil.copyfileobj(boto_man.get_url(uri)["Body"], tmp_file)
+        tmp_file.flush()
+
+        return _read_matched_sheets(
+            tmp_file.name, sheet_names, num_headers, processes, key_name
+        )
+
 
-    return data
+class _SharedWorkbook:
+    """A workbook and its source, closed once all `users` are done with it"""
+
+    def __init__(self, wb, source, users):
+        self.wb = wb
+        self.source = source
+        self.users = users
+
+    def release(self):
+        self.users -= 1
+        if self.users == 0:
+            try:
+                self.wb.close()
+            finally:
+                self.source.close()
+
+
+class _SheetRows:
+    """Rows of one sheet of a lazily loaded workbook
+
+    Releases the workbook once the rows are exhausted, fail, are closed or
+    the iterator is garbage collected, whichever comes first.
+    """
+
+    def __init__(self, rows, workbook):
+        self._rows = rows
+        self._workbook = workbook
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._rows is None:
+            raise StopIteration
+        try:
+            return next(self._rows)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._rows is None:
+            return
+        rows, self._rows = self._rows, None
+        try:
+            rows.close()
+        finally:
+            self._workbook.release()
+
+    def __del__(self):
+        self.close()
+
+
+def load_spreadsheet_from_s3(
+    boto_man=None,
+    uri=None,
+    sheet_names=None,
+    num_headers=1,
+    lazy=False,
+    processes=None,
+):
+    """Load the sheets matching `sheet_names` from a workbook in S3
+
+    The workbook is opened read-only straight from a seekable S3 reader,
+    or from the manager's local cache if it has one, so only the parts of
+    the file that are needed are downloaded and cells are never all held
+    in memory at once.
+
+    Args:
+        boto_man (cdisutils.storage3.Boto3Manager): Manager to read with
+        uri (str): s3://host/bucket/key url of the workbook
+        sheet_names (list): Sheets whose name contains any of these are read
+        num_headers (int): Number of headers in each sheet
+        lazy (bool): Return row iterators (see :func:`iter_sheet`) instead
+            of lists. The workbook and its source stay open until every
+            iterator is exhausted or closed (`rows.close()`).
+        processes (int): If more than 1, parse the matched sheets
+            concurrently in that many processes from the cached copy, or
+            from a temporary file the workbook is downloaded to without a
+            cache, see :func:`read_sheets_from_file`
+
+    Return:
+        dict: `{sheet_name: rows}` for every matched sheet name
+    """
+    if processes and processes > 1:
+        if lazy:
+            raise ValueError("Sheets parsed in processes can't be lazy")
+        return _load_spreadsheet_in_processes(
+            boto_man, uri, sheet_names, num_headers, processes
+        )
+
+    key_name = urlparse(uri).path.split("/")[-1]
+
+    if boto_man.cache is not None:
+        source = open(_cached_path(boto_man, uri), "rb")
+    else:
+        source = boto_man.open_for_read(uri)
+
+    try:
+        wb = open_workbook(source, key_name)
+        sheets = match_sheets(wb.sheetnames, sheet_names)
+    except Exception:
+        source.close()
+        raise
+
+    if lazy and sheets:
+        workbook = _SharedWorkbook(wb, source, len(sheets))
+        return {
+            sheet_name: _SheetRows(
+                iter_sheet(ws=wb[name], num_headers=num_headers), workbook
+            )
+            for sheet_name, name in sheets.items()
+        }
+
+    try:
+        return {
+            sheet_name: list(iter_sheet(ws=wb[name], num_headers=num_headers))
+            for sheet_name, name in sheets.items()
+        }
+    finally:
+        wb.close()
+        source.close()
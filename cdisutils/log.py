@@ -1,33 +1,337 @@
-"""Opinionated basic logging setup."""
+"""Opinionated basic logging setup.
 
+By default every logger writes to stdout synchronously. Call
+:func:`start_queue_logging` to hand records to a bounded queue instead,
+written out by a background thread, so a slow stdout (e.g. a log
+collector applying back-pressure) can't stall the threads that log.
+
+Named events with fields (:func:`log_event`) can be written as one JSON
+document per line and sampled per event, see :func:`configure_logging`.
+"""
+
+import atexit
+import json
 import logging
+import queue
 import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 
 LOGGERS = {}
 
+TEXT_FORMAT = "[%(asctime)s][%(name)10s][%(levelname)7s] %(message)s"
+
+#: Records the queue holds before the drop policy kicks in
+DEFAULT_QUEUE_SIZE = 10000
+
+#: What to do with a record when the queue is full: "new" drops it,
+#: "oldest" drops the oldest queued record to make room for it
+DROP_POLICIES = ("new", "oldest")
+
+# the handler get_logger attached to each cached logger, by name
+_handlers = {}
+# the active QueueListener and the handler feeding it, if any
+_listener = None
+_queue_handler = None
+# set by configure_logging
+_formatter = None
+_sampling = None
+_lock = threading.RLock()
+
+
+class EventMessage:
+    """
+    Log message for a named event with fields, formatted only if the
+    record is actually written.
+
+    Field values that are callables are called at that point, so
+    expensive fields cost nothing when the record is filtered out.
+    """
+
+    __slots__ = ("event", "_fields", "_resolved")
+
+    def __init__(self, event, fields):
+        self.event = event
+        self._fields = fields
+        self._resolved = None
+
+    @property
+    def fields(self):
+        if self._resolved is None:
+            self._resolved = {
+                key: value() if callable(value) else value
+                for key, value in self._fields.items()
+            }
+        return self._resolved
+
+    def __str__(self):
+        return " ".join(
+            [self.event] + [f"{key}={value}" for key, value in self.fields.items()]
+        )
+
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """
+    Log the event ``event`` with ``fields`` (numbers where possible, so
+    they can be aggregated), without building a message unless it is
+    written
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, EventMessage(event, fields))
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats each record as a single line JSON document: ``timestamp``
+    (seconds since the epoch), ``level``, ``logger`` and either
+    ``message`` or, for :func:`log_event` records, ``event`` and its
+    fields.
+    """
+
+    def format(self, record):
+        if isinstance(record.msg, EventMessage):
+            document = dict(record.msg.fields)
+            document["event"] = record.msg.event
+            for attr in ("sample_every", "suppressed"):
+                if hasattr(record, attr):
+                    document[attr] = getattr(record, attr)
+        else:
+            document = {"message": record.getMessage()}
+        document.update(
+            timestamp=record.created, level=record.levelname, logger=record.name
+        )
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            document["exc_info"] = record.exc_text
+        return json.dumps(document, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thins out high-frequency :func:`log_event` events; other records
+    always pass.
+
+    Kept records note how they were sampled, so counts can be scaled
+    back up: ``sample_every`` for events kept one in N, ``suppressed``
+    for the events dropped since the last one kept by ``min_interval``.
+    """
+
+    def __init__(self, sample_every=None, min_interval=None, clock=time.monotonic):
+        """
+        :param dict sample_every:
+            *optional* Event name to N, keep only every Nth such event
+        :param dict min_interval:
+            *optional* Event name to seconds, keep at most one such
+            event per interval
+        :param clock: Time source, mostly useful for tests
+        """
+        super().__init__()
+        self.sample_every = sample_every or {}
+        self.min_interval = min_interval or {}
+        self.clock = clock
+        self._counts = {}
+        self._last = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not isinstance(record.msg, EventMessage):
+            return True
+        event = record.msg.event
+        every = self.sample_every.get(event)
+        interval = self.min_interval.get(event)
+        if every is None and interval is None:
+            return True
+
+        with self._lock:
+            if every is not None:
+                count = self._counts.get(event, 0)
+                self._counts[event] = count + 1
+                if count % every:
+                    return False
+                record.sample_every = every
+            if interval is not None:
+                now = self.clock()
+                last = self._last.get(event)
+                if last is not None and now - last < interval:
+                    self._suppressed[event] = self._suppressed.get(event, 0) + 1
+                    return False
+                self._last[event] = now
+                record.suppressed = self._suppressed.pop(event, 0)
+        return True
+
 
 def get_handler():
     """Return a stdout stream handler"""
     handler = logging.StreamHandler(sys.stdout)
-    formatter = logging.Formatter(
-        "[%(asctime)s][%(name)10s][%(levelname)7s] %(message)s"
-    )
-    handler.setFormatter(formatter)
+    handler.setFormatter(_formatter or logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def _logger_handler():
+    """The handler for a get_logger logger: the shared queue handler if
+    queue logging is running, a filtered stdout handler otherwise"""
+    if _queue_handler is not None:
+        return _queue_handler
+    handler = get_handler()
+    if _sampling is not None:
+        handler.addFilter(_sampling)
     return handler
 
 
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks: when the bounded queue is full a
+    record is dropped according to ``drop_policy`` and counted in
+    ``dropped``.
+    """
+
+    def __init__(self, log_queue, drop_policy="new"):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(
+                f"drop_policy must be one of {DROP_POLICIES}, not {drop_policy!r}"
+            )
+        super().__init__(log_queue)
+        self.drop_policy = drop_policy
+        self.dropped = 0
+
+    def prepare(self, record):
+        if isinstance(record.msg, EventMessage) and not record.exc_info:
+            # left for the listener's formatter, which may want the fields
+            return record
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if self.drop_policy == "oldest":
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                # another thread took the free slot
+                pass
+            else:
+                self.dropped += 1
+                return
+        self.dropped += 1
+
+
+def _set_handler(name, logger, handler):
+    old = _handlers.get(name)
+    if old is not None:
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    _handlers[name] = handler
+
+
+def start_queue_logging(queue_size=DEFAULT_QUEUE_SIZE, drop_policy="new"):
+    """
+    Route the loggers from :func:`get_logger` through a bounded queue
+    written to stdout by a background thread, including the ones already
+    created.
+
+    :param int queue_size: Records the queue holds before dropping
+    :param str drop_policy: One of :data:`DROP_POLICIES`
+    :returns: The :class:`DroppingQueueHandler` the loggers now use
+    """
+    global _listener, _queue_handler
+
+    with _lock:
+        if _listener is not None:
+            stop_queue_logging()
+        log_queue = queue.Queue(maxsize=queue_size)
+        _queue_handler = DroppingQueueHandler(log_queue, drop_policy=drop_policy)
+        if _sampling is not None:
+            # sampled out before they're queued
+            _queue_handler.addFilter(_sampling)
+        _listener = QueueListener(log_queue, get_handler())
+        _listener.start()
+        # only the loggers get_logger set up itself
+        for name in _handlers:
+            _set_handler(name, LOGGERS[name], _queue_handler)
+        return _queue_handler
+
+
+def stop_queue_logging():
+    """
+    Write out the queued records, stop the background thread and go back
+    to logging to stdout directly. Does nothing if queue logging isn't
+    running.
+    """
+    global _listener, _queue_handler
+
+    with _lock:
+        if _listener is None:
+            return
+        listener, _listener, _queue_handler = _listener, None, None
+        for name in _handlers:
+            _set_handler(name, LOGGERS[name], _logger_handler())
+        listener.stop()
+
+
+atexit.register(stop_queue_logging)
+
+
+def configure_logging(structured=False, sample_every=None, min_interval=None):
+    """
+    Choose how the loggers from :func:`get_logger` write records,
+    including the ones already created
+
+    :param bool structured:
+        Write JSON documents (:class:`JSONFormatter`) instead of text
+    :param dict sample_every:
+        *optional* Event name to N, see :class:`SamplingFilter`
+    :param dict min_interval:
+        *optional* Event name to seconds, see :class:`SamplingFilter`
+    """
+    global _formatter, _sampling
+
+    with _lock:
+        _formatter = JSONFormatter() if structured else None
+        if sample_every or min_interval:
+            _sampling = SamplingFilter(sample_every, min_interval)
+        else:
+            _sampling = None
+
+        if _queue_handler is not None:
+            # restarted with the new formatter and filter
+            start_queue_logging(
+                queue_size=_queue_handler.queue.maxsize,
+                drop_policy=_queue_handler.drop_policy,
+            )
+        else:
+            for name in _handlers:
+                _set_handler(name, LOGGERS[name], _logger_handler())
+
+
 def get_logger(name):
     """Return an opinionated basic logger named `name` that logs to
     stdout."""
-    if LOGGERS.get(name):
-        return LOGGERS.get(name)
-    else:
+    logger = LOGGERS.get(name)
+    if logger is not None:
+        return logger
+
+    with _lock:
+        if name in LOGGERS:
+            return LOGGERS[name]
         logger = logging.getLogger(name)
         logger.setLevel(logging.INFO)
         if not (
             len(logger.handlers) > 0
-            and type(logger.handlers[0]) == logging.StreamHandler
+            and type(logger.handlers[0])
+            in (logging.StreamHandler, DroppingQueueHandler)
         ):
-            logger.addHandler(get_handler())
+            _set_handler(name, logger, _logger_handler())
             logger.propagate = False
+        LOGGERS[name] = logger
     return logger
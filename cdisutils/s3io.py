@@ -0,0 +1,298 @@
+"""
+cdisutils.s3io
+----------------------------------
+
+File-like objects backed by object store requests
+
+"""
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .checksum import HashState
+from .log import get_logger
+
+DEFAULT_BLOCK_SIZE = 1048576  # 1MiB
+DEFAULT_CACHE_BLOCKS = 64
+DEFAULT_MAX_READAHEAD = 16
+
+
+class S3Writer(io.RawIOBase):
+    """
+    A writable file-like object backed by a multipart upload.
+
+    Written data is buffered into parts of ``part_size`` bytes and each
+    full part is uploaded in a background thread while the caller keeps
+    writing.  At most ``max_concurrency`` parts are in flight at once,
+    after which :meth:`write` blocks, so memory stays bounded by roughly
+    ``part_size * (max_concurrency + 1)``.
+
+    md5/sha256 are computed as data is written.  :meth:`close` uploads
+    the last part and completes the upload, after which :attr:`result`
+    holds the checksums and the expected ETag.  Leaving a ``with`` block
+    with an exception, or dropping the writer without closing it, aborts
+    the upload instead.
+    """
+
+    log = get_logger("s3_writer")
+
+    def __init__(self, conn, bucket, key, part_size, max_concurrency=2):
+        """
+        :param conn: A boto3 s3 client
+        :param str bucket: Destination bucket
+        :param str key: Destination key
+        :param int part_size: Size of every part but the last
+        :param int max_concurrency: Number of parts uploaded at once
+        """
+        super().__init__()
+        self.conn = conn
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.hash_state = HashState(part_size=part_size)
+        self.result = None
+
+        self._buffer = bytearray()
+        self._part_number = 0
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+        self.upload_id = self.conn.create_multipart_upload(Bucket=bucket, Key=key)[
+            "UploadId"
+        ]
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        """Buffer ``data``, uploading every part that fills up"""
+        self._checkClosed()
+        self._raise_failed_uploads()
+
+        self.hash_state.update(data)
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[: self.part_size])
+            del self._buffer[: self.part_size]
+            self._upload_part(part)
+
+        return len(data)
+
+    def _upload_part(self, part):
+        # blocks while max_concurrency parts are already in flight
+        self._slots.acquire()
+        self._part_number += 1
+        try:
+            future = self._executor.submit(self._send_part, self._part_number, part)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _send_part(self, part_number, part):
+        result = self.conn.upload_part(
+            Body=part,
+            Bucket=self.bucket,
+            Key=self.key,
+            PartNumber=part_number,
+            UploadId=self.upload_id,
+        )
+        return {"ETag": result["ETag"], "PartNumber": part_number}
+
+    def _raise_failed_uploads(self):
+        for future in self._futures:
+            if future.done() and future.exception():
+                raise future.exception()
+
+    def close(self):
+        """Upload the last part and complete the multipart upload"""
+        if self.closed:
+            return
+        try:
+            if self._buffer or not self._futures:
+                self.hash_state.end_part()
+                self._upload_part(bytes(self._buffer))
+                self._buffer = bytearray()
+            parts = [future.result() for future in self._futures]
+            self.conn.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                MultipartUpload={"Parts": parts},
+                UploadId=self.upload_id,
+            )
+        except BaseException:
+            self.abort()
+            raise
+
+        self._executor.shutdown()
+        self.result = self.hash_state.hexdigests()
+        self.result["bytes_transferred"] = self.hash_state.bytes_hashed
+        self.result["etag"] = self.hash_state.multipart_etag()
+        self.log.info(
+            "Upload of %s/%s complete, md5 = %s, %d bytes transferred",
+            self.bucket,
+            self.key,
+            self.result["md5_sum"],
+            self.result["bytes_transferred"],
+        )
+        super().close()
+
+    def abort(self):
+        """Abort the multipart upload, discarding everything written"""
+        if self.closed:
+            return
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown()
+        self.log.warning("Aborting upload of %s/%s", self.bucket, self.key)
+        self.conn.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+        )
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def __del__(self):
+        # IOBase would close(), publishing whatever was written so far
+        if hasattr(self, "upload_id"):
+            self.abort()
+
+
+class S3Reader(io.RawIOBase):
+    """
+    A seekable, read-only file-like object over an object, backed by
+    ranged GETs.
+
+    The object is read in blocks of ``block_size`` bytes, kept in an
+    LRU cache of ``cache_blocks`` blocks.  When reads run sequentially
+    each miss fetches more blocks at once, doubling up to
+    ``max_readahead`` blocks per request, while random access only
+    fetches the blocks it touches.  This lets libraries like
+    ``zipfile`` or ``openpyxl`` read a few KB out of a huge object
+    without downloading all of it.
+
+    Ranged reads are pinned to the ETag seen on open (``IfMatch``), so
+    an object overwritten mid-read fails loudly instead of returning a
+    mix of old and new data.
+    """
+
+    def __init__(
+        self,
+        conn,
+        bucket,
+        key,
+        block_size=DEFAULT_BLOCK_SIZE,
+        cache_blocks=DEFAULT_CACHE_BLOCKS,
+        max_readahead=DEFAULT_MAX_READAHEAD,
+    ):
+        """
+        :param conn: A boto3 s3 client
+        :param str bucket: Source bucket
+        :param str key: Source key
+        :param int block_size: Size of the cached blocks
+        :param int cache_blocks: Number of blocks kept in memory
+        :param int max_readahead: Most blocks fetched by one request
+        """
+        super().__init__()
+        self.conn = conn
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.max_readahead = max_readahead
+        # readahead is pointless if it gets evicted before it's read
+        self.cache_blocks = max(cache_blocks, max_readahead)
+        self.bytes_fetched = 0
+
+        head = self.conn.head_object(Bucket=bucket, Key=key)
+        self.size = head["ContentLength"]
+        self.etag = head["ETag"]
+
+        self._position = 0
+        self._blocks = OrderedDict()
+        self._readahead = 1
+        self._next_fetch = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self._position = position
+        return self._position
+
+    def readinto(self, buffer):
+        """Read up to ``len(buffer)`` bytes into ``buffer``"""
+        self._checkClosed()
+        view = memoryview(buffer).cast("B")
+        end = min(self._position + len(view), self.size)
+        written = 0
+        while self._position < end:
+            index, block_offset = divmod(self._position, self.block_size)
+            block = self._get_block(index)
+            count = min(len(block) - block_offset, end - self._position)
+            view[written : written + count] = block[block_offset : block_offset + count]
+            written += count
+            self._position += count
+        return written
+
+    def readall(self):
+        result = bytearray(max(self.size - self._position, 0))
+        self.readinto(result)
+        return bytes(result)
+
+    def _get_block(self, index):
+        if index in self._blocks:
+            self._blocks.move_to_end(index)
+            return self._blocks[index]
+
+        if index == self._next_fetch:
+            self._readahead = min(self._readahead * 2, self.max_readahead)
+        else:
+            self._readahead = 1
+        last_index = (self.size - 1) // self.block_size
+        count = min(self._readahead, last_index - index + 1)
+        self._fetch_blocks(index, count)
+        self._next_fetch = index + count
+        return self._blocks[index]
+
+    def _fetch_blocks(self, index, count):
+        start = index * self.block_size
+        end = min(start + count * self.block_size, self.size) - 1
+        data = self.conn.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f"bytes={start}-{end}",
+            IfMatch=self.etag,
+        )["Body"].read()
+        self.bytes_fetched += len(data)
+
+        for i in range(count):
+            self._blocks[index + i] = data[
+                i * self.block_size : (i + 1) * self.block_size
+            ]
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
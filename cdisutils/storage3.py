@@ -5,24 +5,30 @@ cdisutils.storage3
 Utilities for working with object stores using boto3
 
 """
-import hashlib
+import ctypes
 import io
 import json
+import logging
+import mmap
+import multiprocessing
 import os
 import re
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, wait
 from urllib.parse import urlparse
 
-import boto3
-import urllib3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 
-from .log import get_logger
-
-# NOTE: These are to disable the cert mismatch for our object stores
-# should we ever fix that, we should remove these
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from .checksum import HashState, etags_match
+from .log import get_logger, log_event
+from .s3io import (
+    DEFAULT_BLOCK_SIZE,
+    DEFAULT_CACHE_BLOCKS,
+    DEFAULT_MAX_READAHEAD,
+    S3Reader,
+    S3Writer,
+)
 
 # magic number here for multipart chunk size, change with care
 DEFAULT_MP_CHUNK_SIZE = 1073741824  # 1GiB
@@ -30,9 +36,14 @@ DEFAULT_MP_CHUNK_SIZE = 1073741824  # 1GiB
 # 16 MiB is used because it was tested for performance, if
 # speed issues are seen, this is a good value to try and
 # tweak. Probably good to keep it powers of 2, and an
-# even interval of the mp_chunk_size above
+# even interval of the mp_chunk_size above. Re-run the test with
+# `python -m tests.benchmarks.bench_storage3 --chunk-sizes ...`
 DEFAULT_DOWNLOAD_CHUNK_SIZE = 16777216  # 16MiB
 
+# how many times a broken read is resumed from the last part boundary
+# before giving up on a transfer
+MAX_READ_RETRIES = 10
+
 
 def get_nearest_file_size(size):
     """
@@ -59,6 +70,13 @@ def get_nearest_file_size(size):
     return value
 
 
+def transfer_rate(transferred_bytes, seconds):
+    """Bytes per second, rounded, or None if no time has passed"""
+    if not seconds:
+        return None
+    return round(transferred_bytes / seconds)
+
+
 def print_running_status(
     transferred_bytes=None, start_time=None, total_size=None, msg_id=0
 ):
@@ -155,7 +173,14 @@ class Boto3Manager:
 
     log = get_logger("boto3_manager")
 
-    def __init__(self, config=None, lazy=False, host_aliases=None, stream_status=False):
+    def __init__(
+        self,
+        config=None,
+        lazy=False,
+        host_aliases=None,
+        stream_status=False,
+        cache=None,
+    ):
         """
         Config map should be a map from hostname to args, e.g.:
         {
@@ -171,6 +196,11 @@ class Boto3Manager:
             A *REGEX* map from names that match the regex to hostnames
             provided in config
             e.g. ``{'aws.accessor1.mirror': 'cleversafe.service.consul'}``
+        :param cache:
+            *optional* A :class:`~cdisutils.cache.ObjectCache` used by
+            :meth:`load_file`, :meth:`load_bytes` and
+            :meth:`parse_data_file` to avoid re-downloading unchanged
+            objects
         """
 
         if config:
@@ -214,6 +244,7 @@ class Boto3Manager:
             },
         }
         self.stream_status = stream_status
+        self.cache = cache
 
         self.mp_chunk_size = DEFAULT_MP_CHUNK_SIZE
         self.chunk_size = DEFAULT_DOWNLOAD_CHUNK_SIZE
@@ -234,7 +265,7 @@ class Boto3Manager:
             self.log.warning("matched multiple aliases: %s", matches)
 
         if matches:
-            self.log.info("using matched aliases: %s", matches.keys)
+            self.log.debug("using matched aliases: %s", list(matches))
             return next(iter(matches.values()))
         else:
             return host
@@ -250,6 +281,15 @@ class Boto3Manager:
 
     def new_connection_to(self, host):
         """Connect to a given host"""
+        # boto3 is slow to import, so it's only loaded once a connection
+        # is actually made
+        import boto3
+        import urllib3
+
+        # NOTE: These are to disable the cert mismatch for our object stores
+        # should we ever fix that, we should remove these
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
         if "https" not in host:
             s3_url = f"https://{host}"
         else:
@@ -260,13 +300,12 @@ class Boto3Manager:
         if "ceph" in s3_url:
             cur_dict["config"] = boto3.session.Config(signature_version="s3")
         if cur_dict.get("verify") == "false":
-            print("Skipping verify")
+            self.log.warning("Skipping certificate verification for %s", host)
             cur_dict.pop("verify")
             conn = boto3.client(
                 "s3", "us-east-1", endpoint_url=s3_url, verify=False, **cur_dict
             )
         else:
-            print("No verify found, using dict")
             conn = boto3.client("s3", "us-east-1", endpoint_url=s3_url, **cur_dict)
 
         return conn
@@ -284,19 +323,31 @@ class Boto3Manager:
 
         return s3_info
 
-    def get_url(self, url):
+    def get_url(self, url, **kwargs):
         """
         Parse an s3://host/bucket/key formatted url and return the
         corresponding boto Key object.
+
+        Extra keyword arguments (e.g. ``Range``) are passed through to
+        ``get_object``.
         """
         parsed_url = self.parse_url(url=url)
         if not url.lower().startswith("s3"):
             raise RuntimeError("%s is not an s3 url" % url)
         key = self.get_connection(parsed_url["s3_loc"]).get_object(
-            Bucket=parsed_url["bucket_name"], Key=parsed_url["key_name"]
+            Bucket=parsed_url["bucket_name"], Key=parsed_url["key_name"], **kwargs
         )
         return key
 
+    def get_url_from(self, url, offset=0):
+        """
+        Like :meth:`get_url`, but starting the object body at byte
+        ``offset``.  Used to resume a broken read.
+        """
+        if offset:
+            return self.get_url(url=url, Range=f"bytes={offset}-")
+        return self.get_url(url=url)
+
     def head_url(self, url):
         """
         Parse an s3://host/bucket/key formatted url and return the
@@ -315,6 +366,84 @@ class Boto3Manager:
 
         return key
 
+    def verify_etag(self, url, etag):
+        """
+        Check the object at ``url`` has the ETag ``etag`` with a single
+        HEAD request, instead of reading it back.
+
+        The expected ETag of a copy is in the result of
+        :meth:`copy_multipart_file`, or can be computed from local data
+        with :func:`cdisutils.checksum.compute_etag`.
+
+        :returns: True if the ETags match, False if they don't or the
+            object can't be found
+        """
+        head = self.head_url(url)
+        if head is None:
+            return False
+        if not etags_match(head["ETag"], etag):
+            self.log.warning(
+                "ETag mismatch for %s: expected %s, found %s", url, etag, head["ETag"]
+            )
+            return False
+        return True
+
+    def open_for_read(
+        self,
+        url,
+        block_size=DEFAULT_BLOCK_SIZE,
+        cache_blocks=DEFAULT_CACHE_BLOCKS,
+        max_readahead=DEFAULT_MAX_READAHEAD,
+    ):
+        """
+        Open an s3://host/bucket/key formatted url for random access,
+        returning a seekable :class:`~cdisutils.s3io.S3Reader` that
+        only downloads the blocks that are actually read.
+
+        .. code-block:: python
+
+            with manager.open_for_read(url) as reader:
+                names = zipfile.ZipFile(reader).namelist()
+        """
+        parsed_url = self.parse_url(url=url)
+        if not url.lower().startswith("s3"):
+            raise RuntimeError("%s is not an s3 url" % url)
+        return S3Reader(
+            self.get_connection(parsed_url["s3_loc"]),
+            parsed_url["bucket_name"],
+            parsed_url["key_name"],
+            block_size=block_size,
+            cache_blocks=cache_blocks,
+            max_readahead=max_readahead,
+        )
+
+    def open_for_write(self, url, part_size=None, max_concurrency=2):
+        """
+        Open an s3://host/bucket/key formatted url for writing, returning
+        a :class:`~cdisutils.s3io.S3Writer` that streams what is written
+        to the object as a multipart upload.
+
+        .. code-block:: python
+
+            with manager.open_for_write(url) as writer:
+                for block in generate_output():
+                    writer.write(block)
+            md5 = writer.result["md5_sum"]
+
+        :param part_size: *optional* Defaults to :attr:`mp_chunk_size`
+        :param max_concurrency: Number of parts uploaded at once
+        """
+        parsed_url = self.parse_url(url=url)
+        if not url.lower().startswith("s3"):
+            raise RuntimeError("%s is not an s3 url" % url)
+        return S3Writer(
+            self.get_connection(parsed_url["s3_loc"]),
+            parsed_url["bucket_name"],
+            parsed_url["key_name"],
+            part_size=part_size or self.mp_chunk_size,
+            max_concurrency=max_concurrency,
+        )
+
     def list_buckets(self, host=None):
         """List all buckets available for a given host"""
         bucket_list = []
@@ -345,8 +474,7 @@ class Boto3Manager:
         multipart_info["chunk_index"] = 1
         multipart_info["total_size"] = 0
         multipart_info["manifest"] = {"Parts": []}
-        multipart_info["md5_sum"] = hashlib.md5()
-        multipart_info["sha256_sum"] = hashlib.sha256()
+        multipart_info["hash_state"] = HashState()
         multipart_info["start_time"] = time.perf_counter()
         mp_info = self.conns[
             multipart_info["dst_info"]["s3_loc"]
@@ -383,6 +511,7 @@ class Boto3Manager:
         """Uploads a multipart chunk of an object"""
 
         mp_info["stream_buffer"].seek(0)
+        start_time = time.perf_counter()
         try:
             result = self.conns[mp_info["dst_info"]["s3_loc"]].upload_part(
                 Body=mp_info["stream_buffer"],
@@ -397,6 +526,14 @@ class Boto3Manager:
                 % (mp_info["cur_size"], mp_info["dst_info"]["url"], exception)
             )
         else:
+            log_event(
+                self.log,
+                "part_uploaded",
+                url=mp_info["dst_info"]["url"],
+                part_number=mp_info["chunk_index"],
+                bytes=mp_info["cur_size"],
+                seconds=round(time.perf_counter() - start_time, 3),
+            )
             mp_info["cur_size"] = 0
             mp_info["stream_buffer"].close()
             mp_info["stream_buffer"] = io.BytesIO()
@@ -406,17 +543,39 @@ class Boto3Manager:
             }
             mp_info["manifest"]["Parts"].append(mp_info_part)
             mp_info["chunk_index"] += 1
+            mp_info["hash_state"].end_part()
+
+    def rewind_multipart_chunk(self, mp_info):
+        """
+        Drop the part currently being buffered after a broken read and
+        rewind the hash state to the last uploaded part, returning the
+        source offset to resume reading from
+        """
+        mp_info["stream_buffer"].close()
+        mp_info["stream_buffer"] = io.BytesIO()
+        mp_info["cur_size"] = 0
+        mp_info["total_size"] = mp_info["hash_state"].rewind()
+        return mp_info["total_size"]
 
     def download_object_part(self, key):
         """Downloads a chunk of an object"""
         return key.read(amt=self.chunk_size)
 
     def copy_multipart_file(
-        self, src_info=None, dst_info=None, stream_status=True, msg_id=0
+        self,
+        src_info=None,
+        dst_info=None,
+        stream_status=True,
+        msg_id=0,
+        progress_callback=None,
     ):
         """
         Routine to use boto3 to copy a file
         multipart between object stores
+
+        :param progress_callback:
+            *optional* Called with the number of bytes transferred so
+            far after every chunk read
         """
 
         if isinstance(src_info, str):
@@ -426,15 +585,7 @@ class Boto3Manager:
             dst_url = dst_info
             dst_info = self.parse_url(url=dst_url)
 
-        self.log.info("Copying %s to %s", src_info["url"], dst_info["url"])
-
         # get the source key
-        self.log.info(
-            "Getting %s (%s %s)",
-            src_info["url"],
-            src_info["bucket_name"],
-            src_info["key_name"],
-        )
         try:
             src_key_info = self.conns[src_info["s3_loc"]].get_object(
                 Bucket=src_info["bucket_name"], Key=src_info["key_name"]
@@ -448,10 +599,55 @@ class Boto3Manager:
             mp_info = self.create_multipart_upload(
                 src_url=src_info["url"], dst_url=dst_info["url"]
             )
-            chunk = self.download_object_part(key=src_key)
-            while chunk:
-                mp_info["stream_buffer"].write(chunk)
-                mp_info["cur_size"] += len(chunk)
+            log_event(
+                self.log,
+                "transfer_start",
+                src=src_info["url"],
+                dst=dst_info["url"],
+                bytes=src_key_size,
+                part_size=mp_info["mp_chunk_size"],
+            )
+            retries = 0
+            offset = 0
+            while True:
+                try:
+                    if src_key is None:
+                        # resuming after a broken read, which may have
+                        # broken after the last byte
+                        if offset >= src_key_size:
+                            break
+                        src_key = self.conns[src_info["s3_loc"]].get_object(
+                            Bucket=src_info["bucket_name"],
+                            Key=src_info["key_name"],
+                            Range=f"bytes={offset}-",
+                        )["Body"]
+                    chunk = self.download_object_part(key=src_key)
+                except (ClientError, BotoCoreError) as exception:
+                    if retries >= MAX_READ_RETRIES:
+                        raise Exception(
+                            "Unable to read from {}: {}".format(
+                                src_info["url"], exception
+                            )
+                        )
+                    retries += 1
+                    offset = self.rewind_multipart_chunk(mp_info=mp_info)
+                    src_key = None
+                    log_event(
+                        self.log,
+                        "retry",
+                        logging.WARNING,
+                        url=src_info["url"],
+                        attempt=retries,
+                        offset=offset,
+                        error=str(exception),
+                    )
+                    time.sleep(2)
+                    continue
+
+                if not chunk:
+                    break
+                retries = 0
+
                 mp_info["total_size"] += len(chunk)
                 if stream_status:
                     print_running_status(
@@ -461,52 +657,120 @@ class Boto3Manager:
                         msg_id=msg_id,
                     )
 
-                mp_info["md5_sum"].update(chunk)
-                mp_info["sha256_sum"].update(chunk)
-
-                if mp_info["cur_size"] >= mp_info["mp_chunk_size"]:
-                    self.upload_multipart_chunk(mp_info=mp_info)
-                try:
-                    chunk = self.download_object_part(key=src_key)
-                except ClientError as exception:
-                    raise Exception(f"Unable to read from {src_key.name}: {exception}")
-
-            # write the remaining data
-            self.upload_multipart_chunk(mp_info=mp_info)
+                if progress_callback:
+                    progress_callback(mp_info["total_size"])
 
-            cur_time = time.perf_counter()
-            size_info = get_nearest_file_size(mp_info["total_size"])
-            base_transfer_rate = float(mp_info["total_size"]) / float(
-                cur_time - mp_info["start_time"]
-            )
-            transfer_info = get_nearest_file_size(base_transfer_rate)
-            cur_conv_size = float(mp_info["total_size"]) / float(size_info[0])
-            cur_conv_rate = base_transfer_rate / float(transfer_info[0])
-            self.log.info(
-                "Complete, %7.02f %s : %6.02f %s per sec",
-                cur_conv_size,
-                size_info[1],
-                cur_conv_rate,
-                transfer_info[1],
-            )
+                # parts are cut at exactly mp_chunk_size, whatever the chunk
+                # size, so the ETag only depends on the part size
+                view = memoryview(chunk)
+                while len(view):
+                    take = min(
+                        len(view), mp_info["mp_chunk_size"] - mp_info["cur_size"]
+                    )
+                    mp_info["stream_buffer"].write(view[:take])
+                    mp_info["hash_state"].update(view[:take])
+                    mp_info["cur_size"] += take
+                    view = view[take:]
+                    if mp_info["cur_size"] >= mp_info["mp_chunk_size"]:
+                        self.upload_multipart_chunk(mp_info=mp_info)
+
+            # write the remaining data; a size that's an exact multiple of
+            # the part size has none, and an empty final part would
+            # change the ETag (an empty object still needs one part)
+            if mp_info["cur_size"] or not mp_info["manifest"]["Parts"]:
+                self.upload_multipart_chunk(mp_info=mp_info)
 
             self.complete_multipart_upload(mp_info=mp_info)
-            self.log.info(
-                "Upload complete, md5 = %s, %d bytes transferred",
-                mp_info["md5_sum"].hexdigest(),
-                mp_info["total_size"],
+            seconds = time.perf_counter() - mp_info["start_time"]
+            log_event(
+                self.log,
+                "transfer_complete",
+                src=src_info["url"],
+                dst=dst_info["url"],
+                bytes=mp_info["total_size"],
+                parts=len(mp_info["manifest"]["Parts"]),
+                seconds=round(seconds, 3),
+                bytes_per_second=transfer_rate(mp_info["total_size"], seconds),
+                md5=mp_info["hash_state"].md5.hexdigest,
             )
         else:
             self.log.warning("Unable to get %s", src_info["url"])
 
         return {
-            "md5_sum": str(mp_info["md5_sum"].hexdigest()),
-            "sha256_sum": str(mp_info["sha256_sum"].hexdigest()),
+            "md5_sum": str(mp_info["hash_state"].md5.hexdigest()),
+            "sha256_sum": str(mp_info["hash_state"].sha256.hexdigest()),
             "bytes_transferred": mp_info["total_size"],
+            "part_md5s": mp_info["hash_state"].part_md5s,
+            "etag": mp_info["hash_state"].multipart_etag(),
         }
 
-    def load_file(self, url=None, stream_status=False):
-        """Load an object into memory"""
+    def copy_multipart_files(
+        self, transfers, processes=None, stream_status=True, status_interval=1.0
+    ):
+        """
+        Copy many objects at once with :meth:`copy_multipart_file` in a
+        pool of worker processes, so the per-chunk Python work of each
+        transfer runs on its own core instead of contending for the GIL.
+
+        Each worker builds its own connections from :attr:`config`.
+        Progress is reported back through a shared-memory array of byte
+        counters, one per transfer, which the parent sums up for the
+        status line.
+
+        :param transfers: A list of ``(src_url, dst_url)`` tuples
+        :param processes:
+            *optional* Number of worker processes, defaults to the
+            number of CPUs
+        :returns:
+            The :meth:`copy_multipart_file` results, in the same order
+            as ``transfers``.  If any transfer failed, the first error
+            is raised once all transfers have finished.
+        """
+        # boto3 clients and their connection pools aren't fork safe
+        context = multiprocessing.get_context("spawn")
+        progress = context.Array(ctypes.c_ulonglong, len(transfers), lock=False)
+
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=context,
+            initializer=_init_copy_worker,
+            initargs=(
+                self.config,
+                self.host_aliases,
+                self.mp_chunk_size,
+                self.chunk_size,
+                progress,
+            ),
+        ) as executor:
+            start_time = time.perf_counter()
+            futures = [
+                executor.submit(_copy_worker, index, src_url, dst_url)
+                for index, (src_url, dst_url) in enumerate(transfers)
+            ]
+            pending = futures
+            while pending:
+                _, pending = wait(pending, timeout=status_interval)
+                if stream_status:
+                    print_running_status(
+                        transferred_bytes=sum(progress), start_time=start_time
+                    )
+
+        total_size = sum(progress)
+        self.log.info(
+            "Copied %d objects, %d bytes transferred", len(transfers), total_size
+        )
+        return [future.result() for future in futures]
+
+    def load_bytes(self, url=None, stream_status=False):
+        """
+        Load an object into memory as bytes
+
+        When the manager has an :class:`~cdisutils.cache.ObjectCache`
+        the object is fetched with a conditional GET and served from
+        the cache as a read-only memory map if it has not changed.
+        """
+        if self.cache is not None:
+            return self.load_cached(url=url)
 
         downloading = True
         file_data = bytearray()
@@ -514,7 +778,8 @@ class Boto3Manager:
         chunk = []
 
         # get the key from the bucket
-        self.log.info("Getting %s", url)
+        start_time = time.perf_counter()
+        log_event(self.log, "transfer_start", src=url)
         try:
             file_key = self.get_url(url=url)
         except Exception as exception:
@@ -537,17 +802,61 @@ class Boto3Manager:
                             downloading = False
                         total_transfer += len(chunk)
                         file_data.extend(chunk)
-                        if stream_status:
+                        if stream_status and file_key["ContentLength"]:
                             sys.stdout.write(
-                                "%6.02%%\r",
-                                float(total_transfer) / float(file_key.size) * 100.0,
+                                "{:6.02f}%\r".format(
+                                    float(total_transfer)
+                                    / float(file_key["ContentLength"])
+                                    * 100.0
+                                )
                             )
                             sys.stdout.flush()
+                seconds = time.perf_counter() - start_time
+                log_event(
+                    self.log,
+                    "transfer_complete",
+                    src=url,
+                    bytes=total_transfer,
+                    seconds=round(seconds, 3),
+                    bytes_per_second=transfer_rate(total_transfer, seconds),
+                )
+            else:
+                self.log.warning("Unable to find %s", url)
+
+        return file_data
+
+    def load_cached(self, url=None):
+        """
+        Load an object through the local cache, re-downloading it only
+        if its ETag changed, and return a read-only memory map of it
+        """
+        etag = self.cache.get(url)
+        try:
+            if etag:
+                file_key = self.get_url(url=url, IfNoneMatch=etag)
             else:
-                self.log.warn("Unable to find %s", url)
+                file_key = self.get_url(url=url)
+        except ClientError as exception:
+            status = exception.response.get("ResponseMetadata", {})
+            if etag and status.get("HTTPStatusCode") == 304:
+                self.log.info("Using cached %s (%s)", url, etag)
+                return self.cache.open(url, etag)
+            self.log.error("Unable to get %s: %s", url, exception)
+            return b""
+
+        self.log.info("Caching %s (%s)", url, file_key["ETag"])
+        self.cache.put(url, file_key["ETag"], file_key["Body"], self.chunk_size)
+        return self.cache.open(url, file_key["ETag"])
+
+    def load_file(self, url=None, stream_status=False):
+        """Load an object into memory"""
+        file_data = self.load_bytes(url=url, stream_status=stream_status)
+        text = str(file_data, "utf-8")
+        if isinstance(file_data, mmap.mmap):
+            file_data.close()
 
-        self.log.info("%d lines received", len(str(file_data)))
-        return file_data.decode()
+        self.log.info("%d lines received", len(text))
+        return text
 
     def parse_data_file(self, uri=None, data_type="tsv", custom_delimiter=None):
         """
@@ -603,19 +912,35 @@ class Boto3Manager:
         )
         return key_data
 
-    def checksum_s3_key(self, url=None):
-        """Get the checksum of an s3 object"""
+    def checksum_s3_key(self, url=None, hash_state=None):
+        """
+        Get the checksum of an s3 object
+
+        :param hash_state:
+            *optional* A :class:`~cdisutils.checksum.HashState` left
+            over from an interrupted checksum of the same object.  Only
+            the bytes after its last part boundary are read.
+        """
         result = {"transfer_time": 0, "bytes_transferred": 0}
-        md5sum = hashlib.md5()
-        sha = hashlib.sha256()
+        if hash_state is None:
+            hash_state = HashState(part_size=self.mp_chunk_size)
         retries = 0
         result["start_time"] = time.time()
         running = False
-        total_transfer = 0
-        file_key_info = self.get_url(url=url)
+        offset = hash_state.rewind()
+        file_key = None
+        if offset:
+            # the interrupted checksum may have hashed the whole object,
+            # so only its size is fetched and the read resumed below, if
+            # there's anything left to read
+            file_key_info = self.head_url(url=url)
+            file_key_size = file_key_info and file_key_info.get("ContentLength", 0)
+        else:
+            file_key_info = self.get_url(url=url)
+            if file_key_info:
+                file_key = file_key_info.get("Body", None)
+                file_key_size = file_key_info.get("ContentLength", 0)
         if file_key_info:
-            file_key = file_key_info.get("Body", None)
-            file_key_size = file_key_info.get("ContentLength", None)
             running = True
             # file_key.BufferSize = self.chunk_size
         else:
@@ -623,35 +948,41 @@ class Boto3Manager:
 
         while running:
             try:
-                chunk = self.download_object_part(key=file_key)
-            except ClientError as exception:
-                if chunk:
-                    if retries > 10:
-                        self.log.error("Error reading: %s", exception)
+                if file_key is None:
+                    # resuming after a broken read, which may have broken
+                    # after the last byte
+                    if offset >= file_key_size:
                         break
-                    else:
-                        retries += 1
-                        self.log.error("Error reading: %s retry %d", exception, retries)
-                        time.sleep(2)
-                else:
-                    self.log.error(
-                        "Error reading %s, got %d bytes", exception, len(chunk)
-                    )
-                    total_transfer += len(chunk)
-                    md5sum.update(chunk)
-                    sha.update(chunk)
-                    retries = 0
+                    file_key = self.get_url_from(url=url, offset=offset)["Body"]
+                chunk = self.download_object_part(key=file_key)
+            except (ClientError, BotoCoreError) as exception:
+                if retries >= MAX_READ_RETRIES:
+                    self.log.error("Error reading: %s", exception)
+                    break
+                retries += 1
+                offset = hash_state.rewind()
+                file_key = None
+                log_event(
+                    self.log,
+                    "retry",
+                    logging.WARNING,
+                    url=url,
+                    attempt=retries,
+                    offset=offset,
+                    error=str(exception),
+                )
+                time.sleep(2)
             else:
+                if not chunk:
+                    break
                 result["bytes_transferred"] += len(chunk)
-                if (len(chunk) < self.chunk_size) and (
-                    result["bytes_transferred"] >= file_key_size
-                ):
-                    running = False
+                hash_state.update(chunk)
+                retries = 0
 
                 if file_key_size > 0:
                     sys.stdout.write(
                         "{:6.02f}%\r".format(
-                            float(result["bytes_transferred"])
+                            float(hash_state.bytes_hashed)
                             / float(file_key_size)
                             * 100.0
                         )
@@ -659,11 +990,35 @@ class Boto3Manager:
                 else:
                     sys.stdout.write("0.00%%\r")
                 sys.stdout.flush()
-                md5sum.update(chunk)
-                sha.update(chunk)
-                retries = 0
 
         result["transfer_time"] = time.time() - result["start_time"]
-        result["md5_sum"] = md5sum.hexdigest()
-        result["sha256_sum"] = sha.hexdigest()
+        result.update(hash_state.hexdigests())
+        # what the object's ETag would be if uploaded in parts of
+        # hash_state.part_size, e.g. by copy_multipart_file
+        result["etag"] = hash_state.multipart_etag()
         return result
+
+
+# Per-process state of the copy_multipart_files workers
+_worker_manager = None
+_worker_progress = None
+
+
+def _init_copy_worker(config, host_aliases, mp_chunk_size, chunk_size, progress):
+    global _worker_manager, _worker_progress
+    _worker_manager = Boto3Manager(config=config, host_aliases=host_aliases)
+    _worker_manager.mp_chunk_size = mp_chunk_size
+    _worker_manager.chunk_size = chunk_size
+    _worker_progress = progress
+
+
+def _copy_worker(index, src_url, dst_url):
+    def report_progress(transferred_bytes):
+        _worker_progress[index] = transferred_bytes
+
+    return _worker_manager.copy_multipart_file(
+        src_info=src_url,
+        dst_info=dst_url,
+        stream_status=False,
+        progress_callback=report_progress,
+    )
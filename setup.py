@@ -37,15 +37,21 @@ setup(
         # cdisutils.dbgap
         # If you include this extra, your application/library should specify
         # the expected versions of gdcdatamodel2 and the associated dictionary.
-        "dbgap": ["gdcdatamodel2", "requests>=2.7", "xmltodict>=0.9"],
+        "dbgap": [
+            "gdcdatamodel2",
+            "requests>=2.7",
+            "urllib3>=1.26",
+            "xmltodict>=0.9",
+        ],
         #
         # cdisutils.excel
-        "excel": ["openpyxl~=2.4"],
+        "excel": ["openpyxl>=2.6,<4"],
         #
         # bin/nova_status.py
         "nova": ["python-novaclient~=3.2"],
         "dev": [
             "moto~=4.1",
+            "openpyxl>=2.6,<4",
             "requests~=2.31",
             "pytest>4.6",
             "pytest-cov>2.10",
@@ -0,0 +1,111 @@
+"""
+Benchmark dbGaP telemetry report parsing in cdisutils.dbgap.
+
+Compares extracting the submitter ids of a generated telemetry report
+with ``xmltodict`` (the previous path) against the streaming
+``parse_telemetry``, fed the whole report or in chunks as it would be
+off the network, and writes the results as JSON.
+
+Run from the repository root, e.g.::
+
+    python -m tests.benchmarks.bench_dbgap --samples 100000 500000
+"""
+
+import logging
+from argparse import ArgumentParser
+from importlib.metadata import version
+
+import xmltodict
+
+from cdisutils import dbgap
+from tests.benchmarks.utils import measure, write_results
+
+
+def legacy_parse(text):
+    """The submitter ids as get_registered_cases built them before the
+    streaming parser"""
+    telemetry = xmltodict.parse(text)
+    samples = telemetry["DbGap"]["Study"]["SampleList"]["Sample"]
+    if isinstance(samples, dict):
+        samples = [samples]
+    return frozenset(s["@submitted_subject_id"] for s in samples)
+
+
+def generate_report(num_samples):
+    """A telemetry report shaped like dbGaP's, with several samples per
+    subject and the attributes they usually carry"""
+    samples = "".join(
+        f'<Sample sample_num="{i}" submitted_sample_id="sample-{i}" '
+        f'submitted_subject_id="subject-{i // 3}" '
+        f'repository="NCI_GDC" sra_sample_id="SRS{i:07d}" '
+        f'biosample_id="SAMN{i:08d}" consent_code="1" consent_short_name="GRU">'
+        f'<Attributes><Attribute name="analyte_type">DNA</Attribute></Attributes>'
+        f"</Sample>"
+        for i in range(num_samples)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<DbGap><Study accession="phs000178.v11.p8" registration_status="released">'
+        f"<SampleList>{samples}</SampleList></Study></DbGap>"
+    ).encode("utf-8")
+
+
+def parse_cmd_args():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--samples", nargs="+", type=int, default=[10000, 100000], help="Samples"
+    )
+    parser.add_argument("--chunk-size", type=int, default=dbgap.TELEMETRY_CHUNK_SIZE)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="dbgap-bench.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cmd_args()
+    logging.getLogger("dbGapXReferencer").setLevel(logging.WARNING)
+
+    results = []
+    for num_samples in args.samples:
+        report = generate_report(num_samples)
+        text = report.decode("utf-8")
+        expected = legacy_parse(text)
+
+        def chunks():
+            return (
+                report[i : i + args.chunk_size]
+                for i in range(0, len(report), args.chunk_size)
+            )
+
+        functions = {
+            "xmltodict": lambda: legacy_parse(text),
+            "parse_telemetry": lambda: dbgap.parse_telemetry(report).submitter_ids,
+            "parse_telemetry_chunked": lambda: dbgap.parse_telemetry(
+                chunks()
+            ).submitter_ids,
+        }
+        for name, func in functions.items():
+            assert func() == expected, name
+            result = measure(func, repeat=args.repeat)
+            result.update(
+                function=name,
+                samples=num_samples,
+                report_bytes=len(report),
+            )
+            results.append(result)
+            print(
+                "{function:>24} samples={samples:>8} {seconds:8.3f}s "
+                "peak={peak_memory_bytes:>11} B".format(**result)
+            )
+
+    write_results(
+        args.output,
+        "dbgap",
+        results,
+        xmltodict=version("xmltodict"),
+        chunk_size=args.chunk_size,
+    )
+
+
+if __name__ == "__main__":
+    main()
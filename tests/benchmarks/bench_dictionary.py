@@ -0,0 +1,187 @@
+"""
+Benchmark dictionary tree normalisation in cdisutils.dictionary.
+
+Compares sort_dict and remove_keys_from_dict against the previous
+recursive implementations on generated nested case documents, copying
+and in place, times fingerprint, first_difference and diff_trees against
+comparing sort_dict copies, and writes the results as JSON.
+
+Run from the repository root, e.g.::
+
+    python -m tests.benchmarks.bench_dictionary --cases 1000 10000
+"""
+
+import json
+from argparse import ArgumentParser
+
+from cdisutils import dictionary
+from tests.benchmarks.utils import measure, write_results
+
+REMOVE_KEYS = ["updated_datetime", "created_datetime", "state", "acl"]
+
+
+def legacy_sort_dict(tree, remove_keys=None):
+    """sort_dict as it was before the explicit stack implementation"""
+    if remove_keys is None:
+        remove_keys = []
+
+    if isinstance(tree, dict):
+        return {
+            key: legacy_sort_dict(tree[key], remove_keys=remove_keys)
+            for key in tree
+            if key not in remove_keys
+        }
+    elif isinstance(tree, list):
+        return sorted(
+            legacy_sort_dict(element, remove_keys=remove_keys) for element in tree
+        )
+    else:
+        return tree
+
+
+def legacy_remove_keys_from_dict(tree, remove_keys):
+    """remove_keys_from_dict as it was before the explicit stack
+    implementation"""
+    if remove_keys is None or remove_keys == []:
+        return tree
+
+    if isinstance(tree, dict):
+        return {
+            key: legacy_remove_keys_from_dict(tree[key], remove_keys)
+            for key in tree
+            if key not in remove_keys
+        }
+    elif isinstance(tree, list):
+        return [legacy_remove_keys_from_dict(element, remove_keys) for element in tree]
+    else:
+        return tree
+
+
+def generate_document(num_cases):
+    """Case documents shaped like the indexed ones: nested entities with
+    the usual system properties. Children are keyed by id and lists only
+    hold scalars, because sort_dict can't order lists of dicts"""
+
+    def entity(kind, i):
+        return {
+            "id": f"{kind}-{i}",
+            "submitter_id": f"{kind}-submitter-{i}",
+            "updated_datetime": "2020-01-01T00:00:00",
+            "created_datetime": "2019-01-01T00:00:00",
+            "state": "released",
+            "acl": ["phs000178", "open"],
+        }
+
+    cases = {}
+    for i in range(num_cases):
+        case = entity("case", i)
+        case["project"] = {"code": "BRCA", "program": entity("program", 0)}
+        case["tags"] = [f"tag-{(i * 7 + j) % 13}" for j in range(5)]
+        case["samples"] = {}
+        for j in range(4):
+            sample = entity("sample", j)
+            sample["portions"] = {}
+            for k in range(3):
+                portion = entity("portion", k)
+                portion["analytes"] = {
+                    f"analyte-{m}": dict(
+                        entity("analyte", m),
+                        aliquot_ids=[f"a-{m}-{n}" for n in (3, 1, 2)],
+                    )
+                    for m in range(2)
+                }
+                portion["weights"] = [k * 1.5, k * 0.5, k]
+                sample["portions"][portion["id"]] = portion
+            case["samples"][sample["id"]] = sample
+        cases[case["id"]] = case
+    return {"cases": cases}
+
+
+def count_nodes(tree):
+    count, stack = 0, [tree]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return count
+
+
+def parse_cmd_args():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--cases", nargs="+", type=int, default=[100, 1000], help="Cases per document"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="dictionary-bench.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cmd_args()
+
+    results = []
+    for num_cases in args.cases:
+        document = generate_document(num_cases)
+        # the in place variants get a fresh copy every run, timed separately
+        encoded = json.dumps(document)
+        nodes = count_nodes(document)
+
+        functions = {
+            "json_loads": lambda: json.loads(encoded),
+            "legacy_sort_dict": lambda: legacy_sort_dict(document, REMOVE_KEYS),
+            "sort_dict": lambda: dictionary.sort_dict(document, REMOVE_KEYS),
+            "sort_dict_in_place": lambda: dictionary.sort_dict(
+                json.loads(encoded), REMOVE_KEYS, in_place=True
+            ),
+            "legacy_remove_keys_from_dict": lambda: legacy_remove_keys_from_dict(
+                document, REMOVE_KEYS
+            ),
+            "remove_keys_from_dict": lambda: dictionary.remove_keys_from_dict(
+                document, REMOVE_KEYS
+            ),
+            "remove_keys_from_dict_in_place": lambda: (
+                dictionary.remove_keys_from_dict(
+                    json.loads(encoded), REMOVE_KEYS, in_place=True
+                )
+            ),
+        }
+        # an equivalent document, and one with a single change deep down
+        other = json.loads(encoded)
+        changed = json.loads(encoded)
+        case = changed["cases"]["case-0"]
+        case["samples"]["sample-0"]["portions"]["portion-0"]["weights"].append(9)
+        functions.update(
+            {
+                "compare_sorted_copies": lambda: (
+                    legacy_sort_dict(document, REMOVE_KEYS)
+                    == legacy_sort_dict(other, REMOVE_KEYS)
+                ),
+                "fingerprint": lambda: dictionary.fingerprint(document, REMOVE_KEYS),
+                "first_difference": lambda: dictionary.first_difference(
+                    document, other, REMOVE_KEYS
+                ),
+                "diff_trees": lambda: dictionary.diff_trees(
+                    document, changed, REMOVE_KEYS
+                ),
+            }
+        )
+        assert functions["sort_dict"]() == functions["legacy_sort_dict"]()
+        assert functions["sort_dict_in_place"]() == functions["legacy_sort_dict"]()
+
+        for name, func in functions.items():
+            result = measure(func, repeat=args.repeat)
+            result.update(function=name, cases=num_cases, nodes=nodes)
+            results.append(result)
+            print(
+                "{function:>32} nodes={nodes:>9} {seconds:8.3f}s "
+                "peak={peak_memory_bytes:>11} B".format(**result)
+            )
+
+    write_results(args.output, "dictionary", results, remove_keys=REMOVE_KEYS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark spreadsheet row iteration in cdisutils.excel.
+
+Compares read_sheet and read_columns against the previous Cell based
+implementations on a generated workbook, in both regular and read-only
+mode, and writes the results as JSON.
+
+Run from the repository root, e.g.::
+
+    python -m tests.benchmarks.bench_excel --rows 50000 --columns 30
+"""
+
+import io
+import logging
+from argparse import ArgumentParser
+
+import openpyxl
+
+from cdisutils import excel
+from tests.benchmarks.utils import measure, write_results
+
+
+def legacy_read_sheet(ws=None, num_headers=1):
+    """read_sheet as it was before the values-only fast path"""
+    sheet_data = []
+    rows = ws.rows
+    header = excel.read_headers(rows, num_headers)
+    for row in rows:
+        any_data = False
+        for cell in row:
+            if cell.value and len(str(cell.value).strip()):
+                any_data = True
+                break
+        if any_data:
+            line_data = dict(zip(header, [str(cell.value).strip() for cell in row]))
+            sheet_data.append(line_data)
+    return sheet_data
+
+
+def legacy_read_columns(ws, num_headers=1):
+    """read_columns as it was before the values-only fast path"""
+    sheet_data = {}
+    rows = ws.rows
+    header = excel.read_headers(rows, num_headers)
+    if header is None:
+        return sheet_data
+    for row in rows:
+        for h, cell in zip(header, row):
+            value = cell.value.strip() if isinstance(cell.value, str) else cell.value
+            if h not in sheet_data:
+                sheet_data[h] = [value]
+            elif value:
+                sheet_data[h].append(value)
+    return sheet_data
+
+
+def generate_workbook(num_rows, num_columns):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Cases"
+    ws.append([f"column_{i}" for i in range(num_columns)])
+    for row in range(num_rows):
+        if row % 50 == 0:
+            ws.append([None] * num_columns)
+        else:
+            ws.append(
+                [f" value {row}-{i} " if i % 3 else row * i for i in range(num_columns)]
+            )
+    data = io.BytesIO()
+    wb.save(data)
+    return data.getvalue()
+
+
+def parse_cmd_args():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="excel-bench.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cmd_args()
+    logging.getLogger("excel").setLevel(logging.WARNING)
+    workbook = generate_workbook(args.rows, args.columns)
+
+    functions = {
+        "legacy_read_sheet": legacy_read_sheet,
+        "read_sheet": excel.read_sheet,
+        "legacy_read_columns": legacy_read_columns,
+        "read_columns": excel.read_columns,
+    }
+
+    # a regular workbook is parsed up front, so only row iteration is timed
+    regular_wb = openpyxl.load_workbook(io.BytesIO(workbook))
+
+    results = []
+    for read_only in (False, True):
+        for name, func in functions.items():
+
+            def run():
+                if not read_only:
+                    func(regular_wb["Cases"])
+                    return
+                # read-only worksheets parse the sheet xml as rows are read
+                wb = openpyxl.load_workbook(io.BytesIO(workbook), read_only=True)
+                func(wb["Cases"])
+                wb.close()
+
+            result = measure(run, repeat=args.repeat)
+            result.update(
+                function=name,
+                read_only=read_only,
+                rows=args.rows,
+                columns=args.columns,
+            )
+            results.append(result)
+            print(
+                "{function:>20} read_only={read_only!s:<5} {seconds:8.3f}s "
+                "peak={peak_memory_bytes:>11} B".format(**result)
+            )
+
+    write_results(
+        args.output,
+        "excel",
+        results,
+        openpyxl=openpyxl.__version__,
+        workbook_bytes=len(workbook),
+    )
+
+
+if __name__ == "__main__":
+    main()
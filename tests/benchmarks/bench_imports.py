@@ -0,0 +1,88 @@
+"""
+Benchmark the import time of cdisutils modules.
+
+Imports each module in a fresh interpreter under ``python -X importtime``
+and records its cumulative import time, next to importing it together
+with the heavy dependencies it used to load eagerly, and writes the
+results as JSON.
+
+Run from the repository root, e.g.::
+
+    python -m tests.benchmarks.bench_imports --repeat 5
+"""
+
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+from tests.benchmarks.utils import write_results
+
+#: module -> the dependencies it imported at import time before they
+#: were deferred
+MODULES = {
+    "cdisutils.storage3": ["boto3", "urllib3"],
+    "cdisutils.excel": ["openpyxl"],
+    "cdisutils.dbgap": ["requests", "xmltodict", "gdcdatamodel2.models"],
+}
+
+
+def import_times(code):
+    """``(name, cumulative microseconds)`` of the top level imports made
+    by running ``code`` in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        # nested imports are included in their parent's cumulative time
+        if not name.startswith("  "):
+            times.append((name.strip(), int(cumulative)))
+    return times
+
+
+def import_seconds(modules, startup):
+    """Cumulative import time of ``modules`` in a fresh interpreter,
+    leaving out the imports every interpreter makes at ``startup``"""
+    times = import_times("import " + ", ".join(modules))
+    return sum(usec for name, usec in times if name not in startup) / 1e6
+
+
+def parse_cmd_args():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="imports-bench.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cmd_args()
+
+    startup = {name for name, _ in import_times("pass")}
+    results = []
+    for module, dependencies in MODULES.items():
+        variants = {"lazy": [module], "eager": [module] + dependencies}
+        for variant, modules in variants.items():
+            try:
+                timings = [import_seconds(modules, startup) for _ in range(args.repeat)]
+            except subprocess.CalledProcessError as exception:
+                print(f"Unable to import {modules}: {exception.stderr}")
+                continue
+            result = {
+                "module": module,
+                "variant": variant,
+                "seconds": statistics.median(timings),
+                "min_seconds": min(timings),
+            }
+            results.append(result)
+            print("{module:>20} {variant:>6} {seconds:8.3f}s".format(**result))
+
+    write_results(args.output, "imports", results, python=sys.executable)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Benchmark storage3 transfers against a local moto server.
+
+Measures throughput and peak memory of ``copy_multipart_file``,
+``checksum_s3_key``, ``load_file`` and ``parse_data_file`` across object
+sizes, download chunk sizes and concurrency levels, and writes the
+results as JSON so runs can be compared over time.
+
+Run from the repository root, e.g.::
+
+    python -m tests.benchmarks.bench_storage3 \\
+        --sizes 16MiB 128MiB --chunk-sizes 1MiB 16MiB 64MiB \\
+        --concurrency 1 4 --output storage3-bench.json
+"""
+
+import contextlib
+import io
+import itertools
+import logging
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import botocore
+import botocore.exceptions
+
+from cdisutils.storage3 import DEFAULT_MP_CHUNK_SIZE, Boto3Manager
+from tests.benchmarks.utils import measure, parse_size, write_results
+from tests.integration.conftest import MotoServer
+
+BUCKET = "benchmark"
+OPERATIONS = ["copy_multipart_file", "checksum_s3_key", "load_file", "parse_data_file"]
+
+
+def tsv_data(size):
+    """Generate ``size`` bytes of TSV so every operation, including
+    parse_data_file, can run against the same objects"""
+    header = b"id\tproject\tvalue\n"
+    row = b"0123456789abcdef\tPROJECT-CODE\t3.14159\n"
+    body = header + row * ((size - len(header)) // len(row) + 1)
+    return body[:size]
+
+
+def wait_for_server(client, timeout=30):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return client.list_buckets()
+        except botocore.exceptions.EndpointConnectionError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def run_operation(manager, operation, src_url, dst_url):
+    if operation == "copy_multipart_file":
+        manager.copy_multipart_file(src_info=src_url, dst_info=dst_url)
+    elif operation == "checksum_s3_key":
+        manager.checksum_s3_key(url=src_url)
+    elif operation == "load_file":
+        manager.load_file(url=src_url)
+    elif operation == "parse_data_file":
+        manager.parse_data_file(uri=src_url)
+
+
+def run_concurrently(manager, operation, urls, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(run_operation, manager, operation, src_url, dst_url)
+            for src_url, dst_url in urls[:concurrency]
+        ]
+        for future in futures:
+            future.result()
+
+
+def parse_cmd_args():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--sizes", nargs="+", default=["16MiB", "64MiB"], help="Object sizes"
+    )
+    parser.add_argument(
+        "--chunk-sizes",
+        nargs="+",
+        default=["1MiB", "16MiB"],
+        help="Download chunk sizes (Boto3Manager.chunk_size)",
+    )
+    parser.add_argument(
+        "--mp-chunk-size",
+        default=str(DEFAULT_MP_CHUNK_SIZE),
+        help="Multipart part size (Boto3Manager.mp_chunk_size)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        nargs="+",
+        type=int,
+        default=[1, 4],
+        help="Number of transfers run at once in threads",
+    )
+    parser.add_argument(
+        "--operations", nargs="+", default=OPERATIONS, choices=OPERATIONS
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--port", type=int, default=7100)
+    parser.add_argument("--output", default="storage3-bench.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cmd_args()
+    sizes = [parse_size(size) for size in args.sizes]
+    chunk_sizes = [parse_size(size) for size in args.chunk_sizes]
+    max_concurrency = max(args.concurrency)
+
+    # the per-transfer INFO logging would otherwise dominate the output
+    logging.getLogger("boto3_manager").setLevel(logging.WARNING)
+
+    server = MotoServer(port=args.port)
+    server.start()
+    try:
+        config = {
+            server.url: {
+                "aws_secret_access_key": "testing",  # pragma: allowlist secret
+                "aws_access_key_id": "testing",
+                "verify": False,
+            }
+        }
+        client = boto3.client(**server.client_config)
+        wait_for_server(client)
+        client.create_bucket(Bucket=BUCKET)
+
+        manager = Boto3Manager(config)
+        manager.mp_chunk_size = parse_size(args.mp_chunk_size)
+
+        results = []
+        for size in sizes:
+            for i in range(max_concurrency):
+                client.put_object(Bucket=BUCKET, Key=f"{size}/{i}", Body=tsv_data(size))
+            urls = [
+                (
+                    f"{server.s3_url}/{BUCKET}/{size}/{i}",
+                    f"{server.s3_url}/{BUCKET}/{size}/{i}.copy",
+                )
+                for i in range(max_concurrency)
+            ]
+
+            for operation, chunk_size, concurrency in itertools.product(
+                args.operations, chunk_sizes, args.concurrency
+            ):
+                manager.chunk_size = chunk_size
+                # keep the progress output of the transfers out of the way
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = measure(
+                        lambda: run_concurrently(manager, operation, urls, concurrency),
+                        repeat=args.repeat,
+                    )
+                result.update(
+                    operation=operation,
+                    object_size=size,
+                    chunk_size=chunk_size,
+                    mp_chunk_size=manager.mp_chunk_size,
+                    concurrency=concurrency,
+                    throughput_bytes_per_sec=size * concurrency / result["seconds"],
+                )
+                results.append(result)
+                print(
+                    "{operation:>20} size={object_size:>11} chunk={chunk_size:>10} "
+                    "x{concurrency:<3} {seconds:8.3f}s "
+                    "{throughput_bytes_per_sec:14.0f} B/s "
+                    "peak={peak_memory_bytes:>11} B".format(**result)
+                )
+
+        write_results(
+            args.output,
+            "storage3",
+            results,
+            boto3=boto3.__version__,
+            botocore=botocore.__version__,
+        )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
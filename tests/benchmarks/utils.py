@@ -0,0 +1,71 @@
+"""Shared helpers for the standalone benchmark runners."""
+
+import json
+import platform
+import re
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+SIZE_SUFFIXES = {"": 1, "KIB": 1024, "MIB": 1024**2, "GIB": 1024**3}
+
+
+def parse_size(value):
+    """Parse sizes like ``16MiB`` or ``1048576`` into bytes"""
+    match = re.match(r"^(\d+)\s*([KMG]iB)?$", value.strip(), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(match.group(1)) * SIZE_SUFFIXES[(match.group(2) or "").upper()]
+
+
+def measure(func, repeat=3):
+    """Time ``func`` ``repeat`` times, then run it once more under
+    tracemalloc to record the peak Python memory allocated.
+
+    Returns:
+        dict: ``seconds`` (median), ``min_seconds`` and
+            ``peak_memory_bytes``
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "peak_memory_bytes": peak,
+    }
+
+
+def environment():
+    """Describe the machine so results from different runs can be
+    compared sensibly"""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def write_results(path, benchmark, results, **metadata):
+    """Write benchmark ``results`` as JSON to ``path``"""
+    document = {
+        "benchmark": benchmark,
+        "environment": environment(),
+        "metadata": metadata,
+        "results": results,
+    }
+    with open(path, "w") as output:
+        json.dump(document, output, indent=2, sort_keys=True)
+        output.write("\n")
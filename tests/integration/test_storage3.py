@@ -1,10 +1,21 @@
+import gc
+import hashlib
+import io
+import logging
 import os
 import time
 import typing
+import zipfile
 
 import boto3
+import openpyxl
 import pytest
+from botocore.exceptions import BotoCoreError
 
+from cdisutils import excel
+from cdisutils.cache import ObjectCache
+from cdisutils.checksum import HashState, compute_etag
+from cdisutils.log import EventMessage
 from cdisutils.storage3 import Boto3Manager
 from tests.integration.conftest import MotoServer
 
@@ -156,21 +167,156 @@ def test_simulate_cleversafe_to_aws_multipart_copy(
     src_info = manager.parse_url(src_url)
     dst_info = manager.parse_url(dst_url)
 
+    events = []
+    handler = logging.Handler()
+    handler.emit = lambda record: events.append(record.msg)
+    manager.log.addHandler(handler)
+
     # copy_multipart_file invokes the other multipart operation: create_multipart_upload, complete_multipart_upload
-    res = manager.copy_multipart_file(src_info=src_info, dst_info=dst_info)
+    try:
+        res = manager.copy_multipart_file(src_info=src_info, dst_info=dst_info)
+    finally:
+        manager.log.removeHandler(handler)
     assert res == {
         "md5_sum": "bc0354f0646794a755a4276435ec5a6c",
         "sha256_sum": "c97d1f1ab2ae91dbe05ad8e20bc58fc6f3af28e98d98ca8dbeee31a9d32e1e5b",
         "bytes_transferred": 40000000,
+        "part_md5s": ["bc0354f0646794a755a4276435ec5a6c"],
+        "etag": compute_etag(b"test" * LARGE_NUMBER_TO_WRITE, manager.mp_chunk_size),
     }
 
+    events = [event for event in events if isinstance(event, EventMessage)]
+    assert [event.event for event in events] == [
+        "transfer_start",
+        "part_uploaded",
+        "transfer_complete",
+    ]
+    assert events[1].fields["bytes"] == 40000000
+    assert events[2].fields["bytes"] == 40000000
+    assert events[2].fields["md5"] == res["md5_sum"]
+
     head = conn_b.head_object(Bucket=TEST_BUCKET, Key=COPIED_FILE_NAME)
     assert head["ResponseMetadata"]["HTTPStatusCode"] == 200
     assert head["ContentLength"] == LARGE_NUMBER_TO_WRITE * len("test")
+    assert manager.verify_etag(dst_url, res["etag"])
+    assert not manager.verify_etag(dst_url, res["md5_sum"])
 
     conn_b.delete_object(Bucket=TEST_BUCKET, Key=COPIED_FILE_NAME)
 
 
+@pytest.mark.usefixtures("create_large_object")
+def test_multipart_copy_exact_multiple_of_part_size():
+    config = get_config()
+    manager = Boto3Manager(config)
+    manager.mp_chunk_size = 5 * 1024 * 1024
+    manager.chunk_size = 1024 * 1024
+    conn = manager.get_connection("localhost:7000")
+    data = b"x" * (10 * 1024 * 1024)
+    conn.put_object(Body=data, Bucket=TEST_BUCKET, Key="exact_multiple")
+    src_url = f"s3://localhost:7000/{TEST_BUCKET}/exact_multiple"
+    dst_url = f"s3://localhost:7000/{TEST_BUCKET}/{COPIED_FILE_NAME}"
+
+    res = manager.copy_multipart_file(src_info=src_url, dst_info=dst_url)
+
+    etag = compute_etag(data, part_size=manager.mp_chunk_size)
+    assert etag.endswith("-2")
+    assert res["etag"] == etag
+    assert len(res["part_md5s"]) == 2
+    assert manager.verify_etag(dst_url, etag)
+    assert manager.checksum_s3_key(url=dst_url)["etag"] == etag
+
+    conn.delete_object(Bucket=TEST_BUCKET, Key="exact_multiple")
+    conn.delete_object(Bucket=TEST_BUCKET, Key=COPIED_FILE_NAME)
+
+
+@pytest.mark.usefixtures("moto_server")
+def test_multipart_copy_chunk_size_not_dividing_part_size():
+    config = get_config()
+    manager = Boto3Manager(config)
+    manager.mp_chunk_size = 5 * 1024 * 1024
+    manager.chunk_size = 3 * 1024 * 1024
+    conn = manager.get_connection("localhost:7000")
+    data = os.urandom(11 * 1024 * 1024)
+    conn.put_object(Body=data, Bucket=TEST_BUCKET, Key="uneven_chunks")
+    src_url = f"s3://localhost:7000/{TEST_BUCKET}/uneven_chunks"
+    dst_url = f"s3://localhost:7000/{TEST_BUCKET}/{COPIED_FILE_NAME}"
+
+    res = manager.copy_multipart_file(src_info=src_url, dst_info=dst_url)
+
+    # 5 + 5 + 1MiB parts, not 6 + 5MiB
+    etag = compute_etag(data, part_size=manager.mp_chunk_size)
+    assert etag.endswith("-3")
+    assert res["etag"] == etag
+    assert res["md5_sum"] == hashlib.md5(data).hexdigest()
+    assert manager.verify_etag(dst_url, etag)
+    assert manager.checksum_s3_key(url=dst_url)["etag"] == etag
+
+    conn.delete_object(Bucket=TEST_BUCKET, Key="uneven_chunks")
+    conn.delete_object(Bucket=TEST_BUCKET, Key=COPIED_FILE_NAME)
+
+
+@pytest.mark.usefixtures("moto_server")
+@pytest.mark.parametrize("failing_read", [7, 11], ids=["mid_part", "after_last_byte"])
+def test_broken_reads_are_resumed(monkeypatch, failing_read):
+    config = get_config()
+    manager = Boto3Manager(config)
+    manager.mp_chunk_size = 5 * 1024 * 1024
+    manager.chunk_size = 1024 * 1024
+    conn = manager.get_connection("localhost:7000")
+    data = os.urandom(10 * 1024 * 1024)
+    conn.put_object(Body=data, Bucket=TEST_BUCKET, Key="broken_reads")
+    src_url = f"s3://localhost:7000/{TEST_BUCKET}/broken_reads"
+    dst_url = f"s3://localhost:7000/{TEST_BUCKET}/{COPIED_FILE_NAME}"
+
+    # the failing_read-th chunk read breaks, and so does the first ranged
+    # GET resuming it; the 11th read is the empty one after the last byte
+    reads = []
+    ranges = []
+    download_object_part = manager.download_object_part
+    get_object = conn.get_object
+
+    def broken_download_object_part(key):
+        reads.append(key)
+        if len(reads) == failing_read:
+            raise BotoCoreError()
+        return download_object_part(key)
+
+    def broken_get_object(**kwargs):
+        if "Range" in kwargs:
+            ranges.append(kwargs["Range"])
+            if len(ranges) == 1:
+                raise BotoCoreError()
+        return get_object(**kwargs)
+
+    monkeypatch.setattr(manager, "download_object_part", broken_download_object_part)
+    monkeypatch.setattr(conn, "get_object", broken_get_object)
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    expected_ranges = ["bytes=5242880-"] * 2 if failing_read == 7 else []
+
+    res = manager.copy_multipart_file(src_info=src_url, dst_info=dst_url)
+
+    etag = compute_etag(data, part_size=manager.mp_chunk_size)
+    assert res["md5_sum"] == hashlib.md5(data).hexdigest()
+    assert res["bytes_transferred"] == len(data)
+    assert res["etag"] == etag
+    assert ranges == expected_ranges
+
+    monkeypatch.setattr(conn, "get_object", get_object)
+    assert manager.verify_etag(dst_url, etag)
+
+    reads.clear()
+    ranges.clear()
+    monkeypatch.setattr(conn, "get_object", broken_get_object)
+    res = manager.checksum_s3_key(url=dst_url)
+
+    assert res["md5_sum"] == hashlib.md5(data).hexdigest()
+    assert res["etag"] == etag
+    assert ranges == expected_ranges
+
+    conn.delete_object(Bucket=TEST_BUCKET, Key="broken_reads")
+    conn.delete_object(Bucket=TEST_BUCKET, Key=COPIED_FILE_NAME)
+
+
 @pytest.mark.usefixtures("create_large_object")
 def test_load_file():
     config = get_config()
@@ -192,3 +338,257 @@ def test_checksum_s3_key():
         res["sha256_sum"]
         == "c97d1f1ab2ae91dbe05ad8e20bc58fc6f3af28e98d98ca8dbeee31a9d32e1e5b"
     )
+
+
+@pytest.mark.usefixtures("create_large_object")
+def test_checksum_s3_key_resumes_from_hash_state():
+    config = get_config()
+    manager = Boto3Manager(config)
+    url = f"s3://localhost:7000/{TEST_BUCKET}/{ORIGINAL_FILE_NAME}"
+
+    # simulate a checksum that was interrupted part way through
+    hash_state = HashState(part_size=8 * 1024 * 1024)
+    hash_state.update(b"test" * (3 * 1024 * 1024))
+    res = manager.checksum_s3_key(url=url, hash_state=hash_state)
+
+    assert res["bytes_transferred"] == 40000000 - 8 * 1024 * 1024
+    assert res["md5_sum"] == "bc0354f0646794a755a4276435ec5a6c"
+    assert (
+        res["sha256_sum"]
+        == "c97d1f1ab2ae91dbe05ad8e20bc58fc6f3af28e98d98ca8dbeee31a9d32e1e5b"
+    )
+    assert res["etag"] == compute_etag(
+        b"test" * LARGE_NUMBER_TO_WRITE, part_size=8 * 1024 * 1024
+    )
+
+    # interrupted after hashing the last byte, on a part boundary
+    conn = manager.get_connection("localhost:7000")
+    data = os.urandom(2 * 1024 * 1024)
+    conn.put_object(Body=data, Bucket=TEST_BUCKET, Key="fully_hashed")
+    hash_state = HashState(part_size=1024 * 1024)
+    hash_state.update(data)
+    res = manager.checksum_s3_key(
+        url=f"s3://localhost:7000/{TEST_BUCKET}/fully_hashed", hash_state=hash_state
+    )
+
+    assert res["bytes_transferred"] == 0
+    assert res["md5_sum"] == hashlib.md5(data).hexdigest()
+    assert res["etag"] == compute_etag(data, part_size=1024 * 1024)
+    conn.delete_object(Bucket=TEST_BUCKET, Key="fully_hashed")
+
+
+@pytest.mark.usefixtures("create_large_object")
+def test_load_file_through_cache(tmp_path):
+    config = get_config()
+    cache = ObjectCache(str(tmp_path))
+    manager = Boto3Manager(config, cache=cache)
+    url = f"s3://localhost:7000/{TEST_BUCKET}/{ORIGINAL_FILE_NAME}"
+
+    assert manager.load_file(url=url) == "test" * LARGE_NUMBER_TO_WRITE
+    etag = cache.get(url)
+    assert etag
+
+    # the second load is a 304 served from the cached copy, which is
+    # not rewritten
+    inode = os.stat(cache.path(url, etag)).st_ino
+    assert manager.load_file(url=url) == "test" * LARGE_NUMBER_TO_WRITE
+    assert os.stat(cache.path(url, etag)).st_ino == inode
+
+
+@pytest.mark.usefixtures("create_large_object")
+def test_load_file_cache_refreshes_changed_object(tmp_path):
+    config = get_config()
+    cache = ObjectCache(str(tmp_path))
+    manager = Boto3Manager(config, cache=cache)
+    conn = manager.get_connection("localhost:7000")
+    url = f"s3://localhost:7000/{TEST_BUCKET}/small_file"
+
+    conn.put_object(Body=b"a\tb\n1\t2", Bucket=TEST_BUCKET, Key="small_file")
+    assert manager.parse_data_file(uri=url) == [{"a": "1", "b": "2"}]
+
+    conn.put_object(Body=b"a\tb\n3\t4", Bucket=TEST_BUCKET, Key="small_file")
+    assert manager.parse_data_file(uri=url) == [{"a": "3", "b": "4"}]
+    assert len(cache.entries()) == 1
+
+    conn.delete_object(Bucket=TEST_BUCKET, Key="small_file")
+
+
+@pytest.mark.usefixtures("create_large_object")
+def test_copy_multipart_files_in_processes():
+    config = get_config()
+    manager = Boto3Manager(config)
+    src_url = f"s3://localhost:7000/{TEST_BUCKET}/{ORIGINAL_FILE_NAME}"
+    dst_urls = [
+        f"s3://localhost:7000/{TEST_BUCKET}/{COPIED_FILE_NAME}_{i}" for i in range(3)
+    ]
+
+    results = manager.copy_multipart_files(
+        [(src_url, dst_url) for dst_url in dst_urls], processes=2
+    )
+
+    assert len(results) == 3
+    conn = manager.get_connection("localhost:7000")
+    for result, dst_url in zip(results, dst_urls):
+        assert result["md5_sum"] == "bc0354f0646794a755a4276435ec5a6c"
+        assert result["bytes_transferred"] == 40000000
+        key = dst_url.rsplit("/", 1)[1]
+        head = conn.head_object(Bucket=TEST_BUCKET, Key=key)
+        assert head["ContentLength"] == 40000000
+        conn.delete_object(Bucket=TEST_BUCKET, Key=key)
+
+
+@pytest.mark.usefixtures("moto_server")
+def test_open_for_write():
+    config = get_config()
+    manager = Boto3Manager(config)
+    conn = manager.get_connection("localhost:7000")
+    conn.create_bucket(Bucket=TEST_BUCKET)
+    url = f"s3://localhost:7000/{TEST_BUCKET}/{COPIED_FILE_NAME}"
+    part_size = 5 * 1024 * 1024
+
+    with manager.open_for_write(url, part_size=part_size) as writer:
+        for _ in range(LARGE_NUMBER_TO_WRITE // 1000):
+            writer.write(b"test" * 1000)
+
+    assert writer.result == {
+        "md5_sum": "bc0354f0646794a755a4276435ec5a6c",
+        "sha256_sum": "c97d1f1ab2ae91dbe05ad8e20bc58fc6f3af28e98d98ca8dbeee31a9d32e1e5b",
+        "bytes_transferred": 40000000,
+        "etag": compute_etag(b"test" * LARGE_NUMBER_TO_WRITE, part_size),
+    }
+    assert len(writer.hash_state.part_md5s) == 8
+    assert manager.verify_etag(url, writer.result["etag"])
+    assert manager.load_file(url=url) == "test" * LARGE_NUMBER_TO_WRITE
+
+    conn.delete_object(Bucket=TEST_BUCKET, Key=COPIED_FILE_NAME)
+
+
+@pytest.mark.usefixtures("moto_server")
+def test_open_for_write_aborts_on_error():
+    config = get_config()
+    manager = Boto3Manager(config)
+    conn = manager.get_connection("localhost:7000")
+    conn.create_bucket(Bucket=TEST_BUCKET)
+    url = f"s3://localhost:7000/{TEST_BUCKET}/aborted_file"
+
+    with pytest.raises(ValueError):
+        with manager.open_for_write(url) as writer:
+            writer.write(b"partial output")
+            raise ValueError("generator failed")
+
+    assert writer.closed
+    assert manager.head_url(url) is None
+    assert not conn.list_multipart_uploads(Bucket=TEST_BUCKET).get("Uploads")
+
+
+@pytest.mark.usefixtures("moto_server")
+def test_open_for_write_aborts_when_dropped():
+    config = get_config()
+    manager = Boto3Manager(config)
+    conn = manager.get_connection("localhost:7000")
+    conn.create_bucket(Bucket=TEST_BUCKET)
+    url = f"s3://localhost:7000/{TEST_BUCKET}/dropped_file"
+
+    writer = manager.open_for_write(url)
+    writer.write(b"partial")
+    del writer
+    gc.collect()
+
+    assert manager.head_url(url) is None
+    assert not conn.list_multipart_uploads(Bucket=TEST_BUCKET).get("Uploads")
+
+
+@pytest.mark.usefixtures("create_large_object")
+def test_open_for_read_random_access():
+    config = get_config()
+    manager = Boto3Manager(config)
+    url = f"s3://localhost:7000/{TEST_BUCKET}/{ORIGINAL_FILE_NAME}"
+
+    with manager.open_for_read(url, block_size=65536) as reader:
+        assert reader.seekable()
+        reader.seek(-6, io.SEEK_END)
+        assert reader.read() == b"sttest"
+        reader.seek(1000001)
+        assert reader.read(7) == b"esttest"
+        assert reader.tell() == 1000008
+        # only the touched blocks were downloaded
+        assert reader.bytes_fetched == 40000000 % 65536 + 65536
+
+        buffer = bytearray(10)
+        reader.seek(2)
+        assert reader.readinto(buffer) == 10
+        assert buffer == b"sttesttest"
+
+
+@pytest.mark.usefixtures("create_large_object")
+def test_open_for_read_sequential_readahead():
+    config = get_config()
+    manager = Boto3Manager(config)
+    url = f"s3://localhost:7000/{TEST_BUCKET}/{ORIGINAL_FILE_NAME}"
+
+    with manager.open_for_read(url, block_size=65536, max_readahead=8) as reader:
+        md5 = hashlib.md5()
+        for chunk in iter(lambda: reader.read(10000), b""):
+            md5.update(chunk)
+        assert md5.hexdigest() == "bc0354f0646794a755a4276435ec5a6c"
+        assert reader.bytes_fetched == 40000000
+        assert reader._readahead == 8
+
+
+@pytest.mark.usefixtures("moto_server")
+def test_open_for_read_zipfile():
+    config = get_config()
+    manager = Boto3Manager(config)
+    conn = manager.get_connection("localhost:7000")
+    conn.create_bucket(Bucket=TEST_BUCKET)
+    url = f"s3://localhost:7000/{TEST_BUCKET}/archive.zip"
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("big.bin", os.urandom(4 * 1024 * 1024))
+        zip_file.writestr("small.txt", "hello")
+    conn.put_object(Body=archive.getvalue(), Bucket=TEST_BUCKET, Key="archive.zip")
+
+    with manager.open_for_read(url, block_size=65536) as reader:
+        with zipfile.ZipFile(reader) as zip_file:
+            assert zip_file.namelist() == ["big.bin", "small.txt"]
+            assert zip_file.read("small.txt") == b"hello"
+        assert reader.bytes_fetched < 4 * 65536
+
+    conn.delete_object(Bucket=TEST_BUCKET, Key="archive.zip")
+
+
+@pytest.mark.usefixtures("moto_server")
+@pytest.mark.parametrize("use_cache", [False, True])
+@pytest.mark.parametrize("processes", [None, 2])
+def test_load_spreadsheet_from_s3(tmp_path, use_cache, processes):
+    config = get_config()
+    cache = ObjectCache(str(tmp_path)) if use_cache else None
+    manager = Boto3Manager(config, cache=cache)
+    conn = manager.get_connection("localhost:7000")
+    conn.create_bucket(Bucket=TEST_BUCKET)
+
+    wb = openpyxl.Workbook()
+    wb.active.title = "Case Sheet"
+    wb.active.append(["submitter_id", "age"])
+    wb.active.append(["case-1", 42])
+    wb.create_sheet("Samples").append(["submitter_id"])
+    data = io.BytesIO()
+    wb.save(data)
+    conn.put_object(Body=data.getvalue(), Bucket=TEST_BUCKET, Key="workbook.xlsx")
+    url = f"s3://localhost:7000/{TEST_BUCKET}/workbook.xlsx"
+
+    sheets = excel.load_spreadsheet_from_s3(
+        boto_man=manager, uri=url, sheet_names=["Case", "Sample"], processes=processes
+    )
+    assert sheets == {
+        "Case": [{"submitter_id": "case-1", "age": "42"}],
+        "Sample": [],
+    }
+
+    sheets = excel.load_spreadsheet_from_s3(
+        boto_man=manager, uri=url, sheet_names=["Case"], lazy=True
+    )
+    assert list(sheets["Case"]) == [{"submitter_id": "case-1", "age": "42"}]
+
+    conn.delete_object(Bucket=TEST_BUCKET, Key="workbook.xlsx")
@@ -0,0 +1,128 @@
+import io
+import os
+import time
+
+from cdisutils.cache import JSONDiskCache, ObjectCache, TTLCache
+
+URL = "s3://localhost:7000/bucket/key"
+
+
+def test_object_cache_put_get_open(tmp_path):
+    cache = ObjectCache(str(tmp_path))
+    assert cache.get(URL) is None
+
+    cache.put(URL, '"abc123"', io.BytesIO(b"some data"))
+    assert cache.get(URL) == '"abc123"'
+    assert cache.open(URL, '"abc123"')[:] == b"some data"
+
+
+def test_object_cache_replaces_old_version(tmp_path):
+    cache = ObjectCache(str(tmp_path))
+    cache.put(URL, '"v1"', io.BytesIO(b"old"))
+    cache.put(URL, '"v2"', io.BytesIO(b"new"))
+
+    assert cache.get(URL) == '"v2"'
+    assert len(cache.entries()) == 1
+    assert not os.path.exists(cache.path(URL, '"v1"'))
+
+
+def test_object_cache_empty_object(tmp_path):
+    cache = ObjectCache(str(tmp_path))
+    cache.put(URL, '"empty"', io.BytesIO(b""))
+    assert cache.open(URL, '"empty"') == b""
+
+
+def test_object_cache_evicts_least_recently_used(tmp_path):
+    cache = ObjectCache(str(tmp_path), max_size=25)
+    cache.put(URL + "1", '"a"', io.BytesIO(b"x" * 10))
+    cache.put(URL + "2", '"b"', io.BytesIO(b"x" * 10))
+
+    # make the first entry the most recently used one
+    old = time.time() - 100
+    os.utime(cache.path(URL + "2", '"b"'), (old, old))
+
+    cache.put(URL + "3", '"c"', io.BytesIO(b"x" * 10))
+    assert cache.get(URL + "1") == '"a"'
+    assert cache.get(URL + "2") is None
+    assert cache.get(URL + "3") == '"c"'
+
+
+def test_object_cache_keeps_oversized_new_entry(tmp_path):
+    cache = ObjectCache(str(tmp_path), max_size=5)
+    cache.put(URL, '"big"', io.BytesIO(b"x" * 10))
+    assert cache.get(URL) == '"big"'
+
+
+def test_ttl_cache_expires():
+    now = [0.0]
+    cache = TTLCache(ttl=10, clock=lambda: now[0])
+    cache["a"] = 1
+    assert cache["a"] == 1 and "a" in cache
+
+    now[0] = 10
+    assert "a" not in cache
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_lru_size_bound():
+    cache = TTLCache(max_size=10, sizeof=len)
+    cache["a"] = "xxxx"
+    cache["b"] = "xxxx"
+    cache.get("a")
+    cache["c"] = "xxxx"
+
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    assert cache.size == 8
+
+    # too large to ever fit
+    cache["d"] = "x" * 11
+    assert "d" not in cache
+    assert cache.pop("a") == "xxxx"
+    assert cache.size == 4
+
+
+def test_json_disk_cache(tmp_path):
+    cache = JSONDiskCache(str(tmp_path), ttl=60)
+    assert cache.get("phs000178") is None
+
+    cache.set("phs000178", {"ids": ["a", "b"]})
+    assert cache.get("phs000178") == {"ids": ["a", "b"]}
+
+    old = time.time() - 120
+    os.utime(cache.path("phs000178"), (old, old))
+    assert cache.get("phs000178") is None
+    assert cache.get("phs000178", stale=True) == {"ids": ["a", "b"]}
+
+    cache.touch("phs000178")
+    assert cache.get("phs000178") == {"ids": ["a", "b"]}
+
+
+def test_ttl_cache_stale_lookup():
+    now = [0.0]
+    cache = TTLCache(ttl=10, clock=lambda: now[0])
+    cache["a"] = 1
+    now[0] = 10
+
+    assert cache.get("a") is None
+    assert cache.get("a", stale=True) == 1
+    assert cache.pop("a") is None
+    assert cache.get("a", stale=True) is None
+
+
+def test_ttl_cache_set_keeps_expired_entries():
+    now = [0.0]
+    cache = TTLCache(ttl=10, max_size=2, clock=lambda: now[0])
+    cache["a"] = 1
+    cache["b"] = 2
+    now[0] = 10
+
+    # refreshing one entry doesn't drop the others' stale copies
+    cache["a"] = 3
+    assert cache.get("b", stale=True) == 2
+    assert len(cache) == 1
+
+    # they only go when evicted
+    cache["c"] = 4
+    assert cache.get("b", stale=True) is None
@@ -0,0 +1,177 @@
+import hashlib
+import json
+
+from cdisutils import checksum
+from cdisutils.checksum import (
+    HashState,
+    checksum_file,
+    checksum_files,
+    compute_etag,
+    etags_match,
+    multipart_etag,
+)
+
+DATA = bytes(range(256)) * 40
+
+
+def test_hash_state_digests():
+    state = HashState()
+    state.update(DATA[:1000])
+    state.update(DATA[1000:])
+
+    assert state.bytes_hashed == len(DATA)
+    assert state.hexdigests() == {
+        "md5_sum": hashlib.md5(DATA).hexdigest(),
+        "sha256_sum": hashlib.sha256(DATA).hexdigest(),
+    }
+
+
+def test_hash_state_part_boundaries():
+    state = HashState(part_size=4096)
+    for i in range(0, len(DATA), 1000):
+        state.update(DATA[i : i + 1000])
+
+    assert state.part_md5s == [
+        hashlib.md5(DATA[:4096]).hexdigest(),
+        hashlib.md5(DATA[4096:8192]).hexdigest(),
+    ]
+    assert [c["offset"] for c in state.checkpoints] == [4096, 8192]
+    assert state.checkpoints[0]["md5_sum"] == hashlib.md5(DATA[:4096]).hexdigest()
+
+
+def test_hash_state_manual_parts():
+    state = HashState()
+    state.update(DATA[:10])
+    state.end_part()
+    state.update(DATA[10:])
+    state.end_part()
+
+    assert state.part_md5s == [
+        hashlib.md5(DATA[:10]).hexdigest(),
+        hashlib.md5(DATA[10:]).hexdigest(),
+    ]
+
+
+def test_hash_state_rewind_resumes_tail():
+    state = HashState(part_size=4096)
+    state.update(DATA[:6000])
+
+    offset = state.rewind()
+    assert offset == 4096
+    assert state.bytes_hashed == 4096
+
+    state.update(DATA[offset:])
+    assert state.md5.hexdigest() == hashlib.md5(DATA).hexdigest()
+    assert state.sha256.hexdigest() == hashlib.sha256(DATA).hexdigest()
+    assert len(state.part_md5s) == 2
+
+
+def test_hash_state_rewind_to_offset():
+    state = HashState(part_size=1024)
+    state.update(DATA)
+
+    assert state.rewind(offset=3000) == 2048
+    assert len(state.checkpoints) == 2
+    state.update(DATA[2048:])
+    assert state.md5.hexdigest() == hashlib.md5(DATA).hexdigest()
+
+
+def expected_etag(data, part_size):
+    parts = [data[i : i + part_size] for i in range(0, len(data), part_size)] or [b""]
+    digests = b"".join(hashlib.md5(part).digest() for part in parts)
+    return f"{hashlib.md5(digests).hexdigest()}-{len(parts)}"
+
+
+def test_multipart_etag():
+    part_md5s = [
+        hashlib.md5(DATA[:8192]).hexdigest(),
+        hashlib.md5(DATA[8192:]).hexdigest(),
+    ]
+    assert multipart_etag(part_md5s) == expected_etag(DATA, 8192)
+
+
+def test_compute_etag():
+    assert compute_etag(DATA, part_size=4096) == expected_etag(DATA, 4096)
+    chunks = (DATA[i : i + 1000] for i in range(0, len(DATA), 1000))
+    assert compute_etag(chunks, part_size=4096) == expected_etag(DATA, 4096)
+    assert compute_etag(b"") == expected_etag(b"", 1)
+
+
+def test_etags_match():
+    assert etags_match('"abc-2"', "abc-2")
+    assert not etags_match('"abc-2"', '"abc"')
+
+
+def test_hash_state_multipart_etag():
+    state = HashState(part_size=4096)
+    assert state.multipart_etag() == expected_etag(b"", 4096)
+
+    state.update(DATA)
+    # the open part counts as the last one, without being closed
+    assert state.multipart_etag() == expected_etag(DATA, 4096)
+    assert len(state.checkpoints) == 2
+
+
+def test_checksum_file(tmp_path):
+    path = tmp_path / "data"
+    path.write_bytes(DATA)
+
+    assert checksum_file(str(path), part_size=4096, buffer_size=1000) == {
+        "path": str(path),
+        "size": len(DATA),
+        "md5_sum": hashlib.md5(DATA).hexdigest(),
+        "sha256_sum": hashlib.sha256(DATA).hexdigest(),
+        "etag": expected_etag(DATA, 4096),
+        "part_size": 4096,
+    }
+
+
+def test_checksum_empty_file(tmp_path):
+    path = tmp_path / "empty"
+    path.write_bytes(b"")
+
+    result = checksum_file(str(path))
+    assert result["size"] == 0
+    assert result["md5_sum"] == hashlib.md5(b"").hexdigest()
+    assert result["etag"] == expected_etag(b"", 1)
+
+
+def test_checksum_files(tmp_path):
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"file-{i}"
+        path.write_bytes(DATA[: i * 500])
+        paths.append(str(path))
+    paths.insert(5, str(tmp_path / "missing"))
+
+    results = list(checksum_files(paths, max_workers=4, part_size=1024))
+
+    assert [result["path"] for result in results] == paths
+    assert "error" in results[5]
+    assert results[6]["md5_sum"] == hashlib.md5(DATA[:2500]).hexdigest()
+    assert results[6]["etag"] == expected_etag(DATA[:2500], 1024)
+
+
+def test_checksum_cli(tmp_path, capsys):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b").write_bytes(DATA)
+    (tmp_path / "a").write_bytes(DATA[:10])
+
+    assert checksum.main([str(tmp_path), "--part-size", "4096", "--json"]) == 0
+    results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [r["path"] for r in results] == [
+        str(tmp_path / "a"),
+        str(tmp_path / "sub" / "b"),
+    ]
+    assert results[1]["etag"] == expected_etag(DATA, 4096)
+
+    assert checksum.main([str(tmp_path / "a"), str(tmp_path / "missing")]) == 1
+    out, err = capsys.readouterr()
+    assert out.split() == [
+        hashlib.md5(DATA[:10]).hexdigest(),
+        hashlib.sha256(DATA[:10]).hexdigest(),
+        expected_etag(DATA[:10], checksum.DEFAULT_PART_SIZE),
+        "10",
+        str(tmp_path / "a"),
+    ]
+    assert "missing" in err
@@ -0,0 +1,504 @@
+import contextlib
+import logging
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import ModuleType, SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+from xml.parsers.expat import ExpatError
+
+import pytest
+
+from cdisutils import dbgap
+
+
+def make_telemetry(accession, status, submitter_ids):
+    samples = "".join(
+        f'<Sample submitted_subject_id="{s}" sample_num="1"/>' for s in submitter_ids
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<DbGap><Study accession="{accession}" registration_status="{status}">'
+        f"<SampleList>{samples}</SampleList></Study></DbGap>"
+    )
+
+
+class TelemetryHandler(BaseHTTPRequestHandler):
+    """Serves the reports of the server it's attached to, by study_id"""
+
+    def do_GET(self):
+        phsid = parse_qs(urlparse(self.path).query)["study_id"][0]
+        with self.server.lock:
+            self.server.requests.append(phsid)
+            failing = self.server.failures.get(phsid, 0)
+            self.server.failures[phsid] = failing - 1
+        report = self.server.reports.get(phsid)
+        if failing > 0:
+            self.send_error(503)
+            return
+        if report is None:
+            self.send_error(400)
+            return
+        etag = '"{}"'.format(hash(report))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = report.encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def telemetry_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TelemetryHandler)
+    server.reports = {}
+    server.requests = []
+    server.failures = {}
+    server.lock = threading.Lock()
+    server.url = (
+        f"http://127.0.0.1:{server.server_port}/GetSampleStatus.cgi"
+        "?study_id={phsid}&rettype=xml"
+    )
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_project(code, accession, bypassed_cases=None):
+    return SimpleNamespace(
+        code=code,
+        dbgap_accession_number=accession,
+        programs=[SimpleNamespace(dbgap_accession_number=None)],
+        sysan={"dbgap_bypassed_cases": bypassed_cases or []},
+    )
+
+
+@pytest.fixture
+def referencer(monkeypatch):
+    projects = {
+        ("TCGA", "BRCA"): make_project("BRCA", "phs000178.v11.p8", ["case-x"]),
+        ("TCGA", "LUAD"): make_project("LUAD", "phs000179.v1.p1"),
+    }
+    reports = {
+        "phs000178.v11.p8": make_telemetry(
+            "phs000178.v11.p8", "released", ["case-1", "case-2"]
+        ),
+        "phs000179.v1.p1": make_telemetry("phs000179.v1.p1", "released", ["case-3"]),
+    }
+    return make_referencer(monkeypatch, projects, reports)
+
+
+def make_referencer(monkeypatch, projects, reports, **kwargs):
+    referencer = dbgap.dbGaPXReferencer(db=None, **kwargs)
+    calls = {"query_projects": 0, "fetch": 0}
+
+    def query_projects(keys):
+        calls["query_projects"] += 1
+        return [
+            dbgap.ProjectRecord(
+                program_name=name,
+                project_code=code,
+                accession=projects[(name, code)].dbgap_accession_number,
+                bypassed_cases=frozenset(
+                    projects[(name, code)].sysan["dbgap_bypassed_cases"]
+                ),
+            )
+            for name, code in keys
+            if (name, code) in projects
+        ]
+
+    def fetch_telemetry(phsid, stale=None, quiet=False):
+        calls["fetch"] += 1
+        return dbgap.parse_telemetry(reports[phsid])
+
+    monkeypatch.setattr(referencer, "_query_projects", query_projects)
+    monkeypatch.setattr(referencer, "_fetch_telemetry", fetch_telemetry)
+    referencer.calls = calls
+    referencer.reports = reports
+    return referencer
+
+
+def test_case_exists(referencer):
+    assert referencer.case_exists("TCGA", "BRCA", "case-1")
+    assert not referencer.case_exists("TCGA", "BRCA", "case-3")
+    assert referencer.case_exists("TCGA", "BRCA", "case-x")
+
+
+def test_cases_exist_resolves_once(referencer):
+    ids = ["case-1", "case-2", "case-3", "case-x"] * 100
+    assert referencer.cases_exist("TCGA", "BRCA", ids) == {
+        "case-1": True,
+        "case-2": True,
+        "case-3": False,
+        "case-x": True,
+    }
+    assert referencer.calls == {"query_projects": 1, "fetch": 1}
+
+
+def test_registered_cases_are_cached(referencer):
+    referencer.cases_exist("TCGA", "BRCA", ["case-1"])
+    referencer.cases_exist("TCGA", "BRCA", ["case-2"])
+    assert referencer.calls["fetch"] == 1
+
+
+def test_bypassed_cases_skip_telemetry(referencer):
+    assert referencer.cases_exist("TCGA", "BRCA", ["case-x"]) == {"case-x": True}
+    assert referencer.calls["fetch"] == 0
+
+
+def test_projects_cases_exist(referencer):
+    assert referencer.projects_cases_exist(
+        {("TCGA", "BRCA"): ["case-1", "case-3"], ("TCGA", "LUAD"): ["case-3"]}
+    ) == {
+        ("TCGA", "BRCA"): {"case-1": True, "case-3": False},
+        ("TCGA", "LUAD"): {"case-3": True},
+    }
+    assert referencer.calls == {"query_projects": 1, "fetch": 2}
+
+
+def test_resolve_projects_index(referencer):
+    brca = referencer.resolve_project("TCGA", "BRCA")
+    assert brca.accession == "phs000178.v11.p8"
+    assert brca.bypassed_cases == {"case-x"}
+
+    records = referencer.resolve_projects([("TCGA", "LUAD"), ("TCGA", "BRCA")])
+    assert list(records) == [("TCGA", "LUAD"), ("TCGA", "BRCA")]
+    assert records[("TCGA", "BRCA")] is brca
+    assert referencer.calls["query_projects"] == 2
+
+    with pytest.raises(dbgap.InternalError):
+        referencer.resolve_projects([("TCGA", "BRCA"), ("TCGA", "NOPE")])
+
+
+class FakeQuery:
+    """Just enough of a psqlgraph query for _query_projects"""
+
+    def __init__(self, db, rows):
+        self.db = db
+        self.rows = rows
+
+    def prop_in(self, key, values):
+        self.db.filters.append((key, sorted(values)))
+        return self
+
+    def path(self, *paths):
+        self.db.filters.append(("path",) + paths)
+        return self
+
+    def add_entity(self, entity):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class FakeDB:
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.queries = 0
+
+    @contextlib.contextmanager
+    def session_scope(self):
+        yield
+
+    def nodes(self, entity):
+        self.queries += 1
+        return FakeQuery(self, self.rows)
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """Stand-in gdcdatamodel2.models, the FakeDB doesn't look at the entities"""
+    package = ModuleType("gdcdatamodel2")
+    package.models = ModuleType("gdcdatamodel2.models")
+    package.models.Program = type("Program", (), {})
+    package.models.Project = type("Project", (), {})
+    monkeypatch.setitem(sys.modules, "gdcdatamodel2", package)
+    monkeypatch.setitem(sys.modules, "gdcdatamodel2.models", package.models)
+    return package.models
+
+
+@pytest.mark.usefixtures("models")
+def test_query_projects_bulk():
+    tcga = SimpleNamespace(name="TCGA", dbgap_accession_number="phs000178")
+    target = SimpleNamespace(name="TARGET", dbgap_accession_number="phs000218")
+    rows = [
+        (make_project("BRCA", None, ["case-x"]), tcga),
+        (make_project("LUAD", "phs000179.v1.p1"), tcga),
+        (make_project("LUAD", None), target),
+    ]
+    db = FakeDB(rows)
+    referencer = dbgap.dbGaPXReferencer(db=db)
+
+    records = referencer.resolve_projects([("TCGA", "BRCA"), ("TARGET", "LUAD")])
+
+    assert db.queries == 1
+    assert db.filters == [
+        ("code", ["BRCA", "LUAD"]),
+        ("path", "programs"),
+        ("name", ["TARGET", "TCGA"]),
+    ]
+    assert records == {
+        ("TCGA", "BRCA"): dbgap.ProjectRecord(
+            "TCGA", "BRCA", "phs000178", frozenset(["case-x"])
+        ),
+        ("TARGET", "LUAD"): dbgap.ProjectRecord(
+            "TARGET", "LUAD", "phs000218", frozenset()
+        ),
+    }
+
+
+def test_parse_telemetry():
+    report = dbgap.parse_telemetry(
+        make_telemetry("phs000179.v1.p1", "released", ["case-3"]), etag='"abc"'
+    )
+    assert report == dbgap.TelemetryReport(
+        accession="phs000179.v1.p1",
+        registration_status="released",
+        submitter_ids=frozenset(["case-3"]),
+        etag='"abc"',
+        last_modified=None,
+    )
+    assert (
+        dbgap.parse_telemetry(
+            make_telemetry("phs000179.v1.p1", "released", [])
+        ).submitter_ids
+        == frozenset()
+    )
+
+
+def test_parse_telemetry_streams_chunks():
+    xml = make_telemetry("phs000178.v11.p8", "released", ["a", "b", "a"]).encode()
+    chunks = (xml[i : i + 7] for i in range(0, len(xml), 7))
+    report = dbgap.parse_telemetry(chunks)
+    assert report.accession == "phs000178.v11.p8"
+    assert report.submitter_ids == frozenset(["a", "b"])
+
+
+def test_parse_telemetry_malformed():
+    with pytest.raises(ExpatError):
+        dbgap.parse_telemetry("<DbGap><Study>")
+
+
+def test_fetch_telemetry_streams_response(monkeypatch):
+    xml = make_telemetry("phs000179.v1.p1", "released", ["case-3"]).encode()
+    requested = {}
+
+    def get(url, **kwargs):
+        requested.update(kwargs, url=url)
+        return SimpleNamespace(
+            status_code=200,
+            headers={"ETag": '"v1"'},
+            iter_content=lambda size: iter([xml[:10], xml[10:]]),
+            close=lambda: None,
+        )
+
+    referencer = dbgap.dbGaPXReferencer(db=None)
+    monkeypatch.setattr(referencer.session, "get", get)
+    report = referencer.get_telemetry("phs000179.v1.p1")
+
+    assert requested["stream"] is True
+    assert requested["timeout"] == dbgap.DEFAULT_TIMEOUT
+    assert "phs000179.v1.p1" in requested["url"]
+    assert report.submitter_ids == frozenset(["case-3"])
+    assert report.etag == '"v1"'
+
+
+def test_unreleased_report_uses_previous_version(referencer):
+    referencer.reports["phs000179.v1.p1"] = make_telemetry(
+        "phs000179.v1.p1", "pending", ["case-3", "case-new"]
+    )
+    referencer.reports["phs000179.v0.p1"] = make_telemetry(
+        "phs000179.v0.p1", "released", ["case-3"]
+    )
+    assert referencer.cases_exist("TCGA", "LUAD", ["case-3", "case-new"]) == {
+        "case-3": True,
+        "case-new": False,
+    }
+
+
+def test_telemetry_cache_expires(monkeypatch, referencer):
+    now = [0.0]
+    referencer._telemetry.clock = lambda: now[0]
+    referencer.get_telemetry("phs000179.v1.p1")
+    referencer.get_telemetry("phs000179.v1.p1")
+    assert referencer.calls["fetch"] == 1
+
+    now[0] += dbgap.DEFAULT_TELEMETRY_TTL
+    referencer.get_telemetry("phs000179.v1.p1")
+    assert referencer.calls["fetch"] == 2
+
+
+def test_telemetry_disk_cache_is_shared(monkeypatch, referencer, tmp_path):
+    projects = {("TCGA", "LUAD"): make_project("LUAD", "phs000179.v1.p1")}
+    first = make_referencer(
+        monkeypatch, projects, referencer.reports, cache_dir=str(tmp_path)
+    )
+    second = make_referencer(
+        monkeypatch, projects, referencer.reports, cache_dir=str(tmp_path)
+    )
+
+    assert first.cases_exist("TCGA", "LUAD", ["case-3"]) == {"case-3": True}
+    assert second.cases_exist("TCGA", "LUAD", ["case-3"]) == {"case-3": True}
+    assert first.calls["fetch"] == 1
+    assert second.calls["fetch"] == 0
+
+
+def test_single_sample_report(referencer):
+    assert referencer.cases_exist("TCGA", "LUAD", ["case-3"]) == {"case-3": True}
+
+
+def test_prefetch_telemetry(telemetry_server, caplog):
+    telemetry_server.reports.update(
+        {
+            "phs000178.v2.p1": make_telemetry(
+                "phs000178.v2.p1", "released", ["case-1", "case-2"]
+            ),
+            "phs000179.v2.p1": make_telemetry(
+                "phs000179.v2.p1", "pending", ["case-3", "case-4"]
+            ),
+            "phs000179.v1.p1": make_telemetry(
+                "phs000179.v1.p1", "released", ["case-3"]
+            ),
+        }
+    )
+    referencer = dbgap.dbGaPXReferencer(db=None)
+    referencer.DEFAULT_URL = telemetry_server.url
+
+    with caplog.at_level(logging.DEBUG, logger=referencer.logger.name):
+        reports = referencer.prefetch_telemetry(
+            ["phs000178.v2.p1", "phs000179.v2.p1", "phs000180.v1.p1"]
+        )
+
+    assert reports["phs000178.v2.p1"].submitter_ids == {"case-1", "case-2"}
+    assert reports["phs000179.v2.p1"].accession == "phs000179.v1.p1"
+    assert "phs000180.v1.p1" not in reports
+    # every previous version but v0 was fetched speculatively, alongside
+    # the rest
+    assert sorted(telemetry_server.requests) == [
+        "phs000178.v1.p1",
+        "phs000178.v2.p1",
+        "phs000179.v1.p1",
+        "phs000179.v2.p1",
+        "phs000180.v1.p1",
+    ]
+    # the missing speculative phs000178.v1.p1 isn't an error, the requested
+    # phs000180.v1.p1 is
+    levels = [record.levelno for record in caplog.records]
+    assert levels.count(logging.ERROR) == 1
+    assert levels.count(logging.DEBUG) == 1
+
+    project = make_project("LUAD", "phs000179.v2.p1")
+    assert referencer.get_registered_cases(project) == {"case-3"}
+    assert len(telemetry_server.requests) == 5
+
+
+def test_prefetch_telemetry_not_speculative(telemetry_server):
+    telemetry_server.reports.update(
+        {
+            "phs000179.v2.p1": make_telemetry("phs000179.v2.p1", "pending", []),
+            "phs000179.v1.p1": make_telemetry("phs000179.v1.p1", "released", ["a"]),
+        }
+    )
+    referencer = dbgap.dbGaPXReferencer(db=None)
+    referencer.DEFAULT_URL = telemetry_server.url
+
+    reports = referencer.prefetch_telemetry(["phs000179.v2.p1"], speculative=False)
+    assert reports["phs000179.v2.p1"].submitter_ids == {"a"}
+    assert telemetry_server.requests == ["phs000179.v2.p1", "phs000179.v1.p1"]
+
+
+def test_expired_telemetry_is_revalidated(telemetry_server):
+    phsid = "phs000179.v1.p1"
+    telemetry_server.reports[phsid] = make_telemetry(phsid, "released", ["a"])
+    now = [0.0]
+    referencer = dbgap.dbGaPXReferencer(
+        db=None, telemetry_cache=dbgap.TTLCache(ttl=60, clock=lambda: now[0])
+    )
+    referencer.DEFAULT_URL = telemetry_server.url
+
+    first = referencer.get_telemetry(phsid)
+    now[0] += 60
+    # unchanged, so the 304 reuses the cached report
+    assert referencer.get_telemetry(phsid) is first
+
+    telemetry_server.reports[phsid] = make_telemetry(phsid, "released", ["a", "b"])
+    now[0] += 60
+    assert referencer.get_telemetry(phsid).submitter_ids == {"a", "b"}
+    assert telemetry_server.requests == [phsid] * 3
+
+
+def test_expired_telemetry_is_all_revalidated(telemetry_server):
+    phsids = ["phs000178.v1.p1", "phs000179.v1.p1"]
+    for phsid in phsids:
+        telemetry_server.reports[phsid] = make_telemetry(phsid, "released", ["a"])
+    now = [0.0]
+    referencer = dbgap.dbGaPXReferencer(
+        db=None, telemetry_cache=dbgap.TTLCache(ttl=60, clock=lambda: now[0])
+    )
+    referencer.DEFAULT_URL = telemetry_server.url
+
+    first = {phsid: referencer.get_telemetry(phsid) for phsid in phsids}
+    now[0] += 60
+    # refreshing one report keeps the other's stale copy to revalidate,
+    # so both come back as 304s reusing the cached reports
+    for phsid in phsids:
+        assert referencer.get_telemetry(phsid) is first[phsid]
+    assert sorted(telemetry_server.requests) == sorted(phsids * 2)
+
+
+def test_stale_disk_cache_is_revalidated(telemetry_server, tmp_path):
+    phsid = "phs000179.v1.p1"
+    telemetry_server.reports[phsid] = make_telemetry(phsid, "released", ["a"])
+    referencer = dbgap.dbGaPXReferencer(db=None, cache_dir=str(tmp_path))
+    referencer.DEFAULT_URL = telemetry_server.url
+    referencer.get_telemetry(phsid)
+
+    path = referencer._disk_cache.path(phsid)
+    os.utime(path, (0, 0))
+    restarted = dbgap.dbGaPXReferencer(db=None, cache_dir=str(tmp_path))
+    restarted.DEFAULT_URL = telemetry_server.url
+
+    assert restarted.get_telemetry(phsid).submitter_ids == {"a"}
+    assert len(telemetry_server.requests) == 2
+    # the 304 marks the disk copy as fresh again
+    assert os.stat(path).st_mtime > 0
+
+
+def test_transient_errors_are_retried(telemetry_server):
+    phsid = "phs000179.v1.p1"
+    telemetry_server.reports[phsid] = make_telemetry(phsid, "released", ["a"])
+    telemetry_server.failures[phsid] = 1
+    referencer = dbgap.dbGaPXReferencer(db=None)
+    referencer.DEFAULT_URL = telemetry_server.url
+
+    assert referencer.get_telemetry(phsid).submitter_ids == {"a"}
+    assert telemetry_server.requests == [phsid] * 2
+
+
+def test_assert_project_exists(telemetry_server):
+    phsid = "phs000179.v1.p1"
+    telemetry_server.reports[phsid] = make_telemetry(phsid, "released", ["a"])
+    referencer = dbgap.dbGaPXReferencer(db=None, retries=0)
+    referencer.DEFAULT_URL = telemetry_server.url
+
+    referencer.assert_project_exists("LUAD", phsid)
+    with pytest.raises(dbgap.UserError):
+        referencer.assert_project_exists("NOPE", "phs999999.v1.p1")
+
+    # the report pulled by the check is reused
+    assert referencer.get_registered_cases(make_project("LUAD", phsid)) == {"a"}
+    assert telemetry_server.requests == [phsid, "phs999999.v1.p1"]
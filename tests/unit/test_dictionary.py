@@ -0,0 +1,223 @@
+import copy
+import sys
+
+import pytest
+
+from cdisutils.dictionary import (
+    Change,
+    diff_trees,
+    fingerprint,
+    first_difference,
+    iter_diff,
+    remove_keys_from_dict,
+    sort_dict,
+)
+
+TREE = {
+    "id": "case-1",
+    "updated_datetime": "2020-01-01",
+    "tags": ["b", "c", "a"],
+    "samples": [
+        {"id": "s2", "updated_datetime": "x", "portions": [3, 1, 2]},
+        {"id": "s1", "aliquots": [{"ids": ["z", "y"], "updated_datetime": "y"}]},
+    ],
+    "project": {"code": "BRCA", "program": {"name": "TCGA"}},
+    "empty": [],
+}
+
+
+def deep_tree(depth):
+    tree = {"leaf": ["b", "a"], "drop": 1}
+    for _ in range(depth):
+        tree = {"child": [tree], "drop": 1}
+    return tree
+
+
+def test_sort_dict():
+    tree = {"b": [3, 1, 2], "a": {"c": ["y", "x"], "drop": 1}, "drop": 2}
+    result = sort_dict(tree, remove_keys=["drop"])
+
+    assert result == {"b": [1, 2, 3], "a": {"c": ["x", "y"]}}
+    assert list(result) == ["b", "a"]
+    # the input is left alone
+    assert tree["b"] == [3, 1, 2]
+
+
+def test_sort_dict_scalars():
+    assert sort_dict("value") == "value"
+    assert sort_dict(None) is None
+    assert sort_dict([2, 1]) == [1, 2]
+
+
+def test_sort_dict_unorderable():
+    with pytest.raises(TypeError):
+        sort_dict([{"a": 1}, {"b": 2}])
+
+
+def test_remove_keys_from_dict():
+    result = remove_keys_from_dict(TREE, ["updated_datetime"])
+
+    assert "updated_datetime" not in result
+    assert "updated_datetime" not in result["samples"][0]
+    assert result["samples"][1]["aliquots"] == [{"ids": ["z", "y"]}]
+    assert result["tags"] == ["b", "c", "a"]
+    assert TREE["samples"][0]["updated_datetime"] == "x"
+
+
+def test_remove_no_keys_returns_tree():
+    assert remove_keys_from_dict(TREE, None) is TREE
+    assert remove_keys_from_dict(TREE, []) is TREE
+
+
+@pytest.mark.parametrize("func", [sort_dict, remove_keys_from_dict])
+def test_in_place_matches_copy(func):
+    tree = copy.deepcopy(TREE)
+    tree["samples"] = [{"id": "s1", "updated_datetime": "x", "portions": [3, 1]}]
+
+    expected = func(tree, ["updated_datetime"])
+    result = func(tree, ["updated_datetime"], in_place=True)
+
+    assert result is tree
+    assert result == expected
+
+
+@pytest.mark.parametrize("in_place", [False, True])
+def test_deeper_than_recursion_limit(in_place):
+    depth = sys.getrecursionlimit() * 2
+    tree = sort_dict(deep_tree(depth), remove_keys={"drop"}, in_place=in_place)
+
+    for _ in range(depth):
+        assert list(tree) == ["child"]
+        tree = tree["child"][0]
+    assert tree == {"leaf": ["a", "b"]}
+
+
+def shuffled(tree):
+    """A copy of ``tree`` with every dict and list in reverse order"""
+    if isinstance(tree, dict):
+        return {key: shuffled(tree[key]) for key in reversed(list(tree))}
+    if isinstance(tree, list):
+        return [shuffled(element) for element in reversed(tree)]
+    return tree
+
+
+def test_fingerprint_ignores_order():
+    assert fingerprint(TREE) == fingerprint(shuffled(TREE))
+    assert fingerprint(TREE) == fingerprint(copy.deepcopy(TREE))
+    assert len(fingerprint(TREE)) == 32
+
+
+def test_fingerprint_remove_keys():
+    changed = copy.deepcopy(TREE)
+    changed["samples"][1]["aliquots"][0]["updated_datetime"] = "z"
+
+    assert fingerprint(changed) != fingerprint(TREE)
+    assert fingerprint(changed, ["updated_datetime"]) == fingerprint(
+        TREE, remove_keys=["updated_datetime"]
+    )
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        (1, 1.0),
+        (1, True),
+        ("1", 1),
+        ([1, 1, 2], [1, 2, 2]),
+        ({"a": [1]}, {"a": 1}),
+        ({"a": 1}, {"b": 1}),
+        ([], {}),
+        ([["a", "b"]], [["a"], ["b"]]),
+    ],
+)
+def test_fingerprint_differs(a, b):
+    assert fingerprint(a) != fingerprint(b)
+
+
+def test_fingerprint_deeper_than_recursion_limit():
+    depth = sys.getrecursionlimit() * 2
+    assert fingerprint(deep_tree(depth)) == fingerprint(deep_tree(depth))
+    assert fingerprint(deep_tree(depth)) != fingerprint(deep_tree(depth + 1))
+
+
+def test_first_difference():
+    assert first_difference(TREE, shuffled(TREE)) is None
+
+    changed = copy.deepcopy(TREE)
+    changed["project"]["program"]["name"] = "TARGET"
+    assert first_difference(TREE, changed) == ("project", "program", "name")
+
+    changed = copy.deepcopy(TREE)
+    del changed["project"]["code"]
+    assert first_difference(TREE, changed) == ("project",)
+
+    changed = copy.deepcopy(TREE)
+    changed["samples"][0]["portions"].append(4)
+    assert first_difference(TREE, changed) == ("samples",)
+
+    assert first_difference({"a": 1}, {"a": 1.0}) == ("a",)
+    assert first_difference([1], [1.0]) == ()
+    assert first_difference(1, "1") == ()
+
+
+def test_first_difference_remove_keys():
+    changed = copy.deepcopy(TREE)
+    changed["updated_datetime"] = "later"
+    changed["samples"][1]["aliquots"][0]["updated_datetime"] = "later"
+
+    assert first_difference(TREE, changed) == ("updated_datetime",)
+    assert first_difference(TREE, changed, remove_keys=["updated_datetime"]) is None
+
+
+def test_diff_trees_equivalent():
+    assert diff_trees(TREE, shuffled(TREE)) == []
+    assert diff_trees(1, 1) == []
+
+
+def test_diff_trees():
+    changed = copy.deepcopy(TREE)
+    changed["project"]["program"]["name"] = "TARGET"
+    del changed["project"]["code"]
+    changed["project"]["disease"] = "BRCA"
+    changed["tags"] = ["c", "a", "d"]
+    # reordered, with a change inside the moved sample
+    changed["samples"].reverse()
+    changed["samples"][1]["portions"] = [1, 2]
+    changed["updated_datetime"] = "later"
+
+    assert diff_trees(TREE, changed, remove_keys=["updated_datetime"]) == [
+        Change("remove", ("tags", 0), "b", None),
+        Change("add", ("tags", 2), None, "d"),
+        Change("remove", ("samples", 0, "portions", 0), 3, None),
+        Change("remove", ("project", "code"), "BRCA", None),
+        Change("change", ("project", "program", "name"), "TCGA", "TARGET"),
+        Change("add", ("project", "disease"), None, "BRCA"),
+    ]
+
+
+def test_diff_trees_types():
+    assert diff_trees({"a": 1}, {"a": 1.0}) == [Change("change", ("a",), 1, 1.0)]
+    assert diff_trees({"a": []}, {"a": {}}) == [Change("change", ("a",), [], {})]
+    assert diff_trees([1], "x") == [Change("change", (), [1], "x")]
+
+
+def test_iter_diff_is_lazy():
+    a = {"first": 1, "second": {"x": 1}}
+    b = {"first": 2, "second": {"x": 2}}
+    changes = iter_diff(a, b)
+    assert next(changes) == Change("change", ("first",), 1, 2)
+    assert next(changes) == Change("change", ("second", "x"), 1, 2)
+    assert next(changes, None) is None
+
+
+def test_diff_trees_deeper_than_recursion_limit():
+    depth = sys.getrecursionlimit() * 2
+    a, b = deep_tree(depth), deep_tree(depth)
+    leaf = b
+    for _ in range(depth):
+        leaf = leaf["child"][0]
+    leaf["leaf"] = ["a", "c"]
+
+    changes = diff_trees(a, b)
+    assert [change.op for change in changes] == ["remove", "add"]
+    assert changes[0].path == ("child", 0) * depth + ("leaf", 0)
@@ -0,0 +1,171 @@
+import io
+
+import openpyxl
+import pytest
+
+from cdisutils import excel
+
+
+def make_workbook(rows, title="Cases"):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = title
+    for row in rows:
+        ws.append(row)
+    data = io.BytesIO()
+    wb.save(data)
+    data.seek(0)
+    return data
+
+
+ROWS = [
+    ["submitter_id", "age", "notes"],
+    [" case-1 ", 42, "first"],
+    [None, None, None],
+    ["case-2", 7, None],
+]
+
+
+@pytest.fixture(params=[False, True], ids=["regular", "read_only"])
+def worksheet(request):
+    wb = openpyxl.load_workbook(make_workbook(ROWS), read_only=request.param)
+    return wb["Cases"]
+
+
+def test_read_sheet(worksheet):
+    assert excel.read_sheet(ws=worksheet) == [
+        {"submitter_id": "case-1", "age": "42", "notes": "first"},
+        {"submitter_id": "case-2", "age": "7", "notes": "None"},
+    ]
+
+
+def test_iter_sheet_is_lazy(worksheet):
+    rows = excel.iter_sheet(ws=worksheet)
+    assert next(rows) == {"submitter_id": "case-1", "age": "42", "notes": "first"}
+
+
+@pytest.mark.parametrize("read_only", [False, True])
+def test_read_sheet_skips_blank_rows(read_only):
+    rows = [["submitter_id", "age"], ["  ", 0], [None, False], [0, " 1 "]]
+    wb = openpyxl.load_workbook(make_workbook(rows), read_only=read_only)
+    assert excel.read_sheet(ws=wb["Cases"]) == [{"submitter_id": "0", "age": "1"}]
+
+
+def test_iter_sheet_values(worksheet):
+    header, rows = excel.iter_sheet_values(ws=worksheet)
+    assert header == ["submitter_id", "age", "notes"]
+    assert list(rows) == [("case-1", "42", "first"), ("case-2", "7", "None")]
+
+
+def test_read_columns(worksheet):
+    assert excel.read_columns(worksheet) == {
+        "submitter_id": ["case-1", "case-2"],
+        "age": [42, 7],
+        "notes": ["first"],
+    }
+
+
+def test_read_sheet_two_headers():
+    rows = [["case", None, "sample"], ["id", "age", "id"], ["c1", 3, "s1"]]
+    wb = openpyxl.load_workbook(make_workbook(rows), read_only=True)
+    assert excel.read_sheet(ws=wb["Cases"], num_headers=2) == [
+        {"case id": "c1", "case age": "3", "sample id": "s1"}
+    ]
+
+
+def test_open_workbook_is_read_only():
+    wb = excel.open_workbook(make_workbook(ROWS), "cases.xlsx")
+    assert wb.read_only
+    assert wb.sheetnames == ["Cases"]
+
+
+def test_match_sheets():
+    sheetnames = ["Case Sheet", "Sample Sheet", "Sample Sheet (old)", "Notes"]
+    assert excel.match_sheets(sheetnames, ["Case", "Sample", "Missing"]) == {
+        "Case": "Case Sheet",
+        "Sample": "Sample Sheet (old)",
+    }
+
+
+def test_read_sheets_from_file(tmp_path):
+    wb = openpyxl.Workbook()
+    wb.active.title = "Cases"
+    for row in ROWS:
+        wb.active.append(row)
+    wb.create_sheet("Samples").append(["submitter_id"])
+    wb["Samples"].append(["sample-1"])
+    path = str(tmp_path / "workbook.xlsx")
+    wb.save(path)
+
+    sheets = {"Case": "Cases", "Sample": "Samples"}
+    assert excel.read_sheets_from_file(path, sheets, processes=2) == {
+        "Case": [
+            {"submitter_id": "case-1", "age": "42", "notes": "first"},
+            {"submitter_id": "case-2", "age": "7", "notes": "None"},
+        ],
+        "Sample": [{"submitter_id": "sample-1"}],
+    }
+
+
+class StubManager:
+    """Just enough of a Boto3Manager to load a workbook from"""
+
+    cache = None
+
+    def __init__(self, data):
+        self.data = data
+
+    def open_for_read(self, uri):
+        return self.data
+
+
+def make_two_sheet_workbook():
+    data = make_workbook(ROWS)
+    wb = openpyxl.load_workbook(data)
+    wb.create_sheet("Samples").append(["submitter_id"])
+    data = io.BytesIO()
+    wb.save(data)
+    data.seek(0)
+    return data
+
+
+def test_load_spreadsheet_from_s3_closes_source():
+    data = make_workbook(ROWS)
+    sheets = excel.load_spreadsheet_from_s3(
+        boto_man=StubManager(data),
+        uri="s3://host/bucket/cases.xlsx",
+        sheet_names=["Case"],
+    )
+    assert len(sheets["Case"]) == 2
+    assert data.closed
+
+
+def test_load_spreadsheet_from_s3_lazy_closes_source():
+    data = make_two_sheet_workbook()
+    sheets = excel.load_spreadsheet_from_s3(
+        boto_man=StubManager(data),
+        uri="s3://host/bucket/cases.xlsx",
+        sheet_names=["Case", "Sample"],
+        lazy=True,
+    )
+
+    assert len(list(sheets["Case"])) == 2
+    # still read by the other sheet
+    assert not data.closed
+    sheets["Sample"].close()
+    assert data.closed
+    assert list(sheets["Sample"]) == []
+
+
+def test_load_spreadsheet_from_s3_lazy_closes_source_when_collected():
+    data = make_workbook(ROWS)
+    sheets = excel.load_spreadsheet_from_s3(
+        boto_man=StubManager(data),
+        uri="s3://host/bucket/cases.xlsx",
+        sheet_names=["Case"],
+        lazy=True,
+    )
+    next(sheets["Case"])
+
+    del sheets
+    assert data.closed
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ["boto3", "openpyxl", "requests", "xmltodict", "gdcdatamodel2"]
+
+
+def imported_modules(code):
+    """Names of the top level packages imported by running ``code`` in a
+    fresh interpreter, from ``python -X importtime``"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return {
+        line.rsplit("|", 1)[1].strip().split(".")[0]
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import cdisutils",
+        "import cdisutils.storage3, cdisutils.excel, cdisutils.dbgap",
+        "from cdisutils.storage3 import Boto3Manager; Boto3Manager()",
+    ],
+)
+def test_heavy_dependencies_not_imported(code):
+    imported = imported_modules(code)
+    assert not imported & set(HEAVY_MODULES)
+    assert "cdisutils" in imported
+
+
+def test_submodules_load_on_access():
+    imported = imported_modules("import cdisutils; cdisutils.storage3.Boto3Manager")
+    assert "botocore" in imported
+    assert "boto3" not in imported
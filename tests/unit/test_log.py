@@ -0,0 +1,155 @@
+import json
+import logging
+import queue
+import uuid
+
+import pytest
+
+from cdisutils import log
+
+
+@pytest.fixture
+def name():
+    name = f"test-{uuid.uuid4()}"
+    yield name
+    log.configure_logging()
+    log.stop_queue_logging()
+    log.LOGGERS.pop(name, None)
+    log._handlers.pop(name, None)
+
+
+def make_record(message):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+
+
+def make_event(event, **fields):
+    return make_record(log.EventMessage(event, fields))
+
+
+def test_get_logger_cached(name, capsys):
+    logger = log.get_logger(name)
+
+    assert log.get_logger(name) is logger
+    assert log.LOGGERS[name] is logger
+    assert len(logger.handlers) == 1
+
+    logger.info("hello")
+    assert capsys.readouterr().out.endswith("hello\n")
+
+
+def test_queue_logging(name, capsys):
+    before = log.get_logger(name)
+    handler = log.start_queue_logging()
+    after = log.get_logger(f"{name}-after")
+    try:
+        assert before.handlers == [handler]
+        assert after.handlers == [handler]
+
+        before.info("one")
+        after.info("two %s", "args")
+    finally:
+        log.stop_queue_logging()
+        log.LOGGERS.pop(f"{name}-after")
+        log._handlers.pop(f"{name}-after")
+
+    # stopping writes out everything queued
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.rsplit("] ", 1)[1] for line in lines] == ["one", "two args"]
+    assert len(before.handlers) == 1
+    assert type(before.handlers[0]) is logging.StreamHandler
+
+
+@pytest.mark.parametrize(
+    "drop_policy, expected", [("new", ["0", "1"]), ("oldest", ["2", "3"])]
+)
+def test_drop_policy(drop_policy, expected):
+    log_queue = queue.Queue(maxsize=2)
+    handler = log.DroppingQueueHandler(log_queue, drop_policy=drop_policy)
+
+    for i in range(4):
+        handler.emit(make_record(str(i)))
+
+    assert handler.dropped == 2
+    assert [log_queue.get_nowait().getMessage() for _ in range(2)] == expected
+
+
+def test_invalid_drop_policy():
+    with pytest.raises(ValueError):
+        log.DroppingQueueHandler(queue.Queue(), drop_policy="block")
+
+
+def test_event_message_is_lazy():
+    calls = []
+    message = log.EventMessage("part_uploaded", {"bytes": lambda: calls.append(1) or 5})
+    assert not calls
+
+    assert str(message) == "part_uploaded bytes=5"
+    assert message.fields == {"bytes": 5}
+    assert calls == [1]
+
+
+def test_log_event_skips_disabled_levels(name):
+    calls = []
+    logger = log.get_logger(name)
+    log.log_event(logger, "retry", logging.DEBUG, offset=lambda: calls.append(1))
+    assert not calls
+
+
+def test_json_formatter():
+    formatter = log.JSONFormatter()
+
+    document = json.loads(formatter.format(make_event("retry", attempt=2)))
+    assert document.pop("timestamp") > 0
+    assert document == {
+        "event": "retry",
+        "attempt": 2,
+        "level": "INFO",
+        "logger": "test",
+    }
+
+    document = json.loads(formatter.format(make_record("plain")))
+    assert document["message"] == "plain"
+
+
+def test_sampling_filter():
+    now = [0.0]
+    sampling = log.SamplingFilter(
+        sample_every={"part_uploaded": 3},
+        min_interval={"retry": 10},
+        clock=lambda: now[0],
+    )
+
+    kept = [sampling.filter(make_event("part_uploaded")) for _ in range(7)]
+    assert kept == [True, False, False, True, False, False, True]
+    assert sampling.filter(make_record("not an event"))
+    assert sampling.filter(make_event("transfer_start"))
+
+    assert sampling.filter(make_event("retry"))
+    now[0] = 5
+    assert not sampling.filter(make_event("retry"))
+    assert not sampling.filter(make_event("retry"))
+    now[0] = 10
+    record = make_event("retry")
+    assert sampling.filter(record)
+    assert record.suppressed == 2
+
+
+@pytest.mark.parametrize("queued", [False, True])
+def test_structured_logging(name, capsys, queued):
+    logger = log.get_logger(name)
+    if queued:
+        log.start_queue_logging()
+    log.configure_logging(structured=True, sample_every={"part_uploaded": 2})
+
+    logger.info("plain %d", 1)
+    for part_number in range(1, 5):
+        log.log_event(logger, "part_uploaded", part_number=part_number)
+    log.stop_queue_logging()
+
+    documents = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert documents[0]["message"] == "plain 1"
+    assert [(doc["event"], doc["part_number"]) for doc in documents[1:]] == [
+        ("part_uploaded", 1),
+        ("part_uploaded", 3),
+    ]
+    assert {doc["sample_every"] for doc in documents[1:]} == {2}
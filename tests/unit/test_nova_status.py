@@ -0,0 +1,286 @@
+import importlib.util
+import os
+import threading
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+exceptions = pytest.importorskip("novaclient.exceptions")
+
+SCRIPT = os.path.join(os.path.dirname(__file__), "..", "..", "bin", "nova_status.py")
+
+
+@pytest.fixture(scope="module")
+def nova_status():
+    spec = importlib.util.spec_from_file_location("nova_status", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_flavor(flavor_id, vcpus, ram, disk):
+    return SimpleNamespace(
+        id=flavor_id, name=f"m1.{flavor_id}", vcpus=vcpus, ram=ram, disk=disk
+    )
+
+
+def make_server(name, zone, host, flavor_id):
+    return SimpleNamespace(
+        human_id=name,
+        flavor={"id": flavor_id},
+        **{"OS-EXT-AZ:availability_zone": zone, "OS-EXT-SRV-ATTR:host": host},
+    )
+
+
+def make_host(cpu, memory_mb, disk_gb, used_cpu, used_memory_mb, used_disk_gb):
+    return [
+        SimpleNamespace(cpu=cpu, memory_mb=memory_mb, disk_gb=disk_gb),
+        SimpleNamespace(cpu=used_cpu, memory_mb=used_memory_mb, disk_gb=used_disk_gb),
+    ]
+
+
+class StubManager:
+    def __init__(self, nova, name, items, unlisted=()):
+        self.nova = nova
+        self.name = name
+        self.items = items
+        self.unlisted = unlisted
+
+    def list(self, **kwargs):
+        self.nova.calls[self.name + ".list"] += 1
+        return [item for key, item in self.items.items() if key not in self.unlisted]
+
+    def get(self, key):
+        self.nova.calls[self.name + ".get"] += 1
+        if self.nova.barrier and self.name == "hosts":
+            self.nova.barrier.wait()
+        if key not in self.items:
+            raise exceptions.NotFound(404)
+        return self.items[key]
+
+
+class StubNova:
+    """Just enough of a novaclient Client for nova_status"""
+
+    def __init__(self, flavors, servers, hosts, zones, hidden_flavors=(), barrier=None):
+        self.calls = Counter()
+        self.barrier = barrier
+        self.flavors = StubManager(
+            self, "flavors", {f.id: f for f in flavors}, unlisted=hidden_flavors
+        )
+        self.servers = StubManager(self, "servers", {s.human_id: s for s in servers})
+        self.hosts = StubManager(self, "hosts", hosts)
+        self.availability_zones = StubManager(
+            self,
+            "availability_zones",
+            {
+                name: SimpleNamespace(zoneName=name, hosts=host_names)
+                for name, host_names in zones.items()
+            },
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def make_nova(**kwargs):
+    flavors = [make_flavor("small", 2, 4000, 20), make_flavor("large", 16, 64000, 200)]
+    servers = [
+        make_server("web-1", "compute_1", "host-a", "small"),
+        make_server("web-2", "compute_1", "host-a", "small"),
+        make_server("db-1", "compute_1", "host-b", "large"),
+    ]
+    hosts = {
+        "host-a": make_host(32, 128000, 1000, 4, 8000, 40),
+        "host-b": make_host(32, 128000, 1000, 24, 96000, 900),
+    }
+    zones = {"compute_1": ["host-a", "host-b", "host-gone"], "compute_2": []}
+    return StubNova(flavors, servers, hosts, zones, **kwargs)
+
+
+URL = "https://api-gdc-av1.example.org/v2.0/"
+
+
+def test_parse_availability_zone(nova_status):
+    nova = make_nova()
+    options = {"flavor": None}
+
+    zones = nova_status.parse_availability_zone(URL, options, nova=nova)
+
+    assert list(zones) == ["compute_1", "compute_2"]
+    assert list(zones["compute_1"]) == ["host-a", "host-b"]
+    host_a = zones["compute_1"]["host-a"]
+    assert host_a.total_cores == 32
+    assert host_a.used_ram == 8
+    assert [service.name for service in host_a.services] == ["web-1", "web-2"]
+    assert host_a.services[0].flavor.vcpus == 2
+    assert zones["compute_2"] == {}
+
+    # one list call for all the flavors, one call per host
+    assert nova.calls == {
+        "flavors.list": 1,
+        "servers.list": 1,
+        "availability_zones.list": 1,
+        "hosts.get": 3,
+    }
+
+
+def test_flavor_not_listed_is_fetched_once(nova_status):
+    nova = make_nova(hidden_flavors={"small"})
+
+    server_info = nova_status.parse_server_info(URL, nova, {})
+
+    assert [s.flavor.id for s in server_info["compute_1"]["host-a"]] == [
+        "small",
+        "small",
+    ]
+    assert nova.calls["flavors.get"] == 1
+
+
+@pytest.mark.parametrize(
+    "flavor, expected",
+    [("small", ["host-a", "host-b"]), ("large", ["host-a"]), ("missing", [])],
+)
+def test_flavor_fits(nova_status, flavor, expected):
+    nova = make_nova()
+
+    zones = nova_status.parse_availability_zone(URL, {"flavor": flavor}, nova=nova)
+
+    assert list(zones["compute_1"]) == expected
+    assert zones["compute_2"] == {}
+    assert nova.calls["flavors.get"] == (1 if flavor == "missing" else 0)
+
+
+def test_hosts_fetched_concurrently(nova_status):
+    # every hosts.get waits until all three are in flight
+    nova = make_nova(barrier=threading.Barrier(3, timeout=5))
+
+    zones = nova_status.parse_availability_zone(URL, {"workers": 3}, nova=nova)
+
+    assert list(zones["compute_1"]) == ["host-a", "host-b"]
+
+
+def test_availability_zones_queried_in_parallel(nova_status, monkeypatch):
+    # servers.list of each zone waits for the other's
+    barrier = threading.Barrier(2, timeout=5)
+    novas = {}
+
+    def list_servers():
+        barrier.wait()
+        return []
+
+    def get_client(url):
+        novas[url] = make_nova()
+        novas[url].servers.list = list_servers
+        return novas[url]
+
+    monkeypatch.setattr(nova_status, "get_client", get_client)
+    urls = [URL, URL.replace("av1", "av2")]
+
+    zones = nova_status.parse_availability_zones(urls, {})
+
+    assert list(zones) == ["av1", "av2"]
+    assert set(novas) == set(urls)
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["--load", "old.json", "--flavor-fits", "small"],
+        ["--save", "new.json", "--flavor-fits", "small"],
+        ["--save", "new.json", "--region", "compute_1"],
+    ],
+)
+def test_parse_cmd_args_rejects_filtered_snapshots(nova_status, monkeypatch, argv):
+    monkeypatch.setattr("sys.argv", ["nova_status.py"] + argv)
+    with pytest.raises(SystemExit):
+        nova_status.parse_cmd_args()
+
+
+def test_parse_cmd_args_snapshot(nova_status, monkeypatch):
+    argv = ["nova_status.py", "--save", "new.json", "--diff", "old.json"]
+    monkeypatch.setattr("sys.argv", argv)
+    args = nova_status.parse_cmd_args()
+    assert (args.save, args.diff) == ("new.json", "old.json")
+
+    # only filters what's printed
+    argv = ["nova_status.py", "--load", "new.json", "--region", "compute_1"]
+    monkeypatch.setattr("sys.argv", argv)
+    assert nova_status.parse_cmd_args().region == "compute_1"
+
+
+def test_fix_av_url(nova_status, monkeypatch):
+    monkeypatch.setenv("OS_AUTH_URL", "https://api-gdc-av1.example.org/v2.0")
+    assert nova_status.fix_av_url(2) == "https://api-gdc-av2.example.org/v2.0/"
+
+
+@pytest.mark.parametrize("name", ["snapshot.json", "snapshot.json.gz"])
+def test_snapshot_round_trip(nova_status, tmp_path, name):
+    zones = {"av1": nova_status.parse_availability_zone(URL, {}, nova=make_nova())}
+    path = str(tmp_path / name)
+
+    nova_status.save_snapshot(path, zones)
+    loaded = nova_status.load_snapshot(path)
+
+    assert nova_status.diff_snapshots(zones, loaded) == []
+    for region, hosts in zones["av1"].items():
+        for host_name, host in hosts.items():
+            assert loaded["av1"][region][host_name][:-1] == host[:-1]
+    service = loaded["av1"]["compute_1"]["host-b"].services[0]
+    assert service == nova_status.Service(
+        "db-1", nova_status.Flavor("large", "m1.large", 16, 64000, 200)
+    )
+
+
+def test_load_snapshot_version(nova_status, tmp_path):
+    path = tmp_path / "snapshot.json"
+    path.write_text('{"version": 0}')
+    with pytest.raises(ValueError):
+        nova_status.load_snapshot(str(path))
+
+
+def test_diff_snapshots(nova_status):
+    old = {"av1": nova_status.parse_availability_zone(URL, {}, nova=make_nova())}
+    new = {"av1": nova_status.parse_availability_zone(URL, {}, nova=make_nova())}
+    assert nova_status.diff_snapshots(old, new) == []
+
+    hosts = new["av1"]["compute_1"]
+    flavor = hosts["host-a"].services[0].flavor
+    hosts["host-a"] = hosts["host-a"]._replace(
+        used_cores=6,
+        services=hosts["host-a"].services[1:] + [nova_status.Service("web-3", flavor)],
+    )
+    del hosts["host-b"]
+    new["av1"]["compute_2"] = {"host-c": hosts["host-a"]}
+
+    changes = nova_status.diff_snapshots(old, new)
+
+    assert [(c.region, c.host, c.status) for c in changes] == [
+        ("compute_1", "host-a", "changed"),
+        ("compute_1", "host-b", "removed"),
+        ("compute_2", "host-c", "added"),
+    ]
+    assert changes[0].resources == {"cores": ((4, 32), (6, 32))}
+    assert (changes[0].added, changes[0].removed) == (["web-3"], ["web-1"])
+    assert changes[1].removed == ["db-1"]
+
+
+def test_print_reports(nova_status, capsys):
+    zones = {"av1": nova_status.parse_availability_zone(URL, {}, nova=make_nova())}
+    options = {option: True for option in nova_status.OUTPUT_TYPES}
+    options["services"] = True
+
+    nova_status.print_availability_zones(zones, options)
+    report = capsys.readouterr().out
+    assert "Region: compute_1" in report
+    assert "web-1, web-2" in report
+
+    changed = {"av1": {"compute_1": {}}}
+    nova_status.print_diff(nova_status.diff_snapshots(zones, changed), options)
+    report = capsys.readouterr().out
+    assert "host-a    : removed" in report
+    assert "- web-1, web-2" in report